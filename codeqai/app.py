@@ -1,6 +1,9 @@
 import argparse
+import functools
+import json
 import os
 import subprocess
+import sys
 import warnings
 
 import click
@@ -8,17 +11,24 @@ from dotenv import dotenv_values, load_dotenv
 from rich.console import Console
 from rich.markdown import Markdown
 from rich.syntax import Syntax
-from streamlit.web import cli as stcli
 from yaspin import yaspin
 
-from codeqai import codeparser, repo, utils
-from codeqai.bootstrap import bootstrap
-from codeqai.cache import create_cache_dir, get_cache_path, save_vector_cache
+from codeqai import repo, utils
+from codeqai.cache import (
+    append_vector_cache,
+    create_cache_dir,
+    save_sync_state,
+    save_vector_cache,
+)
 from codeqai.config import create_config, get_config_path, load_config
 from codeqai.constants import DistillationMode, EmbeddingsModel, LlmHost
-from codeqai.dataset_extractor import DatasetExtractor
-from codeqai.embeddings import Embeddings
-from codeqai.vector_store import VectorStore
+from codeqai.server import connect_server
+
+# langchain, the embeddings and LLM providers, FAISS and streamlit are imported by the actions that use them,
+# so e.g. configure or a search answered by a running server do not pay for them, see tests/startup_test.py
+
+# number of queries of a file that are searched at once, results are printed after each batch
+QUERY_BATCH_SIZE = 64
 
 
 def env_loader(env_path, required_keys=None):
@@ -65,6 +75,35 @@ def env_loader(env_path, required_keys=None):
     load_dotenv(env_path, override=True)
 
 
+def print_embeddings_throughput(embeddings_model):
+    """
+    Prints the throughput of local embeddings models, to tune their workers and threads.
+
+    Args:
+        embeddings_model (Embeddings): The embeddings model.
+    """
+    chunks = getattr(embeddings_model.engine, "chunks", 0)
+    if chunks:
+        print(
+            f"Embedded {chunks} chunks at {embeddings_model.engine.chunks_per_second:.1f} chunks/sec."
+        )
+
+
+def print_vector_recall(vector_store):
+    """
+    Prints the recall of a newly built index with quantized vectors against the full precision vectors.
+
+    Args:
+        vector_store (VectorStore): The vector store.
+    """
+    if vector_store.recall:
+        print(
+            f"Recall@{vector_store.recall['k']} of {vector_store.vector_storage} vectors: "
+            + f"{vector_store.recall['recall']:.3f} with re-scoring, "
+            + f"{vector_store.recall['recall_without_rescoring']:.3f} without."
+        )
+
+
 def run():
     if not subprocess.run(
         ["git", "rev-parse", "--is-inside-work-tree"], capture_output=True
@@ -82,11 +121,39 @@ def run():
             "chat",
             "configure",
             "sync",
+            "compact",
+            "serve",
             "dataset",
         ],
         help="Action to perform. 'app' to start the streamlit app, 'search' to search the codebase, "
         + "'chat' to chat with the model, 'configure' to start config wizard, "
-        + "'sync' to sync the vector store with the current git checkout, 'dataset' to export a dataset for model distillation.",
+        + "'sync' to sync the vector store with the current git checkout, 'compact' to merge the segments of the vector store, "
+        + "'serve' to keep the vector store and models loaded for fast searches and chats of other codeqai processes, "
+        + "'dataset' to export a dataset for model distillation.",
+    )
+    parser.add_argument(
+        "query",
+        nargs="?",
+        default=None,
+        help="Search pattern of 'search' or question of 'chat' to answer and exit, instead of prompting for input.",
+    )
+    parser.add_argument(
+        "--queries",
+        type=str,
+        default=None,
+        help="File with one search pattern or question per line, or '-' to read them from stdin. "
+        + "All of them are answered in one process, then codeqai exits.",
+    )
+    parser.add_argument(
+        "--k",
+        type=int,
+        default=4,
+        help="Number of results per search. Default is 4.",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print the results of 'search' and 'chat' as JSON, one line per query.",
     )
     parser.add_argument(
         "--distillation",
@@ -110,8 +177,29 @@ def run():
         default=1024,
         help="Token limit per code block for distillation dataset extraction. Default is 1024.",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes used to parse the codebase. Default is the number of CPUs.",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=0,
+        help="Port of the server started by 'serve'. Default is a free port.",
+    )
     args = parser.parse_args()
 
+    # checked before reading the queries, so stdin is not consumed by a command that fails
+    if (args.query or args.queries) and args.action not in ["search", "chat"]:
+        parser.error("a query is only supported by 'search' and 'chat'")
+    queries = read_queries(args.query, args.queries)
+    # stdout is reserved for the results, so scripts can parse them, and everything else is printed to stderr
+    output = sys.stdout
+    if args.json:
+        sys.stdout = sys.stderr
+
     if args.action == "configure":
         create_config()
         exit()
@@ -154,6 +242,18 @@ def run():
     # init cache
     create_cache_dir()
 
+    # a running server has everything loaded already, this process only forwards the requests
+    if args.action in ["search", "chat"]:
+        client = connect_server(repo_name)
+        if client is not None:
+            if queries:
+                run_queries(args.action, client, queries, args.k, args.json, output)
+            else:
+                run_interactive(args.action, client, args.k)
+            exit()
+
+    from codeqai.embeddings import EMBEDDINGS_MAX_CONCURRENCY, Embeddings
+
     embeddings_model = Embeddings(
         model=EmbeddingsModel[config["embeddings"].upper().replace("-", "_")],
         deployment=(
@@ -161,9 +261,17 @@ def run():
             if "embeddings-deployment" in config
             else None
         ),
+        max_concurrency=config.get(
+            "embeddings-concurrency", EMBEDDINGS_MAX_CONCURRENCY
+        ),
+        workers=config.get("embeddings-workers", 1),
+        torch_threads=config.get("embeddings-torch-threads"),
     )
 
     if args.action == "dataset":
+        from codeqai import codeparser
+        from codeqai.dataset_extractor import DatasetExtractor
+
         print(args.distillation)
         spinner = yaspin(
             text=f"Parsing codebase for {args.format} dataset export...",
@@ -171,9 +279,13 @@ def run():
         )
         spinner.start()
         repo_name = repo.repo_name()
-        files = repo.load_files()
+        repo_files = repo.plan_files()
         documents = codeparser.parse_code_files_for_finetuning(
-            files, args.max_tokens, spinner
+            [repo_file.path for repo_file in repo_files],
+            args.max_tokens,
+            spinner,
+            workers=args.workers,
+            file_sizes={repo_file.path: repo_file.size for repo_file in repo_files},
         )
         dateset_extractor = DatasetExtractor(
             args.format,
@@ -185,30 +297,64 @@ def run():
         dateset_extractor.export()
         exit()
 
-    # check if faiss.index exists
-    if not os.path.exists(os.path.join(get_cache_path(), f"{repo_name}.faiss.bytes")):
+    from codeqai.index_store import index_exists
+
+    # check if the faiss index exists
+    if not index_exists(repo_name):
+        from codeqai import codeparser
+        from codeqai.vector_store import VectorStore
+
         print(
             f"No vector store found for {utils.get_bold_text(repo_name)}. Initial indexing may take a few minutes."
         )
-        spinner = yaspin(text="🔧 Parsing codebase...", color="green")
+        spinner = yaspin(text="🔧 Parsing and indexing codebase...", color="green")
         spinner.start()
-        files = repo.load_files()
-        documents = codeparser.parse_code_files_for_db(files)
-        spinner.stop()
-        spinner = yaspin(text="💾 Indexing vector store...", color="green")
+        repo_files = repo.plan_files()
+        # documents are parsed lazily and embedded in batches while parsing continues
+        documents = codeparser.iter_code_files_for_db(
+            [repo_file.path for repo_file in repo_files],
+            workers=args.workers,
+            file_sizes={repo_file.path: repo_file.size for repo_file in repo_files},
+        )
         vector_store = VectorStore(
             repo_name,
             embeddings=embeddings_model.embeddings,
+            index_type=config.get("vector-index", "auto"),
+            vector_storage=config.get("vector-storage", "float32"),
         )
-        spinner.start()
         vector_store.index_documents(documents)
         save_vector_cache(vector_store.vector_cache, f"{repo_name}.json")
+        save_sync_state(vector_store.sync_state, f"{repo_name}.sync.json")
         spinner.stop()
+        # the worker processes of local embeddings models are idle until the next indexing
+        embeddings_model.close()
+        print_embeddings_throughput(embeddings_model)
+        print_vector_recall(vector_store)
 
     if args.action == "app":
         print("Starting CodeQAI streamlit app...")
         run_streamlit()
+    elif args.action == "serve":
+        from codeqai.bootstrap import create_llm, create_qa_chain, load_vector_store
+        from codeqai.server import CodeQAIServer
+
+        spinner = yaspin(text="💾 Loading vector store...", color="green")
+        spinner.start()
+        vector_store = load_vector_store(config, repo_name, embeddings_model)
+        server = CodeQAIServer(
+            repo_name,
+            vector_store,
+            functools.partial(create_qa_chain, create_llm(config)),
+        )
+        spinner.stop()
+        try:
+            server.serve(args.port)
+        finally:
+            embeddings_model.close()
     else:
+        from codeqai.bootstrap import bootstrap
+        from codeqai.server import LocalSession
+
         spinner = yaspin(text="💾 Loading vector store...", color="green")
         spinner.start()
         vector_store, memory, qa = bootstrap(config, repo_name, embeddings_model)
@@ -217,76 +363,223 @@ def run():
         if args.action == "sync":
             spinner = yaspin(text="💾 Syncing vector store...", color="green")
             spinner.start()
-            files = repo.load_files()
-            vector_store.sync_documents(files)
-            save_vector_cache(vector_store.vector_cache, f"{repo_name}.json")
+            vector_store.sync()
+            append_vector_cache(
+                vector_store.vector_cache,
+                vector_store.changed_paths,
+                f"{repo_name}.json",
+            )
+            save_sync_state(vector_store.sync_state, f"{repo_name}.sync.json")
             spinner.stop()
+            embeddings_model.close()
+            print_embeddings_throughput(embeddings_model)
+            print_vector_recall(vector_store)
             print("✅ Vector store synced with current git checkout.")
 
-        console = Console()
-        while True:
-            choice = None
-            if args.action == "sync":
-                break
-            if args.action == "search":
-                search_pattern = input("🔎 Enter a search pattern: ")
-                spinner = yaspin(text="🤖 Processing...", color="green")
-                spinner.start()
-                similarity_result = vector_store.similarity_search(search_pattern)
-                spinner.stop()
-                for doc in similarity_result:
-                    language = utils.get_programming_language(
-                        utils.get_file_extension(doc.metadata["filename"])
-                    )
-
-                    start_line, indentation = utils.find_starting_line_and_indent(
-                        doc.metadata["filename"], doc.page_content
-                    )
-
-                    syntax = Syntax(
-                        indentation + doc.page_content,
-                        language.value,
-                        theme="monokai",
-                        line_numbers=True,
-                        start_line=start_line,
-                        indent_guides=True,
-                    )
-                    print(
-                        doc.metadata["filename"] + " -> " + doc.metadata["method_name"]
-                    )
-                    console.print(syntax)
-                    print()
-
-                choice = input("[?] (C)ontinue search or (E)xit [C]:").strip().lower()
-
-            elif args.action == "chat":
-                question = input("💬 Ask anything about the codebase: ")
-                spinner = yaspin(text="🤖 Processing...", color="green")
-                spinner.start()
-                result = qa(question)
-                spinner.stop()
-                markdown = Markdown(result["answer"])
-                console.print(markdown)
-
-                choice = (
-                    input("[?] (C)ontinue chat, (R)eset chat or (E)xit [C]:")
-                    .strip()
-                    .lower()
-                )
+        if args.action == "compact":
+            spinner = yaspin(text="💾 Compacting vector store...", color="green")
+            spinner.start()
+            vector_store.compact()
+            save_vector_cache(vector_store.vector_cache, f"{repo_name}.json")
+            spinner.stop()
+            print_vector_recall(vector_store)
+            print("✅ Vector store compacted.")
 
-                if choice == "r":
-                    memory.clear()
-                    print("Chat history cleared.")
+        if args.action in ["search", "chat"]:
+            session = LocalSession(vector_store, memory, qa)
+            if queries:
+                run_queries(args.action, session, queries, args.k, args.json, output)
             else:
-                print("Invalid action.")
-                exit()
+                run_interactive(args.action, session, args.k)
+
+
+def read_queries(query, queries_path) -> list[str]:
+    """
+    Collects the queries to answer without prompting for input.
+
+    Args:
+        query (str or None): The query given on the command line.
+        queries_path (str or None): The path of a file with one query per line, or "-" for stdin.
+
+    Returns:
+        list[str]: The queries, without blank lines.
+    """
+    queries = [query] if query else []
+    if queries_path == "-":
+        queries.extend(sys.stdin)
+    elif queries_path:
+        with open(queries_path, "r", encoding="utf-8") as file:
+            queries.extend(file)
+    return [query.strip() for query in queries if query.strip()]
+
+
+def get_search_result(doc, file_path, score) -> dict:
+    """
+    Converts a search result into a JSON serializable dict.
+
+    Args:
+        doc (Document): The found document.
+        file_path (str or None): The full path of the file of the document.
+        score (float): The distance of the vector of the document to the query, lower is more similar.
+
+    Returns:
+        dict: The path, method name, line range, score and content of the found document.
+    """
+    start_line, _ = utils.find_starting_line_and_indent(
+        file_path, doc.page_content, doc.metadata
+    )
+    return {
+        "path": doc.metadata.get("path", doc.metadata["filename"]),
+        "method_name": doc.metadata["method_name"],
+        "start_line": start_line,
+        "end_line": doc.metadata.get(
+            "end_line", start_line + doc.page_content.count("\n")
+        ),
+        "score": score,
+        "content": doc.page_content,
+    }
+
+
+def print_search_results(console, similarity_result):
+    """
+    Prints the found documents with syntax highlighting.
+
+    Args:
+        console (Console): The rich console to print the code to.
+        similarity_result (list): The found documents, the full paths of their files and their scores.
+    """
+    for doc, file_path, _ in similarity_result:
+        language = utils.get_programming_language(
+            utils.get_file_extension(doc.metadata["filename"])
+        )
+
+        start_line, indentation = utils.find_starting_line_and_indent(
+            file_path, doc.page_content, doc.metadata
+        )
 
-            if choice == "" or choice == "c":
-                continue
-            elif choice == "e":
-                break
+        syntax = Syntax(
+            indentation + doc.page_content,
+            language.value,
+            theme="monokai",
+            line_numbers=True,
+            start_line=start_line,
+            indent_guides=True,
+        )
+        print(
+            doc.metadata.get("path", doc.metadata["filename"])
+            + " -> "
+            + doc.metadata["method_name"]
+        )
+        console.print(syntax)
+        print()
+
+
+def run_queries(action, session, queries, k=4, output_json=False, output=None):
+    """
+    Answers the given search patterns or questions one after another without prompting for input.
+
+    All queries are answered by the same session, so the vector store and models are only loaded once,
+    and search patterns are searched in batches of QUERY_BATCH_SIZE, see VectorStore.similarity_search_batch.
+    Questions are answered independently of each other, i.e. without the chat history of previous questions.
+
+    Args:
+        action (str): Either "search" or "chat".
+        session (LocalSession or ServerClient): Answers the searches and questions, either in this process
+            or by a running server.
+        queries (list[str]): The search patterns or questions.
+        k (int, optional): The number of results per search. Defaults to 4.
+        output_json (bool, optional): Whether to print one JSON object per query instead of formatted results.
+            Defaults to False.
+        output (TextIO, optional): The stream to print JSON results to. Defaults to stdout.
+    """
+    output = output or sys.stdout
+    console = Console()
+    search_results = []
+    for i, query in enumerate(queries):
+        if action == "search":
+            if not search_results:
+                search_results = session.search_batch(
+                    queries[i : i + QUERY_BATCH_SIZE], k=k
+                )
+            similarity_result = search_results.pop(0)
+            if output_json:
+                result = {
+                    "query": query,
+                    "results": [
+                        get_search_result(doc, file_path, score)
+                        for doc, file_path, score in similarity_result
+                    ],
+                }
+            else:
+                if len(queries) > 1:
+                    print(f"🔎 {query}")
+                print_search_results(console, similarity_result)
+        else:
+            if i > 0:
+                session.reset_chat()
+            answer = session.chat(query)
+            if output_json:
+                result = {"question": query, "answer": answer}
             else:
-                print("Invalid choice. Please enter 'C', 'E', or 'R'.")
+                if len(queries) > 1:
+                    print(f"💬 {query}")
+                console.print(Markdown(answer))
+        if output_json:
+            # one line per query, flushed right away so callers can consume results while later queries run
+            print(json.dumps(result), file=output, flush=True)
+
+
+def run_interactive(action, session, k=4):
+    """
+    Runs the interactive search or chat loop.
+
+    Args:
+        action (str): Either "search" or "chat".
+        session (LocalSession or ServerClient): Answers the searches and questions, either in this process
+            or by a running server.
+        k (int, optional): The number of results per search. Defaults to 4.
+    """
+    console = Console()
+    while True:
+        choice = None
+        if action == "search":
+            search_pattern = input("🔎 Enter a search pattern: ")
+            spinner = yaspin(text="🤖 Processing...", color="green")
+            spinner.start()
+            similarity_result = session.search(search_pattern, k=k)
+            spinner.stop()
+            print_search_results(console, similarity_result)
+
+            choice = input("[?] (C)ontinue search or (E)xit [C]:").strip().lower()
+
+        elif action == "chat":
+            question = input("💬 Ask anything about the codebase: ")
+            spinner = yaspin(text="🤖 Processing...", color="green")
+            spinner.start()
+            answer = session.chat(question)
+            spinner.stop()
+            markdown = Markdown(answer)
+            console.print(markdown)
+
+            choice = (
+                input("[?] (C)ontinue chat, (R)eset chat or (E)xit [C]:")
+                .strip()
+                .lower()
+            )
+
+            if choice == "r":
+                session.reset_chat()
+                print("Chat history cleared.")
+        else:
+            print("Invalid action.")
+            exit()
+
+        if choice == "" or choice == "c":
+            continue
+        elif choice == "e":
+            break
+        else:
+            print("Invalid choice. Please enter 'C', 'E', or 'R'.")
 
 
 @click.group()
@@ -296,6 +589,8 @@ def run_streamlit():
 
 @run_streamlit.command("app")
 def main_streamlit():
+    from streamlit.web import cli as stcli
+
     dirname = os.path.dirname(__file__)
     filename = os.path.join(dirname, "streamlit.py")
     args = []
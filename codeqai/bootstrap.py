@@ -2,7 +2,8 @@ from langchain.chains import ConversationalRetrievalChain
 from langchain.memory import ConversationSummaryMemory
 
 from codeqai.constants import EmbeddingsModel, LlmHost
-from codeqai.embeddings import Embeddings
+from codeqai.embeddings import EMBEDDINGS_MAX_CONCURRENCY, Embeddings
+from codeqai.index_store import DEFAULT_EF_SEARCH, DEFAULT_NPROBE
 from codeqai.llm import LLM
 from codeqai.vector_store import VectorStore
 
@@ -19,6 +20,23 @@ def bootstrap(config, repo_name, embeddings_model=None):
     Returns:
         tuple: A tuple containing the vector store, memory, and QA chain.
     """
+    vector_store = load_vector_store(config, repo_name, embeddings_model)
+    memory, qa = create_qa_chain(create_llm(config), vector_store)
+    return vector_store, memory, qa
+
+
+def load_vector_store(config, repo_name, embeddings_model=None) -> VectorStore:
+    """
+    Loads the vector store of a repository with the embeddings model and index settings of the config.
+
+    Args:
+        config (dict): Configuration dictionary containing settings for embeddings and the vector index.
+        repo_name (str): The name of the repository.
+        embeddings_model (Embeddings, optional): Pre-initialized embeddings model. Defaults to None.
+
+    Returns:
+        VectorStore: The loaded vector store.
+    """
     if embeddings_model is None:
         embeddings_model = Embeddings(
             model=EmbeddingsModel[config["embeddings"].upper().replace("-", "_")],
@@ -27,21 +45,50 @@ def bootstrap(config, repo_name, embeddings_model=None):
                 if "embeddings-deployment" in config
                 else None
             ),
+            max_concurrency=config.get(
+                "embeddings-concurrency", EMBEDDINGS_MAX_CONCURRENCY
+            ),
+            workers=config.get("embeddings-workers", 1),
+            torch_threads=config.get("embeddings-torch-threads"),
         )
 
-    vector_store = VectorStore(repo_name, embeddings=embeddings_model.embeddings)
+    vector_store = VectorStore(
+        repo_name,
+        embeddings=embeddings_model.embeddings,
+        index_type=config.get("vector-index", "auto"),
+        vector_storage=config.get("vector-storage", "float32"),
+        nprobe=config.get("vector-index-nprobe", DEFAULT_NPROBE),
+        ef_search=config.get("vector-index-ef-search", DEFAULT_EF_SEARCH),
+    )
     vector_store.load_documents()
+    return vector_store
 
-    llm = LLM(
+
+def create_llm(config) -> LLM:
+    return LLM(
         llm_host=LlmHost[config["llm-host"].upper().replace("-", "_")],
         chat_model=config["chat-model"],
         deployment=config["model-deployment"] if "model-deployment" in config else None,
     )
-    memory = ConversationSummaryMemory(
-        llm=llm.chat_model, memory_key="chat_history", return_messages=True
-    )
+
+
+def create_qa_chain(llm: LLM, vector_store: VectorStore, memory=None):
+    """
+    Creates a conversational retrieval chain on the retriever of a vector store.
+
+    Args:
+        llm (LLM): The LLM to answer with.
+        vector_store (VectorStore): The loaded vector store.
+        memory (ConversationSummaryMemory, optional): The chat history to continue. Defaults to a new one.
+
+    Returns:
+        tuple: A tuple containing the memory and the QA chain.
+    """
+    if memory is None:
+        memory = ConversationSummaryMemory(
+            llm=llm.chat_model, memory_key="chat_history", return_messages=True
+        )
     qa = ConversationalRetrievalChain.from_llm(
         llm.chat_model, retriever=vector_store.retriever, memory=memory
     )
-
-    return vector_store, memory, qa
+    return memory, qa
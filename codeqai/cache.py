@@ -4,45 +4,96 @@ import platform
 from pathlib import Path
 from typing import Dict
 
+VECTOR_CACHE_VERSION = 2
+
 
 class VectorCache:
-    def __init__(self, filename, vector_ids, commit_hash):
+    def __init__(self, filename, vector_ids, commit_hash, blob_id="", path=None):
         self.filename = filename
         self.vector_ids = vector_ids
         self.commit_hash = commit_hash
+        self.blob_id = blob_id
+        self.path = path
 
     @classmethod
     def from_json(cls, json_data) -> "VectorCache":
         filename = json_data.get("filename")
         vector_ids = json_data.get("vector_ids", [])
         commit_hash = json_data.get("commit_hash", "")
-        return cls(filename, vector_ids, commit_hash)
+        blob_id = json_data.get("blob_id", "")
+        path = json_data.get("path")
+        return cls(filename, vector_ids, commit_hash, blob_id, path)
 
     def to_json(self):
         return {
             "filename": self.filename,
+            "path": self.path,
             "commit_hash": self.commit_hash,
+            "blob_id": self.blob_id,
             "vector_ids": self.vector_ids,
         }
 
 
+class SyncState:
+    def __init__(self, revision, dirty_files):
+        self.revision = revision
+        self.dirty_files = dirty_files
+
+    @classmethod
+    def from_json(cls, json_data) -> "SyncState":
+        revision = json_data.get("revision")
+        dirty_files = json_data.get("dirty_files", [])
+        return cls(revision, dirty_files)
+
+    def to_json(self):
+        return {
+            "revision": self.revision,
+            "dirty_files": self.dirty_files,
+        }
+
+
 def load_vector_cache(filename) -> Dict[str, VectorCache]:
     """
     Loads a vector cache from a JSON file.
 
+    Entries that were changed after the file was last written in full are replayed from its change log,
+    see append_vector_cache.
+    Caches written by earlier versions are keyed by file basename and contain entries without a path.
+    They are loaded as is and have to be migrated to repository relative paths by the caller.
+
     Args:
         filename (str): The name of the file containing the vector cache.
 
     Returns:
-        Dict[str, VectorCache]: A dictionary where the keys are strings and the values are VectorCache objects.
+        Dict[str, VectorCache]: A dictionary where the keys are repository relative file paths
+                                (or file basenames for legacy entries) and the values are VectorCache objects.
     """
     with open(
         get_cache_path() + "/" + filename, "r", encoding="utf-8"
     ) as vector_cache_file:
         vector_cache_json = json.load(vector_cache_file)
+    if vector_cache_json.get("version") == VECTOR_CACHE_VERSION:
+        vector_cache_json = vector_cache_json["files"]
     vector_cache = {}
     for key, value in vector_cache_json.items():
         vector_cache[key] = VectorCache.from_json(value)
+
+    try:
+        with open(
+            get_cache_path() + "/" + filename + ".log", "r", encoding="utf-8"
+        ) as log_file:
+            for line in log_file:
+                try:
+                    change = json.loads(line)
+                except json.JSONDecodeError:
+                    # a line of an interrupted append
+                    continue
+                if change["entry"] is None:
+                    vector_cache.pop(change["key"], None)
+                else:
+                    vector_cache[change["key"]] = VectorCache.from_json(change["entry"])
+    except FileNotFoundError:
+        pass
     return vector_cache
 
 
@@ -51,13 +102,93 @@ def save_vector_cache(vector_cache, filename):
     Saves a vector cache to a JSON file.
 
     Args:
-        vector_cache (Dict[str, VectorCache]): A dictionary where the keys are strings and the values are VectorCache objects.
+        vector_cache (Dict[str, VectorCache]): A dictionary where the keys are repository relative file paths
+                                               and the values are VectorCache objects.
         filename (str): The name of the file to save the vector cache to.
     """
+    path = get_cache_path() + "/" + filename
+    with open(path + ".tmp", "w", encoding="utf-8") as vector_cache_file:
+        json.dump(
+            {"version": VECTOR_CACHE_VERSION, "files": vector_cache},
+            default=VectorCache.to_json,
+            fp=vector_cache_file,
+        )
+    os.replace(path + ".tmp", path)
+    # the change log is contained in the file now
+    if os.path.exists(path + ".log"):
+        os.remove(path + ".log")
+
+
+def append_vector_cache(vector_cache, keys, filename):
+    """
+    Saves the changed entries of a vector cache by appending them to the change log of its JSON file,
+    so the cost of saving is proportional to the change.
+
+    Once the change log grows larger than the JSON file, the vector cache is written in full instead.
+
+    Args:
+        vector_cache (Dict[str, VectorCache]): A dictionary where the keys are repository relative file paths
+                                               and the values are VectorCache objects.
+        keys (Iterable[str]): The keys of the changed entries, including removed ones.
+        filename (str): The name of the file the vector cache has been saved to.
+    """
+    path = get_cache_path() + "/" + filename
+    lines = [
+        json.dumps(
+            {
+                "key": key,
+                "entry": vector_cache[key].to_json() if key in vector_cache else None,
+            }
+        )
+        + "\n"
+        for key in keys
+    ]
+    if not lines:
+        return
+    log_size = os.path.getsize(path + ".log") if os.path.exists(path + ".log") else 0
+    if log_size + sum(map(len, lines)) > os.path.getsize(path):
+        save_vector_cache(vector_cache, filename)
+        return
+    with open(path + ".log", "a+b") as log_file:
+        if log_size:
+            log_file.seek(-1, os.SEEK_END)
+            # terminate the line of an interrupted append, so it is skipped when loading
+            if log_file.read(1) != b"\n":
+                log_file.write(b"\n")
+        log_file.write("".join(lines).encode("utf-8"))
+
+
+def load_sync_state(filename) -> "SyncState | None":
+    """
+    Loads the sync state, i.e. the git revision the vector store was last built or synced from, from a JSON file.
+
+    Args:
+        filename (str): The name of the file containing the sync state.
+
+    Returns:
+        SyncState or None: The sync state, or None if no sync state has been saved yet.
+    """
+    try:
+        with open(
+            get_cache_path() + "/" + filename, "r", encoding="utf-8"
+        ) as sync_state_file:
+            return SyncState.from_json(json.load(sync_state_file))
+    except FileNotFoundError:
+        return None
+
+
+def save_sync_state(sync_state, filename):
+    """
+    Saves the sync state to a JSON file.
+
+    Args:
+        sync_state (SyncState): The sync state to save.
+        filename (str): The name of the file to save the sync state to.
+    """
     with open(
         get_cache_path() + "/" + filename, "w", encoding="utf-8"
-    ) as vector_cache_file:
-        json.dump(vector_cache, default=VectorCache.to_json, fp=vector_cache_file)
+    ) as sync_state_file:
+        json.dump(sync_state.to_json(), fp=sync_state_file)
 
 
 def get_cache_path():
@@ -1,77 +1,236 @@
+import multiprocessing
 import os
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
 
 import inquirer
 from langchain.schema import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from yaspin import yaspin
 
 from codeqai import repo, utils
 from codeqai.constants import Language
 from codeqai.treesitter.treesitter import Treesitter, TreesitterMethodNode
+from codeqai.treesitter.treesitter_registry import TreesitterRegistry
 
+PARALLEL_MIN_FILES = 32
+PARALLEL_BATCH_BYTES = 1024 * 1024
+PARALLEL_PENDING_BATCHES = 2
 
-def parse_code_files_for_db(code_files: list[str]) -> list[Document]:
+
+def parse_code_files_for_db(
+    code_files: list[str],
+    commit_hashes: "dict[str, str] | None" = None,
+    blob_ids: "dict[str, str] | None" = None,
+    workers: "int | None" = None,
+    file_sizes: "dict[str, int] | None" = None,
+) -> list[Document]:
     """
     Parses a list of code files and returns a list of Document objects for database storage.
 
     Args:
         code_files (list[str]): List of paths to code files to be parsed.
+        commit_hashes (dict[str, str], optional): Precomputed mapping of file paths to their latest commit hash,
+            as returned by repo.get_commit_hashes. If None, the commit hashes are resolved in one batch.
+        blob_ids (dict[str, str], optional): Precomputed mapping of file paths to their content hash,
+            as returned by repo.get_blob_ids. If None, the content hashes are resolved in one batch.
+        workers (int, optional): Number of worker processes used for parsing. Defaults to the number of CPUs.
+        file_sizes (dict[str, int], optional): Mapping of file paths to their size in bytes, as planned by
+            repo.plan_files, used to schedule the files across the workers. Defaults to None.
 
     Returns:
-        list[Document]: List of Document objects containing parsed code information.
+        list[Document]: List of Document objects containing parsed code information,
+                        in the order of the given code files.
     """
+    tasks = _get_tasks_for_db(code_files, commit_hashes, blob_ids)
     documents = []
-    code_splitter = None
-    for code_file in code_files:
-        with open(code_file, "r", encoding="utf-8") as file:
-            file_bytes = file.read().encode()
-            commit_hash = repo.get_commit_hash(code_file)
+    for file_documents in _map_files(
+        _parse_file_for_db, tasks, code_files, workers, file_sizes
+    ):
+        documents.extend(file_documents)
+    return documents
 
-            file_extension = utils.get_file_extension(code_file)
-            programming_language = utils.get_programming_language(file_extension)
-            if programming_language == Language.UNKNOWN:
-                continue
 
-            langchain_language = utils.get_langchain_language(programming_language)
+def iter_code_files_for_db(
+    code_files: list[str],
+    commit_hashes: "dict[str, str] | None" = None,
+    blob_ids: "dict[str, str] | None" = None,
+    workers: "int | None" = None,
+    file_sizes: "dict[str, int] | None" = None,
+) -> Iterator[Document]:
+    """
+    Parses a list of code files and yields their Document objects for database storage as soon as they are parsed.
+
+    Unlike parse_code_files_for_db, the documents of the whole repository are never held in memory at once,
+    so they can be embedded and indexed while the remaining files are still being parsed.
+    The documents are yielded in a deterministic order, grouped by file. When the files are parsed by worker processes,
+    the largest files come first instead of the order of the given code files, see _iter_files.
 
-            if langchain_language:
-                code_splitter = RecursiveCharacterTextSplitter.from_language(
-                    language=langchain_language,
-                    chunk_size=512,
-                    chunk_overlap=128,
-                )
+    Args:
+        code_files (list[str]): List of paths to code files to be parsed.
+        commit_hashes (dict[str, str], optional): Precomputed mapping of file paths to their latest commit hash,
+            as returned by repo.get_commit_hashes. If None, the commit hashes are resolved in one batch.
+        blob_ids (dict[str, str], optional): Precomputed mapping of file paths to their content hash,
+            as returned by repo.get_blob_ids. If None, the content hashes are resolved in one batch.
+        workers (int, optional): Number of worker processes used for parsing. Defaults to the number of CPUs.
+        file_sizes (dict[str, int], optional): Mapping of file paths to their size in bytes, as planned by
+            repo.plan_files, used to schedule the files across the workers. Defaults to None.
+
+    Yields:
+        Document: Document objects containing parsed code information.
+    """
+    tasks = _get_tasks_for_db(code_files, commit_hashes, blob_ids)
+    for _, file_documents in _iter_files(
+        _parse_file_for_db, tasks, code_files, workers, file_sizes
+    ):
+        yield from file_documents
+
+
+def _get_tasks_for_db(
+    code_files: list[str],
+    commit_hashes: "dict[str, str] | None",
+    blob_ids: "dict[str, str] | None",
+) -> list[tuple]:
+    if commit_hashes is None:
+        commit_hashes = repo.get_commit_hashes(code_files)
+    if blob_ids is None:
+        blob_ids = repo.get_blob_ids(code_files)
+
+    relative_paths = repo.get_relative_paths(code_files)
+    return [
+        (
+            code_file,
+            relative_paths[code_file],
+            commit_hashes.get(code_file, ""),
+            blob_ids.get(code_file, ""),
+        )
+        for code_file in code_files
+    ]
+
+
+def _parse_file_for_db(
+    code_file: str, relative_path: str, commit_hash: str, blob_id: str
+) -> list[Document]:
+    """
+    Parses a single code file and returns its Document objects for database storage.
+
+    Args:
+        code_file (str): Path to the code file to be parsed.
+        relative_path (str): Repository relative path of the code file.
+        commit_hash (str): Latest commit hash of the code file.
+        blob_id (str): Content hash of the code file.
+
+    Returns:
+        list[Document]: List of Document objects containing parsed code information.
+    """
+    file_extension = utils.get_file_extension(code_file)
+    programming_language = utils.get_programming_language(file_extension)
+    if programming_language == Language.UNKNOWN:
+        return []
+
+    with open(code_file, "r", encoding="utf-8") as file:
+        file_bytes = file.read().encode()
+    file_lines = file_bytes.split(b"\n")
+
+    code_splitter = TreesitterRegistry.get_code_splitter(programming_language)
+
+    documents = []
+    treesitter_parser = Treesitter.get_treesitter(programming_language)
+    treesitterNodes: list[TreesitterMethodNode] = treesitter_parser.parse(file_bytes)
+    for node in treesitterNodes:
+        method_source_code = node.method_source_code
+        filename = os.path.basename(code_file)
 
-            treesitter_parser = Treesitter.create_treesitter(programming_language)
-            treesitterNodes: list[TreesitterMethodNode] = treesitter_parser.parse(
-                file_bytes
+        doc_comment_lines = 0
+        if node.doc_comment and programming_language != Language.PYTHON:
+            method_source_code = node.doc_comment + "\n" + method_source_code
+            doc_comment_lines = node.doc_comment.count("\n") + 1
+
+        splitted_documents = [method_source_code]
+        if code_splitter:
+            splitted_documents = code_splitter.split_text(method_source_code)
+
+        offset = 0
+        for splitted_document in splitted_documents:
+            # chunks are emitted in order, but may overlap with the previous one
+            chunk_offset = method_source_code.find(splitted_document, offset)
+            if chunk_offset == -1:
+                chunk_offset = offset
+            offset = chunk_offset + 1
+            start_line, end_line, indent = _get_chunk_location(
+                file_lines,
+                node,
+                method_source_code,
+                doc_comment_lines,
+                chunk_offset,
+                splitted_document,
+            )
+            document = Document(
+                page_content=splitted_document,
+                metadata={
+                    "filename": filename,
+                    "path": relative_path,
+                    "method_name": node.name,
+                    "start_line": start_line,
+                    "end_line": end_line,
+                    "indent": indent,
+                    "commit_hash": commit_hash,
+                    "blob_id": blob_id,
+                },
             )
-            for node in treesitterNodes:
-                method_source_code = node.method_source_code
-                filename = os.path.basename(code_file)
-
-                if node.doc_comment and programming_language != Language.PYTHON:
-                    method_source_code = node.doc_comment + "\n" + method_source_code
-
-                splitted_documents = [method_source_code]
-                if code_splitter:
-                    splitted_documents = code_splitter.split_text(method_source_code)
-
-                for splitted_document in splitted_documents:
-                    document = Document(
-                        page_content=splitted_document,
-                        metadata={
-                            "filename": filename,
-                            "method_name": node.name,
-                            "commit_hash": commit_hash,
-                        },
-                    )
-                    documents.append(document)
+            documents.append(document)
 
     return documents
 
 
+def _get_chunk_location(
+    file_lines: list[bytes],
+    node: TreesitterMethodNode,
+    method_source_code: str,
+    doc_comment_lines: int,
+    chunk_offset: int,
+    chunk: str,
+):
+    """
+    Computes the location of a chunk of a method within its file.
+
+    Args:
+        file_lines (list[bytes]): The lines of the file.
+        node (TreesitterMethodNode): The method node the chunk was split from.
+        method_source_code (str): The source code of the method, including a prepended doc comment.
+        doc_comment_lines (int): The number of lines of the doc comment prepended to the method source code.
+        chunk_offset (int): The offset of the chunk within the method source code.
+        chunk (str): The chunk.
+
+    Returns:
+        tuple: A tuple containing the starting line number (int), the ending line number (int) and the text
+               preceding the chunk on its starting line (str), i.e. its indentation.
+    """
+    start_row, start_column = node.node.start_point
+    first_row = start_row - doc_comment_lines
+    line_offset = method_source_code.count("\n", 0, chunk_offset)
+    indent = method_source_code[
+        method_source_code.rfind("\n", 0, chunk_offset) + 1 : chunk_offset
+    ]
+    if line_offset == 0 and 0 <= first_row < len(file_lines):
+        if doc_comment_lines:
+            line = file_lines[first_row].decode("utf-8", "replace")
+            indent = line[: len(line) - len(line.lstrip())] + indent
+        else:
+            indent = (
+                file_lines[start_row][:start_column].decode("utf-8", "replace") + indent
+            )
+
+    start_line = first_row + line_offset + 1
+    return start_line, start_line + chunk.count("\n"), indent
+
+
 def parse_code_files_for_finetuning(
-    code_files: list[str], max_tokens, spinner
+    code_files: list[str],
+    max_tokens,
+    spinner,
+    workers: "int | None" = None,
+    file_sizes: "dict[str, int] | None" = None,
 ) -> list[dict]:
     """
     Parses a list of code files for fine-tuning and returns a list of dictionaries containing method information.
@@ -79,6 +238,9 @@ def parse_code_files_for_finetuning(
     Args:
         code_files (list[str]): List of paths to code files to be parsed.
         max_tokens (int): Maximum number of tokens allowed for output.
+        workers (int, optional): Number of worker processes used for parsing. Defaults to the number of CPUs.
+        file_sizes (dict[str, int], optional): Mapping of file paths to their size in bytes, as planned by
+            repo.plan_files, used to schedule the files across the workers. Defaults to None.
 
     Returns:
         list[dict]: List of dictionaries containing method information, including method name, code, description, and language.
@@ -86,38 +248,16 @@ def parse_code_files_for_finetuning(
     input_tokens = 0
     output_tokens = 0
     documents = []
-    for code_file in code_files:
-        with open(code_file, "r", encoding="utf-8") as file:
-            file_bytes = file.read().encode()
-
-            file_extension = utils.get_file_extension(code_file)
-            programming_language = utils.get_programming_language(file_extension)
-            if programming_language == Language.UNKNOWN:
-                continue
-
-            treesitter_parser = Treesitter.create_treesitter(programming_language)
-            treesitterNodes: list[TreesitterMethodNode] = treesitter_parser.parse(
-                file_bytes
-            )
-            for node in treesitterNodes:
-                method_source_code = node.method_source_code
-
-                if node.doc_comment and programming_language == Language.PYTHON:
-                    method_source_code = method_source_code.replace(
-                        node.doc_comment, ""
-                    )
-
-                document = {
-                    "method_name": node.name,
-                    "code": method_source_code,
-                    "description": node.doc_comment,
-                    "language": programming_language.value,
-                }
-                documents.append(document)
+    tasks = [(code_file,) for code_file in code_files]
+    for file_documents in _map_files(
+        _parse_file_for_finetuning, tasks, code_files, workers, file_sizes
+    ):
+        for document in file_documents:
+            documents.append(document)
 
-                if node.doc_comment is not None:
-                    input_tokens += utils.count_tokens(node.doc_comment)
-                    output_tokens += max_tokens
+            if document["description"] is not None:
+                input_tokens += utils.count_tokens(document["description"])
+                output_tokens += max_tokens
 
     spinner.stop()
 
@@ -139,3 +279,145 @@ def parse_code_files_for_finetuning(
         exit()
 
     return documents
+
+
+def _parse_file_for_finetuning(code_file: str) -> list[dict]:
+    """
+    Parses a single code file for fine-tuning and returns a list of dictionaries containing method information.
+
+    Args:
+        code_file (str): Path to the code file to be parsed.
+
+    Returns:
+        list[dict]: List of dictionaries containing method information, including method name, code, description, and language.
+    """
+    file_extension = utils.get_file_extension(code_file)
+    programming_language = utils.get_programming_language(file_extension)
+    if programming_language == Language.UNKNOWN:
+        return []
+
+    with open(code_file, "r", encoding="utf-8") as file:
+        file_bytes = file.read().encode()
+
+    documents = []
+    treesitter_parser = Treesitter.get_treesitter(programming_language)
+    treesitterNodes: list[TreesitterMethodNode] = treesitter_parser.parse(file_bytes)
+    for node in treesitterNodes:
+        method_source_code = node.method_source_code
+
+        if node.doc_comment and programming_language == Language.PYTHON:
+            method_source_code = method_source_code.replace(node.doc_comment, "")
+
+        documents.append(
+            {
+                "method_name": node.name,
+                "code": method_source_code,
+                "description": node.doc_comment,
+                "language": programming_language.value,
+            }
+        )
+    return documents
+
+
+def _map_files(parse_function, tasks, code_files, workers, file_sizes):
+    """
+    Applies a parse function to every task, spreading the tasks across a pool of worker processes.
+
+    Args:
+        parse_function (Callable): Module level function parsing a single file.
+        tasks (list[tuple]): The arguments of the parse function for every file.
+        code_files (list[str]): The file path of every task.
+        workers (int or None): Number of worker processes. Defaults to the number of CPUs.
+        file_sizes (dict[str, int] or None): Mapping of file paths to their size in bytes.
+
+    Returns:
+        list: The results of the parse function, in the order of the tasks.
+    """
+    results = [None] * len(tasks)
+    for index, result in _iter_files(
+        parse_function, tasks, code_files, workers, file_sizes
+    ):
+        results[index] = result
+    return results
+
+
+def _iter_files(parse_function, tasks, code_files, workers, file_sizes):
+    """
+    Applies a parse function to every task and yields the results as they become available.
+
+    The files are scheduled largest first, so a single huge file starts early instead of stalling the tail,
+    while small files are grouped into batches to keep the per-task overhead low.
+    Only a bounded number of batches is submitted to the worker processes ahead of the consumer,
+    so results are never piling up in memory faster than they are consumed.
+    Small workloads are parsed in the current process.
+
+    Args:
+        parse_function (Callable): Module level function parsing a single file.
+        tasks (list[tuple]): The arguments of the parse function for every file.
+        code_files (list[str]): The file path of every task.
+        workers (int or None): Number of worker processes. Defaults to the number of CPUs.
+        file_sizes (dict[str, int] or None): Mapping of file paths to their size in bytes.
+
+    Yields:
+        tuple: The index of the task and the result of the parse function, in a deterministic schedule order.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(tasks) < PARALLEL_MIN_FILES:
+        for index, task in enumerate(tasks):
+            yield index, parse_function(*task)
+        return
+
+    sizes = []
+    for code_file in code_files:
+        if file_sizes and code_file in file_sizes:
+            sizes.append(file_sizes[code_file])
+        else:
+            try:
+                sizes.append(os.path.getsize(code_file))
+            except OSError:
+                sizes.append(0)
+
+    # aim for several batches per worker so the pool stays balanced towards the end
+    batch_bytes = min(PARALLEL_BATCH_BYTES, max(sum(sizes) // (workers * 4), 1))
+    batches = []
+    batch = []
+    batch_size = 0
+    for index in sorted(range(len(tasks)), key=lambda i: sizes[i], reverse=True):
+        batch.append(index)
+        batch_size += sizes[index]
+        if batch_size >= batch_bytes:
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+    if batch:
+        batches.append(batch)
+
+    workers = min(workers, len(batches))
+    # spawn, since forking a process with running threads, e.g. of the embeddings, may deadlock the workers
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append(
+                (
+                    batch,
+                    executor.submit(
+                        _parse_files,
+                        parse_function,
+                        [tasks[index] for index in batch],
+                    ),
+                )
+            )
+            if len(pending) < workers * PARALLEL_PENDING_BATCHES:
+                continue
+            batch, future = pending.popleft()
+            yield from zip(batch, future.result())
+        while pending:
+            batch, future = pending.popleft()
+            yield from zip(batch, future.result())
+
+
+def _parse_files(parse_function, tasks):
+    return [parse_function(*task) for task in tasks]
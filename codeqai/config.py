@@ -96,6 +96,8 @@ def create_config():
                     EmbeddingsModel.INSTRUCTOR_LARGE.value,
                     EmbeddingsModel.SENTENCETRANSFORMERS_ALL_MPNET_BASE_V2.value,
                     EmbeddingsModel.SENTENCETRANSFORMERS_ALL_MINILM_L6_V2.value,
+                    EmbeddingsModel.SENTENCETRANSFORMERS_ALL_MPNET_BASE_V2_ONNX.value,
+                    EmbeddingsModel.SENTENCETRANSFORMERS_ALL_MINILM_L6_V2_ONNX.value,
                 ],
                 default=EmbeddingsModel.INSTRUCTOR_LARGE.value,
             ),
@@ -23,6 +23,12 @@ class Language(Enum):
 class EmbeddingsModel(Enum):
     SENTENCETRANSFORMERS_ALL_MPNET_BASE_V2 = "SentenceTransformers-all-mpnet-base-v2"
     SENTENCETRANSFORMERS_ALL_MINILM_L6_V2 = "SentenceTransformers-all-MiniLM-L6-v2"
+    SENTENCETRANSFORMERS_ALL_MPNET_BASE_V2_ONNX = (
+        "SentenceTransformers-all-mpnet-base-v2-ONNX"
+    )
+    SENTENCETRANSFORMERS_ALL_MINILM_L6_V2_ONNX = (
+        "SentenceTransformers-all-MiniLM-L6-v2-ONNX"
+    )
     INSTRUCTOR_LARGE = "Instructor-Large"
     OPENAI_TEXT_EMBEDDING_ADA_002 = "OpenAI-text-embedding-ada-002"
     AZURE_OPENAI = "Azure-OpenAI"
@@ -0,0 +1,218 @@
+import json
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Union
+
+from langchain.schema import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    def __init__(self, path):
+        """
+        Opens a docstore that keeps the documents of a vector store in an SQLite table, creating it if it does not exist yet.
+
+        Documents are keyed by their docstore id and only read when they are searched, so their source code
+        does not stay in memory. Besides the full metadata, the path, method name and lines of a document
+        are stored in separate columns.
+        The position of the vector of every document in the index is stored as well, so vectors can be
+        deleted by docstore id without scanning the index. Positions are only valid for the index generation
+        recorded with set_positions.
+        Changes are written to the database when commit is called.
+
+        Args:
+            path (str): Path of the SQLite database.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                path TEXT,
+                method_name TEXT,
+                start_line INTEGER,
+                end_line INTEGER,
+                page_content TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                position INTEGER
+            )
+            """)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS properties (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self.connection.commit()
+
+    def add(
+        self, texts: Dict[str, Document], positions: Optional[Dict[str, int]] = None
+    ) -> None:
+        """
+        Adds documents to the docstore.
+
+        Args:
+            texts (Dict[str, Document]): A mapping of docstore ids to documents.
+            positions (Dict[str, int], optional): A mapping of docstore ids to the positions of their vectors.
+                Defaults to None.
+
+        Raises:
+            ValueError: If a docstore id already exists.
+        """
+        positions = positions or {}
+        rows = [
+            (
+                _id,
+                document.metadata.get("path", document.metadata.get("filename")),
+                document.metadata.get("method_name"),
+                document.metadata.get("start_line"),
+                document.metadata.get("end_line"),
+                document.page_content,
+                json.dumps(document.metadata),
+                positions.get(_id),
+            )
+            for _id, document in texts.items()
+        ]
+        with self.lock:
+            try:
+                self.connection.executemany(
+                    "INSERT INTO documents (id, path, method_name, start_line, end_line, page_content, metadata, position) "
+                    + "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+            except sqlite3.IntegrityError as e:
+                raise ValueError(f"Tried to add ids that already exist: {e}")
+
+    def delete(self, ids: List) -> None:
+        """
+        Deletes documents from the docstore.
+
+        Args:
+            ids (List): The docstore ids of the documents to delete.
+
+        Raises:
+            ValueError: If none of the docstore ids exists.
+        """
+        with self.lock:
+            deleted = 0
+            for _id in ids:
+                deleted += self.connection.execute(
+                    "DELETE FROM documents WHERE id = ?", (_id,)
+                ).rowcount
+        if not deleted:
+            raise ValueError(f"Tried to delete ids that does not  exist: {ids}")
+
+    def search(self, search: str) -> Union[str, Document]:
+        """
+        Looks up a document by its docstore id.
+
+        Args:
+            search (str): The docstore id of the document.
+
+        Returns:
+            Document or str: The document if found, otherwise an error message.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT page_content, metadata FROM documents WHERE id = ?", (search,)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def get_documents(self, ids: List[str]) -> Dict[str, Document]:
+        """
+        Looks up the documents of the given docstore ids.
+
+        Args:
+            ids (List[str]): The docstore ids.
+
+        Returns:
+            Dict[str, Document]: A mapping of the found docstore ids to their documents.
+        """
+        documents = {}
+        unique_ids = list(dict.fromkeys(ids))
+        with self.lock:
+            # stay well below the SQLite limit of host parameters per statement
+            for i in range(0, len(unique_ids), 500):
+                chunk = unique_ids[i : i + 500]
+                rows = self.connection.execute(
+                    "SELECT id, page_content, metadata FROM documents WHERE id IN ("
+                    + ",".join("?" * len(chunk))
+                    + ")",
+                    chunk,
+                )
+                for _id, page_content, metadata in rows:
+                    documents[_id] = Document(
+                        page_content=page_content, metadata=json.loads(metadata)
+                    )
+        return documents
+
+    def get_positions(self, ids: List[str]) -> Dict[str, int]:
+        """
+        Looks up the positions of the vectors of the given docstore ids.
+
+        Args:
+            ids (List[str]): The docstore ids.
+
+        Returns:
+            Dict[str, int]: A mapping of the found docstore ids to the positions of their vectors.
+        """
+        positions = {}
+        unique_ids = list(dict.fromkeys(ids))
+        with self.lock:
+            # stay well below the SQLite limit of host parameters per statement
+            for i in range(0, len(unique_ids), 500):
+                chunk = unique_ids[i : i + 500]
+                rows = self.connection.execute(
+                    "SELECT id, position FROM documents WHERE position IS NOT NULL AND id IN ("
+                    + ",".join("?" * len(chunk))
+                    + ")",
+                    chunk,
+                )
+                positions.update(rows)
+        return positions
+
+    def set_positions(self, ids: List[str], generation: int) -> None:
+        """
+        Sets the positions of the vectors of all documents for a new index generation.
+
+        Args:
+            ids (List[str]): The docstore ids in the order of the positions of their vectors.
+            generation (int): The index generation the positions belong to.
+        """
+        with self.lock:
+            self.connection.execute("UPDATE documents SET position = NULL")
+            self.connection.executemany(
+                "UPDATE documents SET position = ? WHERE id = ?",
+                ((position, str(_id)) for position, _id in enumerate(ids)),
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO properties (key, value) VALUES ('generation', ?)",
+                (str(generation),),
+            )
+
+    def get_generation(self) -> Optional[int]:
+        """
+        Returns the index generation the stored positions belong to.
+
+        Returns:
+            int or None: The index generation, or None if no positions were set yet.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM properties WHERE key = 'generation'"
+            ).fetchone()
+        return int(row[0]) if row else None
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM documents").fetchone()[
+                0
+            ]
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
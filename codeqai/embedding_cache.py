@@ -0,0 +1,208 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+from codeqai.cache import get_cache_path
+
+EMBEDDING_CACHE_FILE = "embeddings.sqlite"
+EMBEDDING_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class EmbeddingCache:
+    def __init__(self, path=None, max_bytes=EMBEDDING_CACHE_MAX_BYTES):
+        """
+        Opens the on-disk embedding cache, creating it if it does not exist yet.
+
+        Embeddings are stored per embeddings model and sha256 hash of the embedded text,
+        so they are shared across repositories, branches and re-indexes.
+        When the stored vectors exceed max_bytes, the least recently used entries are evicted.
+
+        Args:
+            path (str, optional): Path of the SQLite database. Defaults to embeddings.sqlite in the cache directory.
+            max_bytes (int, optional): Maximum size of the stored vectors in bytes. Defaults to 1 GiB.
+        """
+        if path is None:
+            path = os.path.join(get_cache_path(), EMBEDDING_CACHE_FILE)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model_id TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (model_id, text_hash)
+            )
+            """)
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)"
+        )
+        self.connection.commit()
+        self.size = self.connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def get(self, model_id: str, text_hashes: list[str]) -> dict[str, list[float]]:
+        """
+        Looks up the cached embeddings of the given text hashes and marks them as recently used.
+
+        Args:
+            model_id (str): The id of the embeddings model.
+            text_hashes (list[str]): The sha256 hashes of the embedded texts.
+
+        Returns:
+            dict[str, list[float]]: A mapping of the found text hashes to their embedding.
+        """
+        embeddings = {}
+        unique_hashes = list(dict.fromkeys(text_hashes))
+        with self.lock:
+            # stay well below the SQLite limit of host parameters per statement
+            for i in range(0, len(unique_hashes), 500):
+                chunk = unique_hashes[i : i + 500]
+                rows = self.connection.execute(
+                    "SELECT text_hash, vector FROM embeddings WHERE model_id = ? AND text_hash IN ("
+                    + ",".join("?" * len(chunk))
+                    + ")",
+                    [model_id, *chunk],
+                )
+                for text_hash, vector in rows:
+                    embeddings[text_hash] = array("f", vector).tolist()
+            now = time.time()
+            self.connection.executemany(
+                "UPDATE embeddings SET accessed = ? WHERE model_id = ? AND text_hash = ?",
+                [(now, model_id, text_hash) for text_hash in embeddings],
+            )
+            self.connection.commit()
+        return embeddings
+
+    def put(self, model_id: str, embeddings: dict[str, list[float]]):
+        """
+        Stores the given embeddings and evicts the least recently used entries if the cache is full.
+
+        Args:
+            model_id (str): The id of the embeddings model.
+            embeddings (dict[str, list[float]]): A mapping of text hashes to their embedding.
+        """
+        now = time.time()
+        rows = [
+            (model_id, text_hash, array("f", embedding).tobytes(), now)
+            for text_hash, embedding in embeddings.items()
+        ]
+        with self.lock:
+            for row in rows:
+                cursor = self.connection.execute(
+                    "INSERT OR IGNORE INTO embeddings (model_id, text_hash, vector, accessed) VALUES (?, ?, ?, ?)",
+                    row,
+                )
+                if cursor.rowcount:
+                    self.size += len(row[2])
+            if self.size > self.max_bytes:
+                self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        # evict down to 90% of the limit, so eviction does not run on every insert
+        target = self.max_bytes * 0.9
+        while self.size > target:
+            rows = self.connection.execute(
+                "SELECT model_id, text_hash, LENGTH(vector) FROM embeddings ORDER BY accessed LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                self.size = 0
+                return
+            evicted = []
+            for model_id, text_hash, size in rows:
+                evicted.append((model_id, text_hash))
+                self.size -= size
+                if self.size <= target:
+                    break
+            self.connection.executemany(
+                "DELETE FROM embeddings WHERE model_id = ? AND text_hash = ?", evicted
+            )
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings, model_id: str, cache: EmbeddingCache):
+        """
+        Wraps an embeddings model, so documents are only embedded if their text is not cached yet.
+
+        Args:
+            embeddings (Embeddings): The embeddings model to wrap.
+            model_id (str): The id of the embeddings model, which scopes the cached embeddings.
+            cache (EmbeddingCache): The embedding cache.
+        """
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embeds the given texts, taking the embeddings of already embedded texts from the cache.
+
+        Args:
+            texts (list[str]): The texts to embed.
+
+        Returns:
+            list[list[float]]: The embedding of every text, in the order of the texts.
+        """
+        text_hashes = [
+            hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts
+        ]
+        embeddings = self.cache.get(self.model_id, text_hashes)
+
+        missing = {}
+        for text, text_hash in zip(texts, text_hashes):
+            if text_hash not in embeddings:
+                missing.setdefault(text_hash, text)
+        if missing:
+            new_embeddings = dict(
+                zip(
+                    missing.keys(),
+                    self.embeddings.embed_documents(list(missing.values())),
+                )
+            )
+            self.cache.put(self.model_id, new_embeddings)
+            embeddings.update(new_embeddings)
+
+        return [embeddings[text_hash] for text_hash in text_hashes]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embeds several queries with the wrapped model, bypassing the cache like embed_query,
+        so search queries do not evict the embeddings of documents.
+
+        Args:
+            texts (list[str]): The queries to embed.
+
+        Returns:
+            list[list[float]]: The embedding of every query, in the order of the queries.
+        """
+        return embed_queries(self.embeddings, texts)
+
+
+def embed_queries(embeddings: Embeddings, texts: list[str]) -> list[list[float]]:
+    """
+    Embeds several queries, with one call if the embeddings model provides embed_queries,
+    otherwise with embed_query for every query.
+
+    Args:
+        embeddings (Embeddings): The embeddings model.
+        texts (list[str]): The queries to embed.
+
+    Returns:
+        list[list[float]]: The embedding of every query, in the order of the queries.
+    """
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    return [embeddings.embed_query(text) for text in texts]
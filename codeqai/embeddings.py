@@ -1,9 +1,28 @@
+import json
+import multiprocessing
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
 import inquirer
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_openai import AzureOpenAIEmbeddings, OpenAIEmbeddings
+from langchain_core.embeddings import Embeddings as LangchainEmbeddings
 
 from codeqai import utils
 from codeqai.constants import EmbeddingsModel
+from codeqai.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+EMBEDDINGS_MAX_CONCURRENCY = 4
+EMBEDDINGS_MAX_BATCH_TOKENS = 32_000
+EMBEDDINGS_MAX_BATCH_SIZE = 2048
+EMBEDDINGS_MAX_INPUT_TOKENS = 8191
+EMBEDDINGS_MAX_RETRIES = 6
+LOCAL_EMBEDDINGS_BATCH_TOKENS = 16_384
+LOCAL_EMBEDDINGS_MAX_BATCH_SIZE = 256
 
 
 class Embeddings:
@@ -11,21 +30,45 @@ class Embeddings:
         self,
         model=EmbeddingsModel.OPENAI_TEXT_EMBEDDING_ADA_002,
         deployment=None,
+        max_concurrency=EMBEDDINGS_MAX_CONCURRENCY,
+        workers=1,
+        torch_threads=None,
     ):
         """
         Initializes the Embeddings class with the specified model and deployment.
 
+        The embeddings model is wrapped with the persistent embedding cache, so texts that have been
+        embedded before by the same model are not embedded again.
+
         Args:
             model (EmbeddingsModel): The embeddings model to use. Defaults to OPENAI_TEXT_EMBEDDING_ADA_002.
             deployment (str, optional): The deployment name for Azure OpenAI embeddings. Defaults to None.
+            max_concurrency (int, optional): Maximum number of concurrent requests to remote embeddings models.
+                                             Defaults to 4.
+            workers (int, optional): Number of worker processes for local embeddings models. Defaults to 1.
+            torch_threads (int, optional): Number of torch threads per process for local embeddings models.
+                                           Defaults to the number of CPUs divided by the number of workers.
         """
         if model == EmbeddingsModel.OPENAI_TEXT_EMBEDDING_ADA_002:
-            self.embeddings = OpenAIEmbeddings(
-                client=None, model="text-embedding-ada-002"
+            self.embeddings = RemoteEmbeddings(
+                os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1").rstrip("/")
+                + "/embeddings",
+                headers={"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"},
+                model="text-embedding-ada-002",
+                max_concurrency=max_concurrency,
             )
         elif model == EmbeddingsModel.AZURE_OPENAI and deployment:
-            self.embeddings = AzureOpenAIEmbeddings(
-                client=None, azure_deployment=deployment
+            endpoint = os.getenv("AZURE_OPENAI_ENDPOINT") or os.getenv(
+                "OPENAI_API_BASE", ""
+            )
+            self.embeddings = RemoteEmbeddings(
+                f"{endpoint.rstrip('/')}/openai/deployments/{deployment}/embeddings"
+                + f"?api-version={os.getenv('OPENAI_API_VERSION')}",
+                headers={
+                    "api-key": os.getenv("AZURE_OPENAI_API_KEY")
+                    or os.getenv("OPENAI_API_KEY", "")
+                },
+                max_concurrency=max_concurrency,
             )
         else:
             try:
@@ -33,11 +76,19 @@ class Embeddings:
             except ImportError:
                 self._install_sentence_transformers()
 
-            if model == EmbeddingsModel.SENTENCETRANSFORMERS_ALL_MPNET_BASE_V2:
-                self.embeddings = HuggingFaceEmbeddings()
-            elif model == EmbeddingsModel.SENTENCETRANSFORMERS_ALL_MINILM_L6_V2:
-                self.embeddings = HuggingFaceEmbeddings(
-                    model_name=EmbeddingsModel.SENTENCETRANSFORMERS_ALL_MINILM_L6_V2.value.replace(
+            model_name = None
+            backend = "torch"
+            if model in [
+                EmbeddingsModel.SENTENCETRANSFORMERS_ALL_MPNET_BASE_V2,
+                EmbeddingsModel.SENTENCETRANSFORMERS_ALL_MPNET_BASE_V2_ONNX,
+            ]:
+                model_name = "sentence-transformers/all-mpnet-base-v2"
+            elif model in [
+                EmbeddingsModel.SENTENCETRANSFORMERS_ALL_MINILM_L6_V2,
+                EmbeddingsModel.SENTENCETRANSFORMERS_ALL_MINILM_L6_V2_ONNX,
+            ]:
+                model_name = (
+                    EmbeddingsModel.SENTENCETRANSFORMERS_ALL_MINILM_L6_V2.value.replace(
                         "SentenceTransformers-", ""
                     )
                 )
@@ -47,10 +98,43 @@ class Embeddings:
                 except ImportError:
                     self._install_instructor_embedding()
 
-                self.embeddings = HuggingFaceEmbeddings(
-                    model_name="hkunlp/instructor-xl"
+                model_name = "hkunlp/instructor-xl"
+
+            if model.value.endswith("-ONNX"):
+                backend = "onnx"
+                try:
+                    import onnxruntime  # noqa: F401
+                except ImportError:
+                    self._install_onnxruntime()
+
+            if model_name:
+                self.embeddings = LocalEmbeddings(
+                    model_name,
+                    workers=workers,
+                    torch_threads=torch_threads,
+                    backend=backend,
                 )
 
+        self.model_id = model.value
+        if model == EmbeddingsModel.AZURE_OPENAI and deployment:
+            self.model_id += "/" + deployment
+        if isinstance(self.embeddings, RemoteEmbeddings):
+            # long inputs are truncated rather than averaged over chunks like the langchain client did,
+            # so their vectors cached by earlier versions are not served
+            self.model_id += "/truncated"
+        # the uncached embeddings model, e.g. to report the throughput of local models
+        self.engine = self.embeddings
+        self.embeddings = CachedEmbeddings(
+            self.embeddings, self.model_id, EmbeddingCache()
+        )
+
+    def close(self):
+        """
+        Stops the worker processes of a local embeddings model, if any, which are started again when needed.
+        """
+        if isinstance(self.engine, LocalEmbeddings):
+            self.engine.close()
+
     def _install_sentence_transformers(self):
         question = [
             inquirer.Confirm(
@@ -110,3 +194,426 @@ class Embeddings:
                 print(f"Error during sentence_transformers installation: {e}")
         else:
             exit("InstructorEmbedding is required for local embeddings.")
+
+    def _install_onnxruntime(self):
+        question = [
+            inquirer.Confirm(
+                "confirm",
+                message=f"{utils.get_bold_text('onnxruntime')} not found in this python environment. Do you want to install it now?",
+                default=True,
+            ),
+        ]
+
+        answers = inquirer.prompt(question)
+        if answers and answers["confirm"]:
+            import subprocess
+            import sys
+
+            try:
+                subprocess.run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "pip",
+                        "install",
+                        "onnxruntime",
+                    ],
+                    check=True,
+                )
+            except subprocess.CalledProcessError as e:
+                print(f"Error during onnxruntime installation: {e}")
+        else:
+            exit("onnxruntime is required for ONNX embeddings.")
+
+
+class LocalEmbeddings(LangchainEmbeddings):
+    def __init__(
+        self,
+        model_name,
+        workers=1,
+        torch_threads=None,
+        batch_tokens=LOCAL_EMBEDDINGS_BATCH_TOKENS,
+        max_batch_size=LOCAL_EMBEDDINGS_MAX_BATCH_SIZE,
+        backend="torch",
+    ):
+        """
+        Initializes a CPU optimized SentenceTransformers embeddings model.
+
+        Texts are sorted by their token length and grouped into batches of similar length, whose size is chosen
+        so every batch holds about the same number of tokens including padding. The batches are optionally
+        encoded by a pool of worker processes, each loading its own copy of the model.
+
+        Args:
+            model_name (str): The name of the SentenceTransformers model.
+            workers (int, optional): Number of worker processes. Defaults to 1, encoding in the current process.
+            torch_threads (int, optional): Number of torch threads per process.
+                                           Defaults to the number of CPUs divided by the number of workers.
+            batch_tokens (int, optional): Number of tokens per batch, including padding. Defaults to 16384.
+            max_batch_size (int, optional): Maximum number of texts per batch. Defaults to 256.
+            backend (str, optional): "torch" to run the model with PyTorch, or "onnx" to run its int8 quantized
+                                     ONNX graph with ONNX Runtime, see codeqai.onnx_embeddings.
+                                     Defaults to "torch".
+        """
+        self.model_name = model_name
+        self.workers = max(1, workers or 1)
+        self.torch_threads = torch_threads or max(
+            1, (os.cpu_count() or 1) // self.workers
+        )
+        self.batch_tokens = batch_tokens
+        self.max_batch_size = max_batch_size
+        self.backend = backend
+        self.model = _load_sentence_transformer(model_name, self.torch_threads, backend)
+        self.pool = None
+        self.chunks = 0
+        self.seconds = 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        """
+        Returns the throughput of all documents embedded so far.
+
+        Returns:
+            float: The number of embedded chunks per second.
+        """
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embeds the given texts in length bucketed batches.
+
+        Args:
+            texts (list[str]): The texts to embed.
+
+        Returns:
+            list[list[float]]: The embedding of every text, in the order of the texts.
+        """
+        start = time.perf_counter()
+        texts = [text.replace("\n", " ") for text in texts]
+        batches = self._bucket_batches(texts)
+        batch_texts = [[texts[index] for index in batch] for batch in batches]
+        if self.workers > 1 and len(batches) > 1:
+            results = self._get_pool().imap(_encode_in_worker, batch_texts)
+        else:
+            results = (_encode(self.model, texts) for texts in batch_texts)
+
+        embeddings = [None] * len(texts)
+        for batch, batch_embeddings in zip(batches, results):
+            for index, embedding in zip(batch, batch_embeddings):
+                embeddings[index] = embedding
+
+        self.chunks += len(texts)
+        self.seconds += time.perf_counter() - start
+        return embeddings
+
+    def embed_query(self, text: str) -> list[float]:
+        return _encode(self.model, [text.replace("\n", " ")])[0]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embeds several queries as one batch in the current process, like embed_query,
+        so they are not counted in the throughput of embedded documents.
+
+        Args:
+            texts (list[str]): The queries to embed.
+
+        Returns:
+            list[list[float]]: The embedding of every query, in the order of the queries.
+        """
+        if not texts:
+            return []
+        return _encode(self.model, [text.replace("\n", " ") for text in texts])
+
+    def close(self):
+        """
+        Stops the worker processes, if any. They are started again by the next batches to embed.
+        """
+        if self.pool:
+            self.pool.terminate()
+            self.pool = None
+
+    def _bucket_batches(self, texts: list[str]) -> list[list[int]]:
+        """
+        Groups the texts into batches of similar token length, longest first.
+
+        Args:
+            texts (list[str]): The texts to embed.
+
+        Returns:
+            list[list[int]]: The indexes of the texts of every batch.
+        """
+        lengths = [
+            len(input_ids)
+            for input_ids in self.model.tokenizer(
+                texts,
+                truncation=True,
+                max_length=self.model.max_seq_length,
+                return_attention_mask=False,
+                return_token_type_ids=False,
+            )["input_ids"]
+        ]
+        batches = []
+        batch = []
+        batch_size = 0
+        for index in sorted(range(len(texts)), key=lambda i: lengths[i], reverse=True):
+            if not batch:
+                # the first text is the longest one, so it determines the padded length
+                batch_size = max(
+                    1,
+                    min(
+                        self.max_batch_size, self.batch_tokens // max(lengths[index], 1)
+                    ),
+                )
+            batch.append(index)
+            if len(batch) >= batch_size:
+                batches.append(batch)
+                batch = []
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _get_pool(self):
+        if self.pool is None:
+            # spawn, since torch does not support forking after its thread pool is initialized
+            self.pool = multiprocessing.get_context("spawn").Pool(
+                self.workers,
+                initializer=_init_worker,
+                initargs=(self.model_name, self.torch_threads, self.backend),
+            )
+        return self.pool
+
+
+_worker_model = None
+
+
+def _load_sentence_transformer(model_name: str, torch_threads: int, backend: str):
+    if backend == "onnx":
+        from codeqai.onnx_embeddings import load_onnx_model
+
+        return load_onnx_model(model_name, torch_threads)
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(torch_threads)
+    return SentenceTransformer(model_name)
+
+
+def _init_worker(model_name: str, torch_threads: int, backend: str):
+    global _worker_model
+    _worker_model = _load_sentence_transformer(model_name, torch_threads, backend)
+
+
+def _encode_in_worker(texts: list[str]) -> list[list[float]]:
+    return _encode(_worker_model, texts)
+
+
+def _encode(model, texts: list[str]) -> list[list[float]]:
+    return model.encode(
+        texts, batch_size=len(texts), show_progress_bar=False, convert_to_numpy=True
+    ).tolist()
+
+
+class RemoteEmbeddings(LangchainEmbeddings):
+    def __init__(
+        self,
+        url,
+        headers=None,
+        model=None,
+        max_concurrency=EMBEDDINGS_MAX_CONCURRENCY,
+        max_batch_tokens=EMBEDDINGS_MAX_BATCH_TOKENS,
+        max_batch_size=EMBEDDINGS_MAX_BATCH_SIZE,
+        max_retries=EMBEDDINGS_MAX_RETRIES,
+        tokenizer=None,
+        timeout=60,
+    ):
+        """
+        Initializes a client for OpenAI compatible embeddings endpoints that schedules batched, concurrent requests.
+
+        Args:
+            url (str): The URL of the embeddings endpoint.
+            headers (dict, optional): Additional request headers, e.g. for authentication. Defaults to None.
+            model (str, optional): The model name sent with every request. Defaults to None.
+            max_concurrency (int, optional): Maximum number of requests in flight. Defaults to 4.
+            max_batch_tokens (int, optional): Maximum number of tokens per request. Defaults to 32000.
+            max_batch_size (int, optional): Maximum number of texts per request. Defaults to 2048.
+            max_retries (int, optional): Maximum number of retries of a failed request. Defaults to 6.
+            tokenizer (optional): Tokenizer with encode and decode methods, used to count the tokens of the texts
+                                  and to truncate texts above the context length of the model.
+                                  Defaults to the tiktoken encoding of text-embedding-ada-002.
+            timeout (float, optional): Timeout of a single request in seconds. Defaults to 60.
+        """
+        self.url = url
+        self.headers = headers or {}
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.tokenizer = tokenizer
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embeds the given texts.
+
+        The texts are packed into batches limited by tokens and number of texts, which are sent concurrently.
+        Failed batches are retried on their own, rate limited requests pause all requests until the reset
+        time announced by the server.
+
+        Args:
+            texts (list[str]): The texts to embed.
+
+        Returns:
+            list[list[float]]: The embedding of every text, in the order of the texts.
+        """
+        batches = self._pack_batches(texts)
+        if not batches:
+            return []
+
+        embeddings = []
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_concurrency, len(batches))
+        ) as executor:
+            for batch_embeddings in executor.map(self._embed_batch, batches):
+                embeddings.extend(batch_embeddings)
+        return embeddings
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed_batch(self._pack_batches([text])[0])[0]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        # the endpoint embeds queries and documents alike
+        return self.embed_documents(texts)
+
+    def _get_tokenizer(self):
+        if self.tokenizer is None:
+            import tiktoken
+
+            self.tokenizer = tiktoken.encoding_for_model("text-embedding-ada-002")
+        return self.tokenizer
+
+    def _pack_batches(self, texts: list[str]) -> list[list[str]]:
+        tokenizer = self._get_tokenizer()
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for text in texts:
+            encoding = tokenizer.encode(text)
+            tokens = len(encoding)
+            if tokens > EMBEDDINGS_MAX_INPUT_TOKENS:
+                # the endpoint rejects inputs above the context length of the model,
+                # which are cut on their tokens as code does not spread its tokens evenly over its characters
+                text = tokenizer.decode(encoding[:EMBEDDINGS_MAX_INPUT_TOKENS])
+                tokens = EMBEDDINGS_MAX_INPUT_TOKENS
+            if batch and (
+                batch_tokens + tokens > self.max_batch_tokens
+                or len(batch) >= self.max_batch_size
+            ):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        payload = {"input": texts}
+        if self.model:
+            payload["model"] = self.model
+        data = json.dumps(payload).encode("utf-8")
+
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_rate_limit()
+            request = urllib.request.Request(
+                self.url,
+                data=data,
+                headers={"Content-Type": "application/json", **self.headers},
+                method="POST",
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    result = json.load(response)
+                    if (
+                        response.headers.get("x-ratelimit-remaining-requests") == "0"
+                        or response.headers.get("x-ratelimit-remaining-tokens") == "0"
+                    ):
+                        self._pause(_get_retry_delay(response.headers, attempt))
+                return [
+                    item["embedding"]
+                    for item in sorted(result["data"], key=lambda item: item["index"])
+                ]
+            except urllib.error.HTTPError as e:
+                if (e.code != 429 and e.code < 500) or attempt == self.max_retries:
+                    raise
+                delay = _get_retry_delay(e.headers, attempt)
+                if e.code == 429:
+                    # the rate limit applies to all requests, not only to this one
+                    self._pause(delay)
+                else:
+                    time.sleep(delay)
+            except (urllib.error.URLError, TimeoutError, ConnectionError):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(_get_retry_delay({}, attempt))
+
+    def _pause(self, delay: float):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+    def _wait_for_rate_limit(self):
+        while True:
+            with self._lock:
+                delay = self._resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+
+def _get_retry_delay(headers, attempt: int) -> float:
+    """
+    Returns the delay before retrying a request, preferring the limits announced by the server.
+
+    Args:
+        headers (Mapping[str, str]): The response headers.
+        attempt (int): The number of the failed attempt, starting at 0.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            pass
+    resets = [
+        _parse_duration(headers[header])
+        for header in ["x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"]
+        if headers.get(header)
+    ]
+    if resets:
+        return max(resets)
+    delay = min(60.0, 0.5 * 2**attempt)
+    return delay + random.uniform(0, delay / 4)
+
+
+def _parse_duration(duration: str) -> float:
+    """
+    Parses durations like 20ms, 1s or 6m0s as sent in the rate limit headers of OpenAI.
+
+    Args:
+        duration (str): The duration.
+
+    Returns:
+        float: The duration in seconds.
+    """
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(
+        float(value) * units[unit]
+        for value, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", duration)
+    )
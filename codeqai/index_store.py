@@ -0,0 +1,1001 @@
+import json
+import os
+import uuid
+from collections.abc import Mapping
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain.schema import Document
+from langchain_community.vectorstores.faiss import FAISS
+
+from codeqai.cache import get_cache_path
+from codeqai.docstore import SQLiteDocstore
+
+MANIFEST_FILE = "manifest.json"
+# compaction merges all segments once there are more than this many
+MAX_SEGMENTS = 16
+# or once this fraction of the vectors is deleted or outside of the base segment
+MAX_DELETED_RATIO = 0.25
+MAX_SEGMENTED_RATIO = 0.25
+COMPACTION_BATCH_SIZE = 65536
+
+INDEX_TYPES = ["auto", "flat", "hnsw", "ivf", "ivfpq"]
+# largest number of vectors for which the index types are chosen automatically
+FLAT_MAX_VECTORS = 20000
+HNSW_MAX_VECTORS = 200000
+IVF_MAX_VECTORS = 2000000
+# smaller indexes are always flat, approximate indexes would not be faster and cannot be trained well
+ANN_MIN_VECTORS = 10000
+# faiss needs at least 39 training vectors per cluster
+TRAINING_VECTORS_PER_LIST = 64
+MAX_TRAINING_VECTORS = 262144
+HNSW_M = 32
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+
+VECTOR_STORAGE_TYPES = ["float32", "float16", "int8"]
+# quantized segments are searched for this many times more candidates, which are re-scored exactly
+RESCORE_FACTOR = 4
+RECALL_SAMPLE_QUERIES = 64
+RECALL_K = 10
+
+
+class SegmentedIndex:
+    def __init__(
+        self,
+        segments,
+        ids,
+        deleted=None,
+        vectors=None,
+        nprobe=DEFAULT_NPROBE,
+        ef_search=DEFAULT_EF_SEARCH,
+    ):
+        """
+        A FAISS index composed of append-only segments.
+
+        The first segment is the base index, every further segment holds the vectors added by a later sync.
+        Positions are numbered across the segments in their order and never shift: deleting a vector
+        only records its position as tombstone, which is excluded from searches until the index is compacted.
+        Vectors are added to a new flat in-memory segment, so persisted segments can stay memory-mapped read-only.
+        The base segment may be an approximate index, see build_index, whose search is tuned by nprobe and ef_search.
+        If the base segment stores quantized vectors, its full precision vectors are kept memory-mapped next to it:
+        the segment is searched for RESCORE_FACTOR times more candidates, which are re-scored with their exact
+        distances, so only the vectors of the candidates are read.
+
+        The class provides the subset of the faiss.Index interface used by the LangChain FAISS vector store.
+
+        Args:
+            segments (list[faiss.Index]): The persisted segments.
+            ids (list[np.ndarray]): The docstore ids of the vectors of every segment.
+            deleted (set[int], optional): The positions of deleted vectors. Defaults to None.
+            vectors (list[np.ndarray], optional): The full precision vectors of every segment, None for segments
+                that are searched exactly. Defaults to None.
+            nprobe (int, optional): Number of clusters visited by a search in IVF segments. Defaults to 16.
+            ef_search (int, optional): Size of the candidate list of a search in HNSW segments. Defaults to 64.
+        """
+        self.segments = segments
+        self.ids = list(ids)
+        self.deleted = set(deleted or [])
+        self.vectors = list(vectors) if vectors else [None] * len(segments)
+        self.rescore_factor = RESCORE_FACTOR
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.persisted_segments = len(segments)
+        self.new_tombstones = []
+        self.selectors = None
+
+    @property
+    def d(self):
+        return self.segments[0].d
+
+    @property
+    def metric_type(self):
+        return self.segments[0].metric_type
+
+    @property
+    def ntotal(self):
+        return sum(segment.ntotal for segment in self.segments)
+
+    def has_changes(self) -> bool:
+        return len(self.segments) > self.persisted_segments or bool(self.new_tombstones)
+
+    def add(self, vectors: np.ndarray):
+        import faiss
+
+        if len(self.segments) == self.persisted_segments:
+            self.segments.append(faiss.IndexFlat(self.d, self.metric_type))
+            self.ids.append([])
+            self.vectors.append(None)
+        self.segments[-1].add(vectors)
+        self.selectors = None
+
+    def add_ids(self, ids: list[str]):
+        self.ids[-1].extend(ids)
+
+    def remove(self, positions: list[int]):
+        positions = [position for position in positions if position not in self.deleted]
+        self.deleted.update(positions)
+        self.new_tombstones.extend(positions)
+        self.selectors = None
+
+    def reconstruct(self, position: int) -> np.ndarray:
+        segment, local_position = self._locate(position)
+        if self.vectors[segment] is not None:
+            return np.array(self.vectors[segment][local_position], dtype=np.float32)
+        return self.segments[segment].reconstruct(local_position)
+
+    def search(self, vectors: np.ndarray, k: int):
+        """
+        Searches the k nearest vectors of every query vector across all segments, skipping deleted vectors.
+
+        Args:
+            vectors (np.ndarray): The query vectors, one row per query.
+            k (int): The number of nearest vectors to return per query.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The distances and positions of the nearest vectors,
+                padded with -1 positions if fewer than k vectors exist.
+        """
+        import faiss
+
+        if self.selectors is None:
+            self.selectors = self._get_selectors()
+        distances = []
+        positions = []
+        offset = 0
+        for segment, segment_vectors, selector in zip(
+            self.segments, self.vectors, self.selectors
+        ):
+            if segment.ntotal:
+                rescore = segment_vectors is not None and self.rescore_factor > 0
+                count = min(k * self.rescore_factor if rescore else k, segment.ntotal)
+                params = self._get_search_parameters(segment, selector, count)
+                segment_distances, segment_positions = segment.search(
+                    vectors, count, params=params
+                )
+                if rescore:
+                    segment_distances, segment_positions = self._rescore(
+                        vectors, segment_vectors, segment_positions, k
+                    )
+                distances.append(segment_distances)
+                positions.append(
+                    np.where(segment_positions >= 0, segment_positions + offset, -1)
+                )
+            offset += segment.ntotal
+
+        inner_product = self.metric_type == faiss.METRIC_INNER_PRODUCT
+        missing = (
+            np.finfo(np.float32).min if inner_product else np.finfo(np.float32).max
+        )
+        distances.append(np.full((len(vectors), k), missing, dtype=np.float32))
+        positions.append(np.full((len(vectors), k), -1, dtype=np.int64))
+        distances = np.concatenate(distances, axis=1)
+        positions = np.concatenate(positions, axis=1)
+        # results of the same segment are already ordered, a stable sort keeps their order on ties
+        distances[positions < 0] = missing
+        order = np.argsort(
+            -distances if inner_product else distances, axis=1, kind="stable"
+        )[:, :k]
+        return (
+            np.take_along_axis(distances, order, axis=1),
+            np.take_along_axis(positions, order, axis=1),
+        )
+
+    def iter_live_vectors(self):
+        """
+        Yields the vectors that are not deleted along with their docstore ids, in batches and segment order.
+
+        Yields:
+            tuple[np.ndarray, list[str]]: A batch of vectors and their docstore ids.
+        """
+        offset = 0
+        for segment, segment_vectors, segment_ids in zip(
+            self.segments, self.vectors, self.ids
+        ):
+            for start in range(0, segment.ntotal, COMPACTION_BATCH_SIZE):
+                count = min(COMPACTION_BATCH_SIZE, segment.ntotal - start)
+                live = [
+                    i for i in range(count) if offset + start + i not in self.deleted
+                ]
+                if live:
+                    # quantized segments are not reconstructed, their full precision vectors are used
+                    if segment_vectors is not None:
+                        vectors = np.asarray(
+                            segment_vectors[start : start + count], dtype=np.float32
+                        )[live]
+                    else:
+                        vectors = segment.reconstruct_n(start, count)[live]
+                    yield vectors, [segment_ids[start + i] for i in live]
+            offset += segment.ntotal
+
+    def _rescore(self, queries, segment_vectors, positions, k):
+        import faiss
+
+        inner_product = self.metric_type == faiss.METRIC_INNER_PRODUCT
+        valid = positions >= 0
+        rows = np.where(valid, positions, 0).ravel()
+        # reading the candidates in order keeps the accesses to the memory-mapped vectors local
+        order = np.argsort(rows, kind="stable")
+        candidates = np.empty((len(rows), self.d), dtype=np.float32)
+        candidates[order] = segment_vectors[rows[order]]
+        candidates = candidates.reshape(*positions.shape, self.d)
+        if inner_product:
+            distances = np.einsum("qcd,qd->qc", candidates, queries)
+        else:
+            distances = np.sum((candidates - queries[:, None, :]) ** 2, axis=2)
+        distances = distances.astype(np.float32)
+        distances[~valid] = (
+            np.finfo(np.float32).min if inner_product else np.finfo(np.float32).max
+        )
+        order = np.argsort(
+            -distances if inner_product else distances, axis=1, kind="stable"
+        )[:, :k]
+        return (
+            np.take_along_axis(distances, order, axis=1),
+            np.take_along_axis(positions, order, axis=1),
+        )
+
+    def _get_search_parameters(self, segment, selector, k):
+        import faiss
+
+        ivf = faiss.try_extract_index_ivf(segment)
+        if ivf is not None:
+            params = faiss.SearchParametersIVF(nprobe=min(self.nprobe, ivf.nlist))
+        elif isinstance(segment, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW(efSearch=max(self.ef_search, k))
+        elif selector is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+        if selector is not None:
+            params.sel = selector
+        return params
+
+    def _locate(self, position: int):
+        for segment, index in enumerate(self.segments):
+            if position < index.ntotal:
+                return segment, position
+            position -= index.ntotal
+        raise KeyError(position)
+
+    def _get_selectors(self):
+        import faiss
+
+        selectors = []
+        offset = 0
+        for segment in self.segments:
+            deleted = [
+                position - offset
+                for position in self.deleted
+                if offset <= position < offset + segment.ntotal
+            ]
+            if deleted:
+                batch = faiss.IDSelectorBatch(np.array(deleted, dtype=np.int64))
+                selector = faiss.IDSelectorNot(batch)
+                # the inner selector has to outlive the outer one
+                selector.batch = batch
+                selectors.append(selector)
+            else:
+                selectors.append(None)
+            offset += segment.ntotal
+        return selectors
+
+
+class SegmentedIds(Mapping):
+    def __init__(self, index: SegmentedIndex):
+        """
+        A read-only mapping of the positions of the vectors of a segmented index, that are not deleted,
+        to their docstore ids.
+
+        Args:
+            index (SegmentedIndex): The segmented index.
+        """
+        self.index = index
+
+    def __getitem__(self, position):
+        if position < 0 or position in self.index.deleted:
+            raise KeyError(position)
+        segment, local_position = self.index._locate(int(position))
+        return str(self.index.ids[segment][local_position])
+
+    def __iter__(self):
+        return (
+            position
+            for position in range(self.index.ntotal)
+            if position not in self.index.deleted
+        )
+
+    def __len__(self):
+        return self.index.ntotal - len(self.index.deleted)
+
+
+class SegmentedFAISS(FAISS):
+    def __init__(self, embeddings: Embeddings, index: SegmentedIndex, docstore):
+        """
+        A LangChain FAISS vector store on a segmented index, see SegmentedIndex.
+
+        Added vectors are appended to a new segment and deleted vectors are recorded as tombstones,
+        so changes can be saved in time proportional to their size.
+        The positions of the vectors never shift, so they serve as stable integer ids: the docstore maps
+        every docstore id to the position of its vector, and deleting vectors only looks up their positions.
+
+        Args:
+            embeddings (Embeddings): The embeddings model of the vector store.
+            index (SegmentedIndex): The segmented index.
+            docstore (SQLiteDocstore): The docstore of the vector store.
+        """
+        super().__init__(embeddings, index, docstore, SegmentedIds(index))
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs) -> list[str]:
+        texts = list(texts)
+        return self._add(texts, self._embed_documents(texts), metadatas, ids)
+
+    def add_embeddings(
+        self, text_embeddings, metadatas=None, ids=None, **kwargs
+    ) -> list[str]:
+        texts, embeddings = zip(*text_embeddings)
+        return self._add(list(texts), list(embeddings), metadatas, ids)
+
+    def _add(self, texts, embeddings, metadatas, ids) -> list[str]:
+        import faiss
+
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        start = self.index.ntotal
+        self.docstore.add(
+            {
+                _id: Document(page_content=text, metadata=metadata)
+                for _id, text, metadata in zip(ids, texts, metadatas)
+            },
+            {_id: start + i for i, _id in enumerate(ids)},
+        )
+        vectors = np.array(embeddings, dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vectors)
+        self.index.add(vectors)
+        self.index.add_ids(ids)
+        return ids
+
+    def similarity_search_with_score_by_vectors(
+        self, embeddings, k=4
+    ) -> list[list[tuple[Document, float]]]:
+        """
+        Searches the documents most similar to every query vector with a single search of the index.
+
+        The documents of all queries are read from the docstore at once.
+
+        Args:
+            embeddings (list[list[float]]): The query vectors.
+            k (int, optional): The number of documents to return per query. Defaults to 4.
+
+        Returns:
+            list[list[tuple[Document, float]]]: The found documents of every query and the distances
+                of their vectors to the query, in the order of the query vectors.
+        """
+        import faiss
+
+        if len(embeddings) == 0:
+            return []
+        vectors = np.array(embeddings, dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vectors)
+        distances, positions = self.index.search(vectors, k)
+        ids = [
+            [self.index_to_docstore_id[position] for position in row if position >= 0]
+            for row in positions
+        ]
+        documents = self.docstore.get_documents([_id for row in ids for _id in row])
+        return [
+            [
+                (documents[_id], float(distance))
+                for _id, distance in zip(row_ids, row_distances)
+                if _id in documents
+            ]
+            for row_ids, row_distances in zip(ids, distances)
+        ]
+
+    def delete(self, ids=None, **kwargs) -> bool:
+        """
+        Deletes the vectors and documents of the given docstore ids.
+
+        The positions of the vectors are looked up in the docstore, so the cost is proportional
+        to the number of ids, not to the size of the index.
+
+        Args:
+            ids (list[str]): The docstore ids to delete.
+
+        Returns:
+            bool: True if the ids were deleted.
+
+        Raises:
+            ValueError: If no ids are given or some ids do not exist.
+        """
+        if ids is None:
+            raise ValueError("No ids provided to delete.")
+        positions = self.docstore.get_positions(ids)
+        missing_ids = [_id for _id in ids if _id not in positions]
+        if missing_ids:
+            raise ValueError(
+                f"Some specified ids do not exist in the current store. Ids not found: {missing_ids}"
+            )
+        self.index.remove(list(positions.values()))
+        self.docstore.delete(ids)
+        return True
+
+
+def get_index_dir(name) -> str:
+    return os.path.join(get_cache_path(), f"{name}.index")
+
+
+def get_legacy_index_path(name) -> str:
+    return os.path.join(get_cache_path(), f"{name}.faiss.bytes")
+
+
+def index_exists(name) -> bool:
+    """
+    Checks if a vector store has been saved, either in the current or a legacy layout.
+
+    Args:
+        name (str): The name of the vector store.
+
+    Returns:
+        bool: True if the vector store exists.
+    """
+    index_dir = get_index_dir(name)
+    return os.path.exists(os.path.join(index_dir, MANIFEST_FILE)) or os.path.exists(
+        get_legacy_index_path(name)
+    )
+
+
+def create_docstore(name) -> SQLiteDocstore:
+    """
+    Creates an empty docstore for a vector store that is built from scratch.
+
+    The docstore gets a new file next to the current one, which is only referenced by the manifest
+    once the new vector store is saved, so the current vector store stays intact until then.
+
+    Args:
+        name (str): The name of the vector store.
+
+    Returns:
+        SQLiteDocstore: The empty docstore.
+    """
+    index_dir = get_index_dir(name)
+    os.makedirs(index_dir, exist_ok=True)
+    return SQLiteDocstore(
+        os.path.join(index_dir, f"docstore-{uuid.uuid4().hex[:12]}.sqlite")
+    )
+
+
+def save_index(db: FAISS, name, index_type="auto", vector_storage="float32"):
+    """
+    Saves a FAISS vector store.
+
+    The vector store is saved as a set of segments described by a manifest file, see SegmentedIndex.
+    For a segmented vector store only the segment of added vectors is written and the deleted positions
+    are appended to the tombstone log, so the cost of saving is proportional to the change.
+    Any other vector store, e.g. a newly built or a legacy one, is written as the base segment of a new generation,
+    which is built with the given index type and vector storage, see build_index.
+    The recall of a base segment with quantized vectors is checked against its full precision vectors,
+    see measure_recall, and recorded in the manifest.
+    The manifest is replaced atomically at the end, so a vector store is never saved partially, and processes
+    that have the files of the previous manifest memory-mapped keep a consistent view.
+    The documents are kept in an SQLite docstore, of which only the changed rows are written,
+    along with the positions of their vectors.
+
+    Args:
+        db (FAISS): The vector store to save.
+        name (str): The name of the vector store.
+        index_type (str, optional): The index type of a new base segment, one of INDEX_TYPES. Defaults to "auto".
+        vector_storage (str, optional): The storage of the vectors of a new base segment, one of VECTOR_STORAGE_TYPES.
+            Defaults to "float32".
+
+    Returns:
+        dict or None: The recall of a new base segment with quantized vectors, see measure_recall.
+    """
+    index_dir = get_index_dir(name)
+    os.makedirs(index_dir, exist_ok=True)
+    if not isinstance(db.docstore, SQLiteDocstore):
+        docstore = create_docstore(name)
+        docstore.add(db.docstore._dict)
+        db.docstore = docstore
+
+    if not isinstance(db, SegmentedFAISS):
+        db.docstore.commit()
+        ids = [db.index_to_docstore_id[i] for i in range(db.index.ntotal)]
+        index = db.index
+        quantized = _is_quantized(vector_storage)
+        if quantized or resolve_index_type(index_type, index.ntotal) != "flat":
+            index = build_index(
+                lambda: _iter_vectors(db.index),
+                index.ntotal,
+                index.d,
+                index.metric_type,
+                index_type,
+                vector_storage,
+            )
+        _write_generation(
+            index_dir,
+            index,
+            ids,
+            db.docstore,
+            (lambda: _iter_vectors(db.index)) if quantized else None,
+        )
+        if quantized:
+            return _check_recall(
+                index_dir,
+                _load_segmented_index(index_dir, _load_manifest(index_dir)),
+                lambda: _iter_vectors(db.index),
+            )
+        return None
+
+    manifest = _load_manifest(index_dir)
+    index = db.index
+    for segment in range(index.persisted_segments, len(index.segments)):
+        stem = f"segment-{manifest['generation']}-{segment}"
+        _write_segment(index_dir, stem, index.segments[segment], index.ids[segment])
+        manifest["segments"].append(stem)
+    if index.new_tombstones:
+        tombstones_path = os.path.join(index_dir, manifest["tombstones"])
+        with open(
+            tombstones_path, "r+b" if os.path.exists(tombstones_path) else "wb"
+        ) as tombstones_file:
+            # entries beyond the count of the manifest are left over from an interrupted save
+            tombstones_file.seek(manifest["tombstone_count"] * 8)
+            tombstones_file.write(
+                np.array(index.new_tombstones, dtype=np.int64).tobytes()
+            )
+            tombstones_file.truncate()
+        manifest["tombstone_count"] += len(index.new_tombstones)
+    db.docstore.commit()
+    _save_manifest(index_dir, manifest)
+    index.persisted_segments = len(index.segments)
+    index.new_tombstones = []
+    return None
+
+
+def load_index(
+    name,
+    embeddings: Embeddings,
+    nprobe=DEFAULT_NPROBE,
+    ef_search=DEFAULT_EF_SEARCH,
+) -> SegmentedFAISS:
+    """
+    Loads a FAISS vector store.
+
+    All segments of the index and their docstore ids are memory-mapped read-only, so loading takes near-constant
+    time and processes that load the same vector store share their pages. Documents are read from the SQLite
+    docstore when they are searched. A vector store saved in the legacy layout, a single pickled blob,
+    is converted to the current layout first.
+    If the positions of the vectors in the docstore do not belong to the generation of the index, e.g. because
+    the vector store was saved before positions were stored, they are set again from the ids of the segments.
+
+    Args:
+        name (str): The name of the vector store.
+        embeddings (Embeddings): The embeddings model of the vector store.
+        nprobe (int, optional): Number of clusters visited by a search in an IVF index. Defaults to 16.
+        ef_search (int, optional): Size of the candidate list of a search in an HNSW index. Defaults to 64.
+
+    Returns:
+        SegmentedFAISS: The loaded vector store.
+    """
+    index_dir = get_index_dir(name)
+    _migrate_legacy_layout(name, embeddings)
+    manifest = _load_manifest(index_dir)
+    index = _load_segmented_index(index_dir, manifest)
+    index.nprobe = nprobe
+    index.ef_search = ef_search
+    docstore = SQLiteDocstore(os.path.join(index_dir, manifest["docstore"]))
+    if docstore.get_generation() != manifest["generation"]:
+        docstore.set_positions(
+            [_id for segment_ids in index.ids for _id in segment_ids],
+            manifest["generation"],
+        )
+        docstore.commit()
+    return SegmentedFAISS(embeddings, index, docstore)
+
+
+def _load_segmented_index(index_dir, manifest) -> SegmentedIndex:
+    import faiss
+
+    segments = []
+    ids = []
+    vectors = []
+    for stem in manifest["segments"]:
+        segments.append(
+            faiss.read_index(
+                os.path.join(index_dir, stem + ".faiss"),
+                # IO_FLAG_MMAP copies the vectors of flat, scalar quantized and HNSW indexes into memory,
+                # IO_FLAG_MMAP_IFC keeps the storage of all index types mapped to the file
+                faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY,
+            )
+        )
+        ids.append(np.load(os.path.join(index_dir, stem + ".ids.npy"), mmap_mode="r"))
+        vectors_path = os.path.join(index_dir, stem + ".vectors.npy")
+        vectors.append(
+            np.load(vectors_path, mmap_mode="r")
+            if os.path.exists(vectors_path)
+            else None
+        )
+    deleted = []
+    if manifest["tombstone_count"]:
+        deleted = np.fromfile(
+            os.path.join(index_dir, manifest["tombstones"]),
+            dtype=np.int64,
+            count=manifest["tombstone_count"],
+        ).tolist()
+    return SegmentedIndex(segments, ids, deleted, vectors)
+
+
+def needs_compaction(db: SegmentedFAISS) -> bool:
+    index = db.index
+    return (
+        len(index.segments) > MAX_SEGMENTS
+        or len(index.deleted) > MAX_DELETED_RATIO * index.ntotal
+        or index.ntotal - index.segments[0].ntotal > MAX_SEGMENTED_RATIO * index.ntotal
+    )
+
+
+def compact_index(
+    db: SegmentedFAISS, name, index_type="auto", vector_storage="float32"
+):
+    """
+    Merges all segments of a saved vector store into a new base segment without the deleted vectors,
+    starts a new tombstone log and swaps the new index into the vector store.
+
+    Args:
+        db (SegmentedFAISS): The vector store, which must not have unsaved changes.
+        name (str): The name of the vector store.
+        index_type (str, optional): The index type of the new base segment, one of INDEX_TYPES. Defaults to "auto".
+        vector_storage (str, optional): The storage of the vectors of the new base segment, one of VECTOR_STORAGE_TYPES.
+            Defaults to "float32".
+
+    Returns:
+        dict or None: The recall of a new base segment with quantized vectors, see measure_recall,
+            or None if it has no vectors.
+    """
+    index_dir = get_index_dir(name)
+    ids = []
+    quantized = _is_quantized(vector_storage)
+
+    def iter_vectors():
+        ids.clear()
+        for vectors, vector_ids in db.index.iter_live_vectors():
+            ids.extend(vector_ids)
+            yield vectors
+
+    base = build_index(
+        iter_vectors,
+        len(db.index_to_docstore_id),
+        db.index.d,
+        db.index.metric_type,
+        index_type,
+        vector_storage,
+    )
+    _write_generation(
+        index_dir,
+        base,
+        ids,
+        db.docstore,
+        iter_vectors if quantized else None,
+    )
+    index = _load_segmented_index(index_dir, _load_manifest(index_dir))
+    index.nprobe = db.index.nprobe
+    index.ef_search = db.index.ef_search
+    # the vectors of the new generation are the live vectors of the previous one
+    recall = (
+        _check_recall(
+            index_dir,
+            index,
+            lambda: (vectors for vectors, _ in index.iter_live_vectors()),
+        )
+        if quantized
+        else None
+    )
+    db.index = index
+    db.index_to_docstore_id = SegmentedIds(index)
+    return recall
+
+
+def resolve_index_type(index_type, ntotal) -> str:
+    """
+    Resolves the index type to build for a number of vectors.
+
+    Automatically, small indexes are flat, i.e. searched exhaustively, medium sized indexes are HNSW graphs,
+    large ones IVF indexes and very large ones IVF indexes with product quantized vectors to save memory.
+    Indexes with less than ANN_MIN_VECTORS vectors are always flat.
+
+    Args:
+        index_type (str): One of INDEX_TYPES.
+        ntotal (int): The number of vectors.
+
+    Returns:
+        str: The index type to build, one of INDEX_TYPES except "auto".
+
+    Raises:
+        ValueError: If the index type is unknown.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(
+            f"Unknown vector index type {index_type}, use one of {', '.join(INDEX_TYPES)}."
+        )
+    if ntotal < ANN_MIN_VECTORS:
+        return "flat"
+    if index_type != "auto":
+        return index_type
+    if ntotal <= FLAT_MAX_VECTORS:
+        return "flat"
+    if ntotal <= HNSW_MAX_VECTORS:
+        return "hnsw"
+    if ntotal <= IVF_MAX_VECTORS:
+        return "ivf"
+    return "ivfpq"
+
+
+def build_index(
+    iter_vectors, ntotal, d, metric_type, index_type="auto", vector_storage="float32"
+):
+    """
+    Builds a FAISS index of the given index type.
+
+    IVF indexes partition the vectors into about 4 * sqrt(ntotal) clusters, which are trained on a random sample
+    of the vectors. IVF-PQ indexes additionally compress every vector to a product quantized code of d / 8 bytes.
+    IVF indexes keep a direct map of their vectors, so they can be reconstructed for max marginal relevance searches.
+    Flat, HNSW and IVF indexes store float16 or int8 scalar quantized vectors instead of float32 vectors
+    if requested, which take a half or a quarter of the memory. The int8 quantizer is trained on the value range
+    of every dimension in a sample of the vectors. IVF-PQ indexes always store product quantized codes.
+
+    Args:
+        iter_vectors (Callable[[], Iterator[np.ndarray]]): Returns an iterator over batches of the vectors
+            in the order of their positions, called once for training and once for adding the vectors.
+        ntotal (int): The number of vectors.
+        d (int): The dimension of the vectors.
+        metric_type (int): The faiss metric type.
+        index_type (str, optional): One of INDEX_TYPES. Defaults to "auto".
+        vector_storage (str, optional): One of VECTOR_STORAGE_TYPES. Defaults to "float32".
+
+    Returns:
+        faiss.Index: The built index.
+    """
+    import faiss
+
+    index_type = resolve_index_type(index_type, ntotal)
+    quantizer_type = None
+    if _is_quantized(vector_storage):
+        quantizer_type = (
+            faiss.ScalarQuantizer.QT_fp16
+            if vector_storage == "float16"
+            else faiss.ScalarQuantizer.QT_8bit
+        )
+    training_size = MAX_TRAINING_VECTORS
+    if index_type == "flat":
+        if quantizer_type is None:
+            index = faiss.IndexFlat(d, metric_type)
+        else:
+            index = faiss.IndexScalarQuantizer(d, quantizer_type, metric_type)
+    elif index_type == "hnsw":
+        if quantizer_type is None:
+            index = faiss.IndexHNSWFlat(d, HNSW_M, metric_type)
+        else:
+            index = faiss.IndexHNSWSQ(d, quantizer_type, HNSW_M, metric_type)
+    else:
+        nlist = max(1, min(int(4 * np.sqrt(ntotal)), ntotal // 39))
+        training_size = min(MAX_TRAINING_VECTORS, nlist * TRAINING_VECTORS_PER_LIST)
+        quantizer = faiss.IndexFlat(d, metric_type)
+        if index_type == "ivfpq":
+            index = faiss.IndexIVFPQ(
+                quantizer, d, nlist, _get_pq_subquantizers(d), 8, metric_type
+            )
+        elif quantizer_type is None:
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, metric_type)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer, d, nlist, quantizer_type, metric_type
+            )
+    # an index without vectors stays untrained, it is searched and compacted like an empty one
+    if not index.is_trained and ntotal:
+        index.train(_sample_vectors(iter_vectors(), ntotal, training_size))
+    for vectors in iter_vectors():
+        index.add(vectors)
+    if index_type in ["ivf", "ivfpq"]:
+        index.make_direct_map()
+    return index
+
+
+def measure_recall(
+    index: SegmentedIndex, iter_vectors, queries=RECALL_SAMPLE_QUERIES, k=RECALL_K
+) -> dict:
+    """
+    Measures the recall of a search of a segmented index with quantized vectors against an exact search
+    of the full precision vectors.
+
+    A random sample of the vectors is used as queries and the k nearest full precision vectors of every query
+    are searched exhaustively. The recall is the fraction of these vectors that the search of the index finds,
+    once with and once without re-scoring the candidates.
+
+    Args:
+        index (SegmentedIndex): The index, which must not have deleted vectors.
+        iter_vectors (Callable[[], Iterator[np.ndarray]]): Returns an iterator over batches of the full precision
+            vectors in the order of their positions.
+        queries (int, optional): The number of sample queries. Defaults to 64.
+        k (int, optional): The number of nearest vectors per query. Defaults to 10.
+
+    Returns:
+        dict: The recall with re-scoring, "recall", and without, "recall_without_rescoring", and "k".
+    """
+    import faiss
+
+    k = min(k, index.ntotal)
+    sample = _sample_vectors(iter_vectors(), index.ntotal, queries)
+    heap = faiss.ResultHeap(
+        len(sample), k, keep_max=index.metric_type == faiss.METRIC_INNER_PRODUCT
+    )
+    offset = 0
+    for vectors in iter_vectors():
+        distances, positions = faiss.knn(
+            sample,
+            np.ascontiguousarray(vectors),
+            min(k, len(vectors)),
+            index.metric_type,
+        )
+        heap.add_result(distances, np.where(positions >= 0, positions + offset, -1))
+        offset += len(vectors)
+    heap.finalize()
+
+    def recall():
+        _, positions = index.search(sample, k)
+        return float(
+            np.mean(
+                [
+                    len(set(found) & set(expected)) / k
+                    for found, expected in zip(positions, heap.I)
+                ]
+            )
+        )
+
+    rescore_factor = index.rescore_factor
+    try:
+        with_rescoring = recall()
+        index.rescore_factor = 0
+        without_rescoring = recall()
+    finally:
+        index.rescore_factor = rescore_factor
+    return {
+        "k": k,
+        "recall": with_rescoring,
+        "recall_without_rescoring": without_rescoring,
+    }
+
+
+def _check_recall(index_dir, index, iter_vectors) -> "dict | None":
+    if not index.ntotal:
+        return None
+    manifest = _load_manifest(index_dir)
+    manifest["recall"] = measure_recall(index, iter_vectors)
+    _save_manifest(index_dir, manifest)
+    return manifest["recall"]
+
+
+def _is_quantized(vector_storage) -> bool:
+    if vector_storage not in VECTOR_STORAGE_TYPES:
+        raise ValueError(
+            f"Unknown vector storage {vector_storage}, use one of {', '.join(VECTOR_STORAGE_TYPES)}."
+        )
+    return vector_storage != "float32"
+
+
+def _get_pq_subquantizers(d) -> int:
+    # one byte per subquantizer and at least 8 dimensions per subquantizer
+    for m in range(max(1, d // 8), 0, -1):
+        if d % m == 0:
+            return m
+
+
+def _sample_vectors(batches, ntotal, size) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    probability = min(1.0, size / max(ntotal, 1))
+    sample = [vectors[rng.random(len(vectors)) < probability] for vectors in batches]
+    return np.ascontiguousarray(np.concatenate(sample)[:size], dtype=np.float32)
+
+
+def _iter_vectors(index):
+    for start in range(0, index.ntotal, COMPACTION_BATCH_SIZE):
+        yield index.reconstruct_n(
+            start, min(COMPACTION_BATCH_SIZE, index.ntotal - start)
+        )
+
+
+def _write_segment(index_dir, stem, index, ids):
+    import faiss
+
+    faiss.write_index(index, os.path.join(index_dir, stem + ".faiss"))
+    with open(os.path.join(index_dir, stem + ".ids.npy"), "wb") as ids_file:
+        np.save(ids_file, np.array(ids, dtype=str))
+
+
+def _write_vectors(path, iter_vectors, ntotal, d):
+    vectors = np.lib.format.open_memmap(
+        path, mode="w+", dtype=np.float32, shape=(ntotal, d)
+    )
+    start = 0
+    for batch in iter_vectors():
+        vectors[start : start + len(batch)] = batch
+        start += len(batch)
+    vectors.flush()
+    del vectors
+
+
+def _write_generation(
+    index_dir, index, ids, docstore: SQLiteDocstore, iter_vectors=None
+):
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+    generation = (
+        _load_manifest(index_dir)["generation"] + 1
+        if os.path.exists(manifest_path)
+        else 1
+    )
+    stem = f"base-{generation}"
+    _write_segment(index_dir, stem, index, ids)
+    if iter_vectors is not None:
+        # the full precision vectors of a quantized base segment, for re-scoring its candidates
+        _write_vectors(
+            os.path.join(index_dir, stem + ".vectors.npy"),
+            iter_vectors,
+            index.ntotal,
+            index.d,
+        )
+    # positions are committed ahead of the manifest, a mismatch is repaired by load_index
+    docstore.set_positions(ids, generation)
+    docstore.commit()
+    docstore_file = os.path.basename(docstore.path)
+    _save_manifest(
+        index_dir,
+        {
+            "generation": generation,
+            "segments": [stem],
+            "tombstones": f"tombstones-{generation}.bin",
+            "tombstone_count": 0,
+            "docstore": docstore_file,
+        },
+    )
+    # files of earlier generations are only unlinked, processes that still have them open keep their view
+    for file in os.listdir(index_dir):
+        if (
+            file.startswith(("base-", "segment-", "tombstones-"))
+            and not file.startswith(stem + ".")
+        ) or (file.startswith("docstore") and not file.startswith(docstore_file)):
+            try:
+                os.remove(os.path.join(index_dir, file))
+            except OSError:
+                # still open on Windows, removed with the next generation
+                pass
+
+
+def _load_manifest(index_dir) -> dict:
+    with open(os.path.join(index_dir, MANIFEST_FILE), "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _save_manifest(index_dir, manifest):
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def _migrate_legacy_layout(name, embeddings: Embeddings):
+    index_dir = get_index_dir(name)
+    if os.path.exists(os.path.join(index_dir, MANIFEST_FILE)):
+        return
+
+    legacy_index_path = get_legacy_index_path(name)
+    if not os.path.exists(legacy_index_path):
+        raise FileNotFoundError(f"No vector store found for {name}.")
+    with open(legacy_index_path, "rb") as file:
+        legacy_db = FAISS.deserialize_from_bytes(
+            embeddings=embeddings, serialized=file.read()
+        )
+    save_index(legacy_db, name)
+    os.remove(legacy_index_path)
@@ -0,0 +1,209 @@
+import json
+import os
+
+import numpy as np
+
+from codeqai.cache import get_cache_path
+
+ONNX_MIN_COSINE_SIMILARITY = 0.98
+ONNX_MODEL_FILES = ["model-int8.onnx", "model.onnx"]
+ONNX_METADATA_FILE = "metadata.json"
+# code and prose, short and long, to compare the exported models with the original one
+ONNX_SAMPLE_TEXTS = [
+    "def add(a, b):\n    return a + b",
+    "Parses the given file bytes and extracts method nodes.",
+    "public static void main(String[] args) { System.out.println(args.length); }",
+    'fn main() {\n    let v: Vec<i32> = (0..10).map(|x| x * x).collect();\n    println!("{:?}", v);\n}',
+    "SELECT name, count(*) FROM files GROUP BY name ORDER BY 2 DESC",
+    "How are the vector ids of a file removed from the index when the file is deleted?",
+    "x",
+    " ".join(["for (int i = 0; i < n; i++) { sum += values[i]; }"] * 20),
+]
+
+
+class OnnxSentenceTransformer:
+    def __init__(self, export_dir, model_file, max_seq_length, threads=None):
+        """
+        Loads an exported SentenceTransformers model into an ONNX Runtime session on the CPU.
+
+        The instance provides the subset of the SentenceTransformer interface used for embedding documents,
+        i.e. tokenizer, max_seq_length and encode.
+
+        Args:
+            export_dir (str): The directory of the exported model and its tokenizer.
+            model_file (str): The file name of the ONNX graph within the export directory.
+            max_seq_length (int): The maximum number of tokens per text, longer texts are truncated.
+            threads (int, optional): Number of intra-op threads. Defaults to the ONNX Runtime default.
+        """
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        self.max_seq_length = max_seq_length
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(export_dir, model_file),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = [
+            model_input.name for model_input in self.session.get_inputs()
+        ]
+
+    def encode(self, texts, batch_size=32, **kwargs) -> np.ndarray:
+        """
+        Embeds the given texts.
+
+        Args:
+            texts (list[str]): The texts to embed.
+            batch_size (int, optional): Number of texts per inference run. Defaults to 32.
+
+        Returns:
+            np.ndarray: The embeddings of the texts, one row per text.
+        """
+        embeddings = []
+        for i in range(0, len(texts), batch_size):
+            features = self.tokenizer(
+                texts[i : i + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            inputs = {
+                name: features[name].astype(np.int64) for name in self.input_names
+            }
+            embeddings.append(self.session.run(["sentence_embedding"], inputs)[0])
+        return np.concatenate(embeddings)
+
+
+def load_onnx_model(model_name, threads=None) -> OnnxSentenceTransformer:
+    """
+    Loads the int8 quantized ONNX graph of a SentenceTransformers model, exporting it on first use.
+
+    Args:
+        model_name (str): The name of the SentenceTransformers model.
+        threads (int, optional): Number of intra-op threads. Defaults to the ONNX Runtime default.
+
+    Returns:
+        OnnxSentenceTransformer: The loaded model.
+    """
+    export_dir = get_onnx_export_dir(model_name)
+    metadata_path = os.path.join(export_dir, ONNX_METADATA_FILE)
+    if not os.path.exists(metadata_path):
+        export_onnx_model(model_name, export_dir)
+    with open(metadata_path, "r", encoding="utf-8") as metadata_file:
+        metadata = json.load(metadata_file)
+    return OnnxSentenceTransformer(
+        export_dir, metadata["model_file"], metadata["max_seq_length"], threads
+    )
+
+
+def get_onnx_export_dir(model_name) -> str:
+    return os.path.join(get_cache_path(), "onnx", model_name.replace("/", "--"))
+
+
+def export_onnx_model(model_name, export_dir):
+    """
+    Exports a SentenceTransformers model, including pooling and normalization, to an ONNX graph
+    and quantizes its weights to int8.
+
+    The embeddings of both graphs are compared with the embeddings of the PyTorch model for a set of sample texts.
+    The int8 graph is used if the cosine similarity of all sample embeddings is at least ONNX_MIN_COSINE_SIMILARITY,
+    otherwise the full precision graph, so vectors stay interchangeable with existing indexes.
+    The chosen graph is recorded in the metadata file, which marks the export as complete.
+
+    Args:
+        model_name (str): The name of the SentenceTransformers model.
+        export_dir (str): The directory to export the model to.
+
+    Raises:
+        ValueError: If none of the exported graphs is within the tolerance.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    class SentenceEmbedding(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(
+                {"input_ids": input_ids, "attention_mask": attention_mask}
+            )["sentence_embedding"]
+
+    os.makedirs(export_dir, exist_ok=True)
+    model = SentenceTransformer(model_name, device="cpu")
+    model.eval()
+    model.tokenizer.save_pretrained(export_dir)
+
+    full_precision_path = os.path.join(export_dir, "model.onnx")
+    features = model.tokenizer(ONNX_SAMPLE_TEXTS[:2], padding=True, return_tensors="pt")
+    with torch.no_grad():
+        torch.onnx.export(
+            SentenceEmbedding(model),
+            (features["input_ids"], features["attention_mask"]),
+            full_precision_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["sentence_embedding"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "sentence_embedding": {0: "batch"},
+            },
+            opset_version=14,
+        )
+    quantize_dynamic(
+        full_precision_path,
+        os.path.join(export_dir, "model-int8.onnx"),
+        weight_type=QuantType.QInt8,
+    )
+
+    reference = model.encode(ONNX_SAMPLE_TEXTS, convert_to_numpy=True)
+    for model_file in ONNX_MODEL_FILES:
+        onnx_model = OnnxSentenceTransformer(
+            export_dir, model_file, model.max_seq_length
+        )
+        similarity = min_cosine_similarity(
+            reference, onnx_model.encode(ONNX_SAMPLE_TEXTS)
+        )
+        if similarity >= ONNX_MIN_COSINE_SIMILARITY:
+            with open(
+                os.path.join(export_dir, ONNX_METADATA_FILE), "w", encoding="utf-8"
+            ) as metadata_file:
+                json.dump(
+                    {
+                        "model_name": model_name,
+                        "model_file": model_file,
+                        "max_seq_length": model.max_seq_length,
+                        "min_cosine_similarity": similarity,
+                    },
+                    metadata_file,
+                )
+            return
+        print(
+            f"ONNX graph {model_file} of {model_name} deviates from the original model "
+            + f"(cosine similarity {similarity:.4f})."
+        )
+    raise ValueError(f"Could not export {model_name} to ONNX within tolerance.")
+
+
+def min_cosine_similarity(expected: np.ndarray, actual: np.ndarray) -> float:
+    """
+    Returns the smallest cosine similarity of corresponding rows of two embedding matrices.
+
+    Args:
+        expected (np.ndarray): The reference embeddings.
+        actual (np.ndarray): The embeddings to compare.
+
+    Returns:
+        float: The smallest cosine similarity.
+    """
+    similarities = np.sum(expected * actual, axis=1) / (
+        np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1)
+    )
+    return float(np.min(similarities))
@@ -1,4 +1,6 @@
+import functools
 import os
+import stat
 import subprocess
 
 from git.repo import Repo
@@ -17,6 +19,7 @@ def repo_name():
     return get_git_root(os.getcwd()).split("/")[-1]
 
 
+@functools.lru_cache(maxsize=None)
 def get_git_root(path):
     """
     Retrieves the root directory of the Git repository for the given path.
@@ -32,49 +35,236 @@ def get_git_root(path):
     return git_root
 
 
-def find_file_in_git_repo(file_name):
+def get_relative_paths(file_paths, git_root=None):
     """
-    Searches for a file with the given name in the current Git repository.
+    Maps the given file paths to their paths relative to the root of the Git repository.
 
     Args:
-        file_name (str): The name of the file to search for.
+        file_paths (list[str]): The file paths, either absolute or relative to the current working directory.
+        git_root (str, optional): The root directory of the Git repository. Defaults to the repository of the
+            current working directory.
 
     Returns:
-        str or None: The full path to the file if found, otherwise None.
+        dict[str, str]: A dictionary mapping each given file path to its repository relative path using "/" separators.
+    """
+    if git_root is None:
+        git_root = get_git_root(os.getcwd())
+    return {
+        file_path: os.path.relpath(os.path.abspath(file_path), git_root).replace(
+            os.sep, "/"
+        )
+        for file_path in file_paths
+    }
+
+
+class RepoFile:
+    def __init__(self, path, relative_path, size, mode):
+        self.path = path
+        self.relative_path = relative_path
+        self.size = size
+        self.mode = mode
+
+
+def plan_files(include_untracked=True, relative_paths=None):
+    """
+    Plans the files of the current Git repository that are eligible for indexing.
+
+    The candidate files are enumerated through the git index with `git ls-files` instead of walking the working tree,
+    so files ignored by `.gitignore` are never visited. Blacklisted directories are passed to git as exclude
+    pathspecs and pruned before any path is listed. Symlinks and submodules are skipped.
+
+    Args:
+        include_untracked (bool, optional): Whether to include untracked files that are not ignored. Defaults to True.
+        relative_paths (set[str], optional): Restricts the plan to these repository relative paths. Defaults to None.
+
+    Returns:
+        list[RepoFile]: A list of files that match the whitelist extensions and are not in the blacklist
+                        directories or files, each with its repository relative path, size in bytes and git file mode.
     """
     git_root = get_git_root(os.getcwd())
+    pathspecs = [f":(exclude,glob)**/{blacklist}/**" for blacklist in BLACKLIST_DIR]
 
-    for root, dirs, files in os.walk(git_root):
-        if any(blacklist in root for blacklist in BLACKLIST_DIR):
+    entries = {}
+    try:
+        tracked = subprocess.run(
+            ["git", "ls-files", "-z", "--stage", "--", *pathspecs],
+            cwd=git_root,
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout.decode("utf-8", "replace")
+        for entry in tracked.split("\0"):
+            if not entry:
+                continue
+            # "<mode> <object> <stage>\t<path>", unmerged files are listed once per stage
+            info, path = entry.split("\t", 1)
+            entries.setdefault(path, info.split(" ", 1)[0])
+
+        if include_untracked:
+            untracked = subprocess.run(
+                [
+                    "git",
+                    "ls-files",
+                    "-z",
+                    "--others",
+                    "--exclude-standard",
+                    "--",
+                    *pathspecs,
+                ],
+                cwd=git_root,
+                stdout=subprocess.PIPE,
+                check=True,
+            ).stdout.decode("utf-8", "replace")
+            for path in untracked.split("\0"):
+                if path:
+                    entries.setdefault(path, None)
+    except subprocess.CalledProcessError as e:
+        print(f"Error executing git command: {e}")
+        return []
+
+    file_list = []
+    for relative_path, mode in entries.items():
+        if relative_paths is not None and relative_path not in relative_paths:
+            continue
+        file = relative_path.rsplit("/", 1)[-1]
+        if os.path.splitext(file)[1] not in WHITELIST_FILES or file in BLACKLIST_FILES:
+            continue
+        if mode in (GIT_MODE_SYMLINK, GIT_MODE_SUBMODULE):
             continue
-        for file in files:
-            if file == file_name:
-                return os.path.join(root, file)
+
+        path = os.path.join(git_root, relative_path)
+        try:
+            file_stat = os.lstat(path)
+        except OSError:
+            # tracked file that was deleted in the working tree
+            continue
+        if not stat.S_ISREG(file_stat.st_mode):
+            continue
+        if mode is None:
+            mode = (
+                GIT_MODE_EXECUTABLE
+                if file_stat.st_mode & stat.S_IXUSR
+                else GIT_MODE_REGULAR
+            )
+        file_list.append(RepoFile(path, relative_path, file_stat.st_size, mode))
+
+    return file_list
 
 
 def load_files():
     """
     Loads files from the current Git repository based on whitelist and blacklist criteria.
 
-    This function walks through the directory structure of the Git repository,
-    and collects files that match the whitelist extensions and are not in the blacklist directories or files.
+    This function collects the files planned by plan_files, i.e. tracked and untracked files that are not ignored,
+    match the whitelist extensions and are not in the blacklist directories or files.
 
     Returns:
         list: A list of file paths that meet the criteria.
     """
+    return [repo_file.path for repo_file in plan_files()]
+
+
+def get_head_revision():
+    """
+    Retrieves the commit hash of the current HEAD.
+
+    Returns:
+        str or None: The commit hash of HEAD, or None if the repository has no commits yet.
+    """
+    result = subprocess.run(
+        ["git", "rev-parse", "--verify", "-q", "HEAD"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    return result.stdout.strip() or None
+
+
+def get_dirty_files():
+    """
+    Retrieves the files whose working tree content differs from HEAD, including untracked files that are not ignored.
+
+    Returns:
+        list[str]: A list of repository relative paths.
+    """
     git_root = get_git_root(os.getcwd())
-    file_list = []
+    try:
+        modified = subprocess.run(
+            ["git", "diff", "-z", "--name-only", "--no-renames", "HEAD", "--"],
+            cwd=git_root,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        ).stdout.decode("utf-8", "replace")
+    except subprocess.CalledProcessError:
+        # no commits yet, every file in the index is dirty
+        modified = subprocess.run(
+            ["git", "ls-files", "-z"],
+            cwd=git_root,
+            stdout=subprocess.PIPE,
+        ).stdout.decode("utf-8", "replace")
+    untracked = subprocess.run(
+        ["git", "ls-files", "-z", "--others", "--exclude-standard"],
+        cwd=git_root,
+        stdout=subprocess.PIPE,
+    ).stdout.decode("utf-8", "replace")
 
-    for root, dirs, files in os.walk(git_root):
-        if any(blacklist in root for blacklist in BLACKLIST_DIR):
-            continue
-        for file in files:
-            file_ext = os.path.splitext(file)[1]
-            if any(whitelist == file_ext for whitelist in WHITELIST_FILES):
-                if file not in BLACKLIST_FILES:
-                    file_list.append(os.path.join(root, file))
+    dirty_files = set(modified.split("\0")) | set(untracked.split("\0"))
+    dirty_files.discard("")
+    return sorted(dirty_files)
 
-    return file_list
+
+def get_changed_files(revision, dirty_files=None):
+    """
+    Retrieves the files that changed in the working tree since the given revision.
+
+    The changes are computed from a single tree diff between the revision and the working tree,
+    which covers committed, staged and unstaged changes, plus the untracked files and the files
+    that were dirty when the revision was recorded (they may have been reverted since).
+    A renamed file shows up as a deletion of the old path and an addition of the new one.
+
+    Args:
+        revision (str): The commit hash to compute the changes from.
+        dirty_files (list[str], optional): Repository relative paths that were dirty when the revision was recorded.
+
+    Returns:
+        tuple or None: A tuple containing the list of changed or added file paths that are eligible for indexing
+                       and the list of deleted or no longer eligible file paths. None if the revision is unknown.
+    """
+    git_root = get_git_root(os.getcwd())
+    try:
+        subprocess.run(
+            ["git", "cat-file", "-e", f"{revision}^{{commit}}"],
+            cwd=git_root,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        diff = subprocess.run(
+            ["git", "diff", "-z", "--name-only", "--no-renames", revision, "--"],
+            cwd=git_root,
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout.decode("utf-8", "replace")
+        untracked = subprocess.run(
+            ["git", "ls-files", "-z", "--others", "--exclude-standard"],
+            cwd=git_root,
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout.decode("utf-8", "replace")
+    except subprocess.CalledProcessError:
+        return None
+
+    untracked_paths = set(untracked.split("\0"))
+    candidates = set(diff.split("\0")) | untracked_paths
+    candidates.update(dirty_files or [])
+    candidates.discard("")
+
+    planned_files = plan_files(relative_paths=candidates)
+    planned_paths = {repo_file.relative_path for repo_file in planned_files}
+    deleted_files = [
+        os.path.join(git_root, relative_path)
+        for relative_path in sorted(candidates - planned_paths - untracked_paths)
+    ]
+    return [repo_file.path for repo_file in planned_files], deleted_files
 
 
 def get_commit_hash(file_path):
@@ -105,6 +295,166 @@ def get_commit_hash(file_path):
         return None
 
 
+def get_commit_hashes(file_paths):
+    """
+    Retrieves the latest commit hash for each of the specified files in a single pass over the git history.
+
+    Instead of running one `git log` per file, the history is streamed once from the newest commit
+    backwards and the first commit touching a file is recorded as its latest commit.
+    Only the first parents are followed, and a merge commit lists the files it changed relative to its first parent,
+    so a file changed on a merged branch is resolved to the merge commit.
+    The walk stops as soon as every tracked file has been resolved.
+
+    Args:
+        file_paths (list[str]): The paths to the files for which to retrieve the commit hashes.
+
+    Returns:
+        dict[str, str]: A dictionary mapping each given file path to its latest commit hash.
+                        Files without any commit (e.g. untracked files) are mapped to an empty string.
+    """
+    commit_hashes = {file_path: "" for file_path in file_paths}
+    if not file_paths:
+        return commit_hashes
+
+    git_root = get_git_root(os.getcwd())
+    relative_paths = {}
+    for file_path, relative_path in get_relative_paths(file_paths, git_root).items():
+        relative_paths.setdefault(relative_path, []).append(file_path)
+
+    try:
+        result = subprocess.run(
+            ["git", "ls-files", "-z"],
+            cwd=git_root,
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+    except subprocess.CalledProcessError as e:
+        print(f"Error executing git command: {e}")
+        return commit_hashes
+
+    tracked_files = set(result.stdout.decode("utf-8", "replace").split("\0"))
+    unresolved = {path for path in relative_paths if path in tracked_files}
+    if not unresolved:
+        return commit_hashes
+
+    # Each commit is emitted as "\x01<hash>\0" followed by "\n<path>\0" for every file it touches
+    process = subprocess.Popen(
+        ["git", "log", "-m", "--first-parent", "--format=%x01%H", "--name-only", "-z"],
+        cwd=git_root,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    commit_hash = ""
+    buffer = b""
+    try:
+        while unresolved:
+            chunk = process.stdout.read(65536)
+            if not chunk:
+                break
+            tokens = (buffer + chunk).split(b"\0")
+            buffer = tokens.pop()
+            for token in tokens:
+                if token.startswith(b"\x01"):
+                    commit_hash = token[1:].decode()
+                    continue
+                path = token.lstrip(b"\n").decode("utf-8", "replace")
+                if path in unresolved:
+                    unresolved.discard(path)
+                    for file_path in relative_paths[path]:
+                        commit_hashes[file_path] = commit_hash
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+
+    return commit_hashes
+
+
+def get_blob_ids(file_paths):
+    """
+    Retrieves a content hash for each of the specified files.
+
+    For files whose working tree content matches the git index, the blob id recorded in the index is used,
+    so no file content has to be read. Modified and untracked files are hashed with `git hash-object`,
+    which yields the blob id the content would get once committed. Equal content therefore always maps
+    to the same id, regardless of which commit last touched the file or whether it is committed at all.
+
+    Args:
+        file_paths (list[str]): The paths to the files for which to retrieve the content hashes.
+
+    Returns:
+        dict[str, str]: A dictionary mapping each given file path to its git blob id.
+                        Files that could not be hashed are mapped to an empty string.
+    """
+    blob_ids = {file_path: "" for file_path in file_paths}
+    if not file_paths:
+        return blob_ids
+
+    git_root = get_git_root(os.getcwd())
+    relative_paths = {}
+    for file_path, relative_path in get_relative_paths(file_paths, git_root).items():
+        relative_paths.setdefault(relative_path, []).append(file_path)
+
+    try:
+        index = subprocess.run(
+            ["git", "ls-files", "-z", "--stage"],
+            cwd=git_root,
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout.decode("utf-8", "replace")
+        modified = subprocess.run(
+            ["git", "diff-files", "-z", "--name-only"],
+            cwd=git_root,
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout.decode("utf-8", "replace")
+    except subprocess.CalledProcessError as e:
+        print(f"Error executing git command: {e}")
+        return blob_ids
+
+    index_blob_ids = {}
+    for entry in index.split("\0"):
+        if not entry:
+            continue
+        info, path = entry.split("\t", 1)
+        _, blob_id, stage = info.split(" ")
+        if stage == "0":
+            index_blob_ids[path] = blob_id
+    modified_paths = set(modified.split("\0"))
+
+    unindexed_paths = []
+    for path in relative_paths:
+        if path in index_blob_ids and path not in modified_paths:
+            for file_path in relative_paths[path]:
+                blob_ids[file_path] = index_blob_ids[path]
+        elif "\n" not in path and os.path.isfile(os.path.join(git_root, path)):
+            unindexed_paths.append(path)
+
+    if unindexed_paths:
+        try:
+            hashed = subprocess.run(
+                ["git", "hash-object", "--stdin-paths"],
+                cwd=git_root,
+                input="\n".join(unindexed_paths) + "\n",
+                stdout=subprocess.PIPE,
+                text=True,
+                check=True,
+            ).stdout.split()
+        except subprocess.CalledProcessError as e:
+            print(f"Error executing git command: {e}")
+            return blob_ids
+        for path, blob_id in zip(unindexed_paths, hashed):
+            for file_path in relative_paths[path]:
+                blob_ids[file_path] = blob_id
+
+    return blob_ids
+
+
+GIT_MODE_REGULAR = "100644"
+GIT_MODE_EXECUTABLE = "100755"
+GIT_MODE_SYMLINK = "120000"
+GIT_MODE_SUBMODULE = "160000"
+
 BLACKLIST_DIR = [
     "__pycache__",
     ".pytest_cache",
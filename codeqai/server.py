@@ -0,0 +1,403 @@
+import contextlib
+import copy
+import json
+import os
+import secrets
+import threading
+import urllib.request
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
+
+from codeqai.cache import get_cache_path
+
+if TYPE_CHECKING:
+    from langchain.schema import Document
+
+SERVER_HOST = "127.0.0.1"
+SERVER_CONNECT_TIMEOUT = 0.5
+# the chat history of the least recently used session is dropped beyond this number of sessions
+MAX_CHAT_SESSIONS = 32
+
+
+class LocalSession:
+    def __init__(self, vector_store, memory, qa):
+        """
+        Answers searches and chat questions with a vector store and QA chain loaded in the current process.
+
+        Args:
+            vector_store (VectorStore): The loaded vector store.
+            memory (ConversationSummaryMemory): The chat history of the QA chain.
+            qa (ConversationalRetrievalChain): The QA chain.
+        """
+        self.vector_store = vector_store
+        self.memory = memory
+        self.qa = qa
+
+    def search(self, query: str, k=4) -> list[tuple["Document", "str | None", float]]:
+        """
+        Searches the documents most similar to a query.
+
+        Args:
+            query (str): The search query.
+            k (int, optional): The number of documents to return. Defaults to 4.
+
+        Returns:
+            list[tuple[Document, str | None, float]]: The found documents, the full paths of their files
+                and the distances of their vectors to the query.
+        """
+        return [
+            (document, self.vector_store.get_file_path(document), float(score))
+            for document, score in self.vector_store.similarity_search_with_score(
+                query, k=k
+            )
+        ]
+
+    def search_batch(
+        self, queries: list[str], k=4
+    ) -> list[list[tuple["Document", "str | None", float]]]:
+        """
+        Searches the documents most similar to each of several queries with one search of the vector store.
+
+        Args:
+            queries (list[str]): The search queries.
+            k (int, optional): The number of documents to return per query. Defaults to 4.
+
+        Returns:
+            list[list[tuple[Document, str | None, float]]]: The search results of every query, see search.
+        """
+        return [
+            [
+                (document, self.vector_store.get_file_path(document), score)
+                for document, score in results
+            ]
+            for results in self.vector_store.similarity_search_batch(queries, k=k)
+        ]
+
+    def chat(self, question: str) -> str:
+        return self.qa(question)["answer"]
+
+    def reset_chat(self):
+        self.memory.clear()
+
+
+class ServerClient:
+    def __init__(self, url, token):
+        """
+        A thin client of a running codeqai server, with the same interface as LocalSession.
+
+        Every client has its own chat session on the server. Found documents are returned with their page content
+        and metadata only, so the client does not need to import langchain.
+
+        Args:
+            url (str): The base url of the server.
+            token (str): The access token of the server.
+        """
+        self.url = url
+        self.token = token
+        self.session = uuid.uuid4().hex
+
+    def health(self) -> dict:
+        return self._request("/health", timeout=SERVER_CONNECT_TIMEOUT)
+
+    def search(
+        self, query: str, k=4
+    ) -> list[tuple[SimpleNamespace, "str | None", float]]:
+        results = self._request("/search", {"query": query, "k": k})
+        return [_from_search_result(result) for result in results["documents"]]
+
+    def search_batch(
+        self, queries: list[str], k=4
+    ) -> list[list[tuple[SimpleNamespace, "str | None", float]]]:
+        results = self._request("/search/batch", {"queries": queries, "k": k})
+        return [
+            [_from_search_result(result) for result in query_results]
+            for query_results in results["results"]
+        ]
+
+    def chat(self, question: str) -> str:
+        return self._request("/chat", {"session": self.session, "question": question})[
+            "answer"
+        ]
+
+    def reset_chat(self):
+        self._request("/chat/reset", {"session": self.session})
+
+    def _request(self, path, payload=None, timeout=None) -> dict:
+        request = urllib.request.Request(
+            self.url + path,
+            data=json.dumps(payload).encode("utf-8") if payload is not None else None,
+            headers={
+                "Authorization": f"Bearer {self.token}",
+                "Content-Type": "application/json",
+            },
+        )
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+
+
+class CodeQAIServer:
+    def __init__(self, repo_name, vector_store, create_qa_chain):
+        """
+        Keeps the vector store, the embeddings model and the LLM client of a repository loaded,
+        to answer searches and chat questions of thin clients over localhost HTTP.
+
+        The vector store is loaded again when its manifest changes, e.g. after a sync in another process,
+        which is cheap since the index is memory-mapped. It is loaded into a copy that replaces the current
+        vector store once it is loaded, so requests that are still answered with the previous one are not affected.
+        The previous vector store is closed once the last of these requests is answered.
+        Every client has its own chat history.
+
+        Args:
+            repo_name (str): The name of the repository.
+            vector_store (VectorStore): The loaded vector store.
+            create_qa_chain (Callable): Creates a QA chain with the LLM client, see bootstrap.create_qa_chain,
+                called with the vector store and the memory to continue or None for a new one.
+        """
+        from codeqai.index_store import MANIFEST_FILE, get_index_dir
+
+        self.repo_name = repo_name
+        self.vector_store = vector_store
+        # the number of running requests of every vector store in use
+        self.vector_store_users = {}
+        self.create_qa_chain = create_qa_chain
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.manifest_path = os.path.join(get_index_dir(repo_name), MANIFEST_FILE)
+        self.manifest = self._read_manifest()
+        self.httpd = None
+
+    def search(self, query: str, k=4) -> list[dict]:
+        with self._use_vector_store() as vector_store:
+            return [
+                _to_search_result(vector_store, document, score)
+                for document, score in vector_store.similarity_search_with_score(
+                    query, k=k
+                )
+            ]
+
+    def search_batch(self, queries: list[str], k=4) -> list[list[dict]]:
+        with self._use_vector_store() as vector_store:
+            return [
+                [
+                    _to_search_result(vector_store, document, score)
+                    for document, score in results
+                ]
+                for results in vector_store.similarity_search_batch(queries, k=k)
+            ]
+
+    def chat(self, session: str, question: str) -> str:
+        with self._use_vector_store() as vector_store:
+            with self.lock:
+                if session not in self.sessions:
+                    memory, _ = self.create_qa_chain(vector_store, None)
+                    self.sessions[session] = (memory, threading.Lock())
+                    if len(self.sessions) > MAX_CHAT_SESSIONS:
+                        self.sessions.popitem(last=False)
+                self.sessions.move_to_end(session)
+                memory, session_lock = self.sessions[session]
+            # questions of the same session are answered in order, as they extend the same history
+            with session_lock:
+                _, qa = self.create_qa_chain(vector_store, memory)
+                return qa(question)["answer"]
+
+    def reset_chat(self, session: str):
+        with self.lock:
+            self.sessions.pop(session, None)
+
+    def serve(self, port=0):
+        """
+        Serves requests until interrupted or shut down.
+
+        The address and a random access token are written to the server file of the repository,
+        which is only readable by the current user, so clients of the same user can connect.
+        The server file is removed when the server stops, unless another server of the repository replaced it.
+
+        Args:
+            port (int, optional): The port to listen on. Defaults to 0, i.e. a free port.
+        """
+        self.httpd = httpd = ThreadingHTTPServer(
+            (SERVER_HOST, port), ServerRequestHandler
+        )
+        httpd.codeqai = self
+        httpd.token = secrets.token_hex(16)
+        server_file = get_server_file(self.repo_name)
+        with os.fdopen(
+            os.open(server_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w"
+        ) as file:
+            json.dump(
+                {
+                    "url": f"http://{SERVER_HOST}:{httpd.server_address[1]}",
+                    "token": httpd.token,
+                    "pid": os.getpid(),
+                },
+                file,
+            )
+        print(
+            f"Serving {self.repo_name} on http://{SERVER_HOST}:{httpd.server_address[1]}, press Ctrl+C to stop."
+        )
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+            try:
+                with open(server_file, "r", encoding="utf-8") as file:
+                    owned = json.load(file).get("token") == httpd.token
+            except (OSError, ValueError):
+                owned = False
+            if owned:
+                os.remove(server_file)
+
+    @contextlib.contextmanager
+    def _use_vector_store(self):
+        """
+        Provides the current vector store for a request, loading it again first if its manifest changed.
+
+        The content of the manifest is compared rather than its modification time, which may not change
+        when the manifest is replaced quickly. It is read before loading, so a change during loading
+        triggers another reload.
+        A replaced vector store is closed as soon as no request uses it anymore.
+
+        Yields:
+            VectorStore: The current vector store, which stays usable until the request is answered.
+        """
+        with self.lock:
+            manifest = self._read_manifest()
+            if manifest != self.manifest:
+                vector_store = copy.copy(self.vector_store)
+                vector_store.load_documents()
+                if self.vector_store not in self.vector_store_users:
+                    self.vector_store.close()
+                self.vector_store = vector_store
+                self.manifest = manifest
+            vector_store = self.vector_store
+            self.vector_store_users[vector_store] = (
+                self.vector_store_users.get(vector_store, 0) + 1
+            )
+        try:
+            yield vector_store
+        finally:
+            with self.lock:
+                users = self.vector_store_users.pop(vector_store) - 1
+                if users:
+                    self.vector_store_users[vector_store] = users
+                elif vector_store is not self.vector_store:
+                    vector_store.close()
+
+    def _read_manifest(self) -> bytes:
+        with open(self.manifest_path, "rb") as manifest_file:
+            return manifest_file.read()
+
+
+class ServerRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/health":
+            self._respond(lambda _: {"repo": self.server.codeqai.repo_name})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if self.path == "/search":
+            self._respond(self._search)
+        elif self.path == "/search/batch":
+            self._respond(self._search_batch)
+        elif self.path == "/chat":
+            self._respond(self._chat)
+        elif self.path == "/chat/reset":
+            self._respond(self._reset_chat)
+        else:
+            self.send_error(404)
+
+    def _search(self, request) -> dict:
+        return {
+            "documents": self.server.codeqai.search(
+                request["query"], request.get("k", 4)
+            )
+        }
+
+    def _search_batch(self, request) -> dict:
+        return {
+            "results": self.server.codeqai.search_batch(
+                request["queries"], request.get("k", 4)
+            )
+        }
+
+    def _chat(self, request) -> dict:
+        return {
+            "answer": self.server.codeqai.chat(request["session"], request["question"])
+        }
+
+    def _reset_chat(self, request) -> dict:
+        self.server.codeqai.reset_chat(request["session"])
+        return {}
+
+    def _respond(self, handle):
+        if not secrets.compare_digest(
+            self.headers.get("Authorization", ""), f"Bearer {self.server.token}"
+        ):
+            self.send_error(403)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length)) if length else {}
+            status, response = 200, handle(request)
+        except Exception as e:
+            status, response = 500, {"error": str(e)}
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _to_search_result(vector_store, document, score) -> dict:
+    return {
+        "page_content": document.page_content,
+        "metadata": document.metadata,
+        "file_path": vector_store.get_file_path(document),
+        "score": float(score),
+    }
+
+
+def _from_search_result(result) -> tuple[SimpleNamespace, "str | None", float]:
+    return (
+        SimpleNamespace(
+            page_content=result["page_content"], metadata=result["metadata"]
+        ),
+        result["file_path"],
+        result["score"],
+    )
+
+
+def get_server_file(repo_name) -> str:
+    return os.path.join(get_cache_path(), f"{repo_name}.server.json")
+
+
+def connect_server(repo_name) -> "ServerClient | None":
+    """
+    Connects to the running server of a repository, see CodeQAIServer.
+
+    Args:
+        repo_name (str): The name of the repository.
+
+    Returns:
+        ServerClient or None: A client of the server, or None if no server of the repository is running.
+    """
+    try:
+        with open(get_server_file(repo_name), "r", encoding="utf-8") as file:
+            server = json.load(file)
+        client = ServerClient(server["url"], server["token"])
+        if client.health()["repo"] == repo_name:
+            return client
+    except (OSError, ValueError, KeyError):
+        # no server file, or a server that is not running anymore
+        pass
+    return None
@@ -6,7 +6,7 @@ from langchain.memory import ConversationSummaryMemory
 
 from codeqai import codeparser, repo, utils
 from codeqai.bootstrap import bootstrap
-from codeqai.cache import save_vector_cache
+from codeqai.cache import append_vector_cache, save_sync_state
 from codeqai.config import load_config
 
 
@@ -22,10 +22,14 @@ def semantic_search(repo_name: str):
             )
 
             start_line, indentation = utils.find_starting_line_and_indent(
-                doc.metadata["filename"], doc.page_content
+                vector_store.get_file_path(doc), doc.page_content, doc.metadata
             )
 
-            st.write(doc.metadata["filename"] + " -> " + doc.metadata["method_name"])
+            st.write(
+                doc.metadata.get("path", doc.metadata["filename"])
+                + " -> "
+                + doc.metadata["method_name"]
+            )
             # TODO add start_line to the code, open PR on streamlit
             st.code(
                 indentation + doc.page_content,
@@ -82,9 +86,12 @@ vector_store, memory, qa = bootstrap(config, repo_name)
 
 selected_chat = st.sidebar.radio("Select Mode", ["Search", "Chat"])
 if st.sidebar.button("Sync with current git checkout"):
-    files = repo.load_files()
-    vector_store.sync_documents(files)
-    save_vector_cache(vector_store.vector_cache, f"{repo_name}.json")
+    vector_store.sync()
+    append_vector_cache(
+        vector_store.vector_cache, vector_store.changed_paths, f"{repo_name}.json"
+    )
+    vector_store.changed_paths.clear()
+    save_sync_state(vector_store.sync_state, f"{repo_name}.sync.json")
     st.sidebar.write(
         "✅ Synced with git commit hash\n"
         + subprocess.run(
@@ -1,14 +1,26 @@
+import importlib
+
 from codeqai.treesitter.treesitter import (Treesitter,
                                                    TreesitterMethodNode)
-from codeqai.treesitter.treesitter_c import TreesitterC
-from codeqai.treesitter.treesitter_cpp import TreesitterCpp
-from codeqai.treesitter.treesitter_cs import TreesitterCsharp
-from codeqai.treesitter.treesitter_go import TreesitterGo
-from codeqai.treesitter.treesitter_java import TreesitterJava
-from codeqai.treesitter.treesitter_js import TreesitterJavascript
-from codeqai.treesitter.treesitter_kt import TreesitterKotlin
-from codeqai.treesitter.treesitter_py import TreesitterPython
-from codeqai.treesitter.treesitter_rb import TreesitterRuby
-from codeqai.treesitter.treesitter_rs import TreesitterRust
-from codeqai.treesitter.treesitter_ts import TreesitterTypescript
-from codeqai.treesitter.treesitter_hs import TreesitterHaskell
+
+# the language modules, and with them their grammars, are only imported on first access
+_LANGUAGE_MODULES = {
+    "TreesitterC": "codeqai.treesitter.treesitter_c",
+    "TreesitterCpp": "codeqai.treesitter.treesitter_cpp",
+    "TreesitterCsharp": "codeqai.treesitter.treesitter_cs",
+    "TreesitterGo": "codeqai.treesitter.treesitter_go",
+    "TreesitterJava": "codeqai.treesitter.treesitter_java",
+    "TreesitterJavascript": "codeqai.treesitter.treesitter_js",
+    "TreesitterKotlin": "codeqai.treesitter.treesitter_kt",
+    "TreesitterPython": "codeqai.treesitter.treesitter_py",
+    "TreesitterRuby": "codeqai.treesitter.treesitter_rb",
+    "TreesitterRust": "codeqai.treesitter.treesitter_rs",
+    "TreesitterTypescript": "codeqai.treesitter.treesitter_ts",
+    "TreesitterHaskell": "codeqai.treesitter.treesitter_hs",
+}
+
+
+def __getattr__(name):
+    if name in _LANGUAGE_MODULES:
+        return getattr(importlib.import_module(_LANGUAGE_MODULES[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
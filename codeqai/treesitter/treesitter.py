@@ -28,17 +28,25 @@ class Treesitter(ABC):
         method_declaration_identifier: str,
         name_identifier: str,
         doc_comment_identifier: str,
+        query: "str | None" = None,
     ):
         self.parser = get_parser(language.value)
         self.language = get_language(language.value)
         self.method_declaration_identifier = method_declaration_identifier
         self.method_name_identifier = name_identifier
         self.doc_comment_identifier = doc_comment_identifier
+        # compiled once per instance, methods, names and doc comments are then
+        # captured in a single native pass over the syntax tree
+        self.query = self.language.query(query or self._get_default_query())
 
     @staticmethod
     def create_treesitter(language: Language) -> "Treesitter":
         return TreesitterRegistry.create_treesitter(language)
 
+    @staticmethod
+    def get_treesitter(language: Language) -> "Treesitter":
+        return TreesitterRegistry.get_treesitter(language)
+
     def parse(self, file_bytes: bytes) -> list[TreesitterMethodNode]:
         """
         Parses the given file bytes and extracts method nodes.
@@ -53,52 +61,139 @@ class Treesitter(ABC):
         result = []
         methods = self._query_all_methods(self.tree.root_node)
         for method in methods:
-            method_name = self._query_method_name(method["method"])
-            doc_comment = method["doc_comment"]
             result.append(
-                TreesitterMethodNode(method_name, doc_comment, None, method["method"])
+                TreesitterMethodNode(
+                    method["name"],
+                    method["doc_comment"],
+                    method.get("source_code"),
+                    method["method"],
+                )
             )
         return result
 
+    def _get_default_query(self) -> str:
+        """
+        Builds the query for languages whose methods are identified by a single node type
+        with the name as direct child and the doc comment as preceding sibling.
+
+        Comments are captured on their own instead of with a sibling anchor, because anchors
+        do not match inside error nodes, and are assigned to the method they directly precede.
+
+        Returns:
+            str: The query source.
+        """
+        return f"""
+            ({self.method_declaration_identifier}) @method
+            ({self.method_declaration_identifier}
+                ({self.method_name_identifier}) @method_name)
+            ({self.doc_comment_identifier}) @doc_comment
+        """
+
     def _query_all_methods(
         self,
         node: tree_sitter.Node,
     ):
         """
-        Recursively queries all method nodes in the given syntax tree node.
+        Queries all method nodes in the given syntax tree node.
+
+        The captures of the compiled query are visited once in document order. Methods nested
+        inside an already captured method are part of its source code and are skipped, names
+        are assigned to the enclosing method and runs of consecutive doc comments to the
+        method they directly precede.
 
         Args:
             node (tree_sitter.Node): The root node to start the query from.
 
         Returns:
-            list: A list of dictionaries, each containing a method node and its associated doc comment (if any).
+            list: A list of dictionaries, each containing a method node, its name and its
+                  associated doc comment (if any).
         """
+        captures = sorted(
+            self.query.captures(node),
+            key=lambda capture: (capture[0].start_byte, -capture[0].end_byte),
+        )
         methods = []
-        if node.type == self.method_declaration_identifier:
-            doc_comment_node = None
-            if (
-                node.prev_named_sibling
-                and node.prev_named_sibling.type == self.doc_comment_identifier
-            ):
-                doc_comment_node = node.prev_named_sibling.text.decode()
-            methods.append({"method": node, "doc_comment": doc_comment_node})
-        else:
-            for child in node.children:
-                methods.extend(self._query_all_methods(child))
-        return methods
-
-    def _query_method_name(self, node: tree_sitter.Node):
+        method = None
+        doc_comment_nodes = []
+        for capture_node, capture_name in captures:
+            inside = method and capture_node.start_byte < method["method"].end_byte
+            if capture_name == "method":
+                if inside:
+                    method["nested"] = True
+                    continue
+                if not (
+                    doc_comment_nodes
+                    and doc_comment_nodes[-1].next_named_sibling == capture_node
+                ):
+                    doc_comment_nodes = []
+                method = {
+                    "method": capture_node,
+                    "name_nodes": [],
+                    "doc_comment_nodes": doc_comment_nodes,
+                    "nested": False,
+                }
+                methods.append(method)
+                doc_comment_nodes = []
+            elif capture_name == "method_name":
+                if inside and not method["nested"]:
+                    method["name_nodes"].append(capture_node)
+            elif capture_name == "doc_comment":
+                if inside:
+                    if self._is_docstring(method["method"], capture_node):
+                        method["doc_comment_nodes"].append(capture_node)
+                elif (
+                    doc_comment_nodes
+                    and doc_comment_nodes[-1].next_named_sibling == capture_node
+                ):
+                    doc_comment_nodes.append(capture_node)
+                else:
+                    doc_comment_nodes = [capture_node]
+        return [
+            {
+                "method": method["method"],
+                "name": self._get_method_name(method["name_nodes"]),
+                "doc_comment": self._get_doc_comment(method["doc_comment_nodes"]),
+            }
+            for method in methods
+        ]
+
+    def _get_method_name(self, name_nodes: list[tree_sitter.Node]):
         """
-        Queries the method name from the given syntax tree node.
+        Returns the method name from the name nodes captured for a method.
 
         Args:
-            node (tree_sitter.Node): The syntax tree node to query.
+            name_nodes (list[tree_sitter.Node]): The captured name nodes in document order.
 
         Returns:
             str or None: The method name if found, otherwise None.
         """
-        if node.type == self.method_declaration_identifier:
-            for child in node.children:
-                if child.type == self.method_name_identifier:
-                    return child.text.decode()
+        if name_nodes:
+            return name_nodes[0].text.decode()
         return None
+
+    def _get_doc_comment(self, doc_comment_nodes: list[tree_sitter.Node]):
+        """
+        Returns the doc comment from the comment nodes captured for a method.
+
+        Args:
+            doc_comment_nodes (list[tree_sitter.Node]): The captured comment nodes in document order.
+
+        Returns:
+            str or None: The doc comment if found, otherwise None.
+        """
+        if doc_comment_nodes:
+            return doc_comment_nodes[-1].text.decode()
+        return None
+
+    def _is_docstring(self, method_node: tree_sitter.Node, node: tree_sitter.Node):
+        """
+        Checks whether a doc comment captured inside a method documents the method itself.
+
+        Args:
+            method_node (tree_sitter.Node): The enclosing method node.
+            node (tree_sitter.Node): The captured doc comment node.
+
+        Returns:
+            bool: True if the node is the docstring of the method, otherwise False.
+        """
+        return False
@@ -8,72 +8,45 @@ from codeqai.treesitter.treesitter_registry import TreesitterRegistry
 class TreesitterCsharp(Treesitter):
     def __init__(self):
         super().__init__(
-            Language.C_SHARP, "method_declaration", "identifier", "comment"
+            Language.C_SHARP,
+            "method_declaration",
+            "identifier",
+            "comment",
+            query="""
+                (method_declaration) @method
+                (method_declaration (identifier) @method_name)
+                (comment) @doc_comment
+            """,
         )
 
-    def _query_method_name(self, node: tree_sitter.Node):
+    def _get_method_name(self, name_nodes: list[tree_sitter.Node]):
         """
-        Queries the method name from the given syntax tree node.
+        Returns the method name from the name nodes captured for a method.
 
         Args:
-            node (tree_sitter.Node): The syntax tree node to query.
+            name_nodes (list[tree_sitter.Node]): The captured name nodes in document order.
 
         Returns:
             str or None: The method name if found, otherwise None.
         """
-        first_match = None
-        if node.type == self.method_declaration_identifier:
-            for child in node.children:
-                # if the return type is an object type, then the method name
-                # is the second match
-                if child.type == self.method_name_identifier and not first_match:
-                    first_match = child.text.decode()
-                elif child.type == self.method_name_identifier and first_match:
-                    return child.text.decode()
-        return first_match
+        # if the return type is an object type, then the method name
+        # is the second match
+        if len(name_nodes) > 1:
+            return name_nodes[1].text.decode()
+        return super()._get_method_name(name_nodes)
 
-    def _query_all_methods(self, node: tree_sitter.Node):
+    def _get_doc_comment(self, doc_comment_nodes: list[tree_sitter.Node]):
         """
-        Recursively queries all method nodes in the given syntax tree node.
+        Returns the doc comment from the consecutive comment nodes preceding a method.
 
         Args:
-            node (tree_sitter.Node): The root node to start the query from.
+            doc_comment_nodes (list[tree_sitter.Node]): The captured comment nodes in document order.
 
         Returns:
-            list: A list of dictionaries, each containing a method node and its associated doc comment (if any).
+            str or None: The joined doc comment if found, otherwise None.
         """
-        methods = []
-        if node.type == self.method_declaration_identifier:
-            doc_comment_nodes = []
-            if (
-                node.prev_named_sibling
-                and node.prev_named_sibling.type == self.doc_comment_identifier
-            ):
-                current_doc_comment_node = node.prev_named_sibling
-                while (
-                    current_doc_comment_node
-                    and current_doc_comment_node.type == self.doc_comment_identifier
-                ):
-                    doc_comment_nodes.append(current_doc_comment_node.text.decode())
-                    if current_doc_comment_node.prev_named_sibling:
-                        current_doc_comment_node = (
-                            current_doc_comment_node.prev_named_sibling
-                        )
-                    else:
-                        current_doc_comment_node = None
-
-            doc_comment_str = ""
-            doc_comment_nodes.reverse()
-            for doc_comment_node in doc_comment_nodes:
-                doc_comment_str += doc_comment_node + "\n"
-            if doc_comment_str.strip() != "":
-                methods.append({"method": node, "doc_comment": doc_comment_str.strip()})
-            else:
-                methods.append({"method": node, "doc_comment": None})
-        else:
-            for child in node.children:
-                methods.extend(self._query_all_methods(child))
-        return methods
+        doc_comment = "\n".join(node.text.decode() for node in doc_comment_nodes)
+        return doc_comment.strip() or None
 
 
 TreesitterRegistry.register_treesitter(Language.C_SHARP, TreesitterCsharp)
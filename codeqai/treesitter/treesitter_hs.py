@@ -1,97 +1,75 @@
 import tree_sitter
 
 from codeqai.constants import Language
-from codeqai.treesitter.treesitter import Treesitter, TreesitterMethodNode
+from codeqai.treesitter.treesitter import Treesitter
 from codeqai.treesitter.treesitter_registry import TreesitterRegistry
 
 
 class TreesitterHaskell(Treesitter):
     def __init__(self):
-        super().__init__(Language.HASKELL, "function", "variable", "comment")
-
-    def parse(self, file_bytes: bytes) -> list[TreesitterMethodNode]:
-        """
-        Parses the given file bytes and extracts method nodes.
-
-        Args:
-            file_bytes (bytes): The content of the file to be parsed.
-
-        Returns:
-            list[TreesitterMethodNode]: A list of TreesitterMethodNode objects representing the methods in the file.
-        """
-        self.tree = self.parser.parse(file_bytes)
-        result = []
-        methods = self._query_all_methods(self.tree.root_node)
-        for method in methods:
-            method_name = self._query_method_name(method["method"])
-            doc_comment = method["doc_comment"]
-            source_code = None
-            if method["method"].type == "signature":
-                sc = map(
-                    lambda x: "\n" + x.text.decode() if x.type == "function" else "",
-                    method["method"].children,
-                )
-                source_code = method["method"].text.decode() + "".join(sc)
-            result.append(
-                TreesitterMethodNode(
-                    method_name, doc_comment, source_code, method["method"]
-                )
-            )
-        return result
+        super().__init__(
+            Language.HASKELL,
+            "function",
+            "variable",
+            "comment",
+            query="(function) @method",
+        )
 
     def _query_all_methods(
         self,
         node: tree_sitter.Node,
     ):
         """
-        Recursively queries all method nodes in the given syntax tree node.
+        Queries all method nodes in the given syntax tree node.
+
+        A function preceded by its type signature is returned as the signature, and further
+        equations of the same function are merged into the preceding method.
 
         Args:
             node (tree_sitter.Node): The root node to start the query from.
 
         Returns:
-            list: A list of dictionaries, each containing a method node and its associated doc comment (if any).
+            list: A list of dictionaries, each containing a method node, its name, its
+                  associated doc comment (if any) and its source code.
         """
         methods = []
-        if node.type == self.method_declaration_identifier:
-            doc_comment_node = None
-            if (
-                node.prev_named_sibling
-                and node.prev_named_sibling.type == self.doc_comment_identifier
-            ):
-                doc_comment_node = node.prev_named_sibling.text.decode()
-            else:
-                if (
-                    node.prev_named_sibling
-                    and node.prev_named_sibling.type == "signature"
-                ):
-                    prev_node = node.prev_named_sibling
-                    if (
-                        prev_node.prev_named_sibling
-                        and prev_node.prev_named_sibling.type
-                        == self.doc_comment_identifier
-                    ):
-                        doc_comment_node = prev_node.prev_named_sibling.text.decode()
-                    prev_node.children.append(node)
-                    node = prev_node
-            methods.append({"method": node, "doc_comment": doc_comment_node})
-        else:
-            for child in node.children:
-                current = self._query_all_methods(child)
-                if methods and current:
-                    previous = methods[-1]
-                    if self._query_method_name(
-                        previous["method"]
-                    ) == self._query_method_name(current[0]["method"]):
-                        previous["method"].children.extend(
-                            map(lambda x: x["method"], current)
-                        )
-                        methods = methods[:-1]
-                        methods.append(previous)
-                    else:
-                        methods.extend(current)
-                else:
-                    methods.extend(current)
+        end_byte = -1
+        for function_node, _ in self.query.captures(node):
+            # functions of where and let bindings are part of the enclosing function
+            if function_node.start_byte < end_byte:
+                continue
+            end_byte = function_node.end_byte
+
+            method_node = function_node
+            doc_comment_node = function_node.prev_named_sibling
+            if doc_comment_node and doc_comment_node.type == "signature":
+                method_node = doc_comment_node
+                doc_comment_node = method_node.prev_named_sibling
+
+            method_name = self._query_method_name(method_node)
+            if methods and methods[-1]["name"] == method_name:
+                methods[-1]["functions"].append(function_node)
+                continue
+            methods.append(
+                {
+                    "method": method_node,
+                    "name": method_name,
+                    "doc_comment": (
+                        doc_comment_node.text.decode()
+                        if doc_comment_node
+                        and doc_comment_node.type == self.doc_comment_identifier
+                        else None
+                    ),
+                    "functions": [function_node],
+                }
+            )
+
+        for method in methods:
+            method["source_code"] = None
+            if method["method"].type == "signature":
+                method["source_code"] = method["method"].text.decode() + "".join(
+                    "\n" + function.text.decode() for function in method["functions"]
+                )
         return methods
 
     def _query_method_name(self, node: tree_sitter.Node):
@@ -104,10 +82,9 @@ class TreesitterHaskell(Treesitter):
         Returns:
             str or None: The method name if found, otherwise None.
         """
-        if node.type == "signature" or node.type == self.method_declaration_identifier:
-            for child in node.children:
-                if child.type == self.method_name_identifier:
-                    return child.text.decode()
+        for child in node.children:
+            if child.type == self.method_name_identifier:
+                return child.text.decode()
         return None
 
 
@@ -6,7 +6,10 @@ from codeqai.treesitter.treesitter_registry import TreesitterRegistry
 class TreesitterKotlin(Treesitter):
     def __init__(self):
         super().__init__(
-            Language.KOTLIN, "function_declaration", "simple_identifier", "comment"
+            Language.KOTLIN,
+            "function_declaration",
+            "simple_identifier",
+            "multiline_comment",
         )
 
 
@@ -1,46 +1,35 @@
 import tree_sitter
 
 from codeqai.constants import Language
-from codeqai.treesitter.treesitter import Treesitter, TreesitterMethodNode
+from codeqai.treesitter.treesitter import Treesitter
 from codeqai.treesitter.treesitter_registry import TreesitterRegistry
 
 
 class TreesitterRuby(Treesitter):
     def __init__(self):
-        super().__init__(Language.RUBY, "method", "identifier", "comment")
-
-    def parse(self, file_bytes: bytes) -> list[TreesitterMethodNode]:
-        return super().parse(file_bytes)
-
-    def _query_all_methods(
-        self,
-        node: tree_sitter.Node,
-    ):
+        super().__init__(
+            Language.RUBY,
+            "method",
+            "identifier",
+            "comment",
+            query="""
+                (method) @method
+                (method (identifier) @method_name)
+                (comment) @doc_comment
+            """,
+        )
+
+    def _get_doc_comment(self, doc_comment_nodes: list[tree_sitter.Node]):
         """
-        Recursively queries all method nodes in the given syntax tree node.
+        Returns the doc comment from the consecutive comment nodes preceding a method.
 
         Args:
-            node (tree_sitter.Node): The root node to start the query from.
+            doc_comment_nodes (list[tree_sitter.Node]): The captured comment nodes in document order.
 
         Returns:
-            list: A list of dictionaries, each containing a method node and its associated doc comment (if any).
+            str: The joined doc comment, empty if the method has none.
         """
-        methods = []
-        if node.type == self.method_declaration_identifier:
-            doc_comment = []
-            doc_comment_node = node
-            while (
-                doc_comment_node.prev_named_sibling
-                and doc_comment_node.prev_named_sibling.type
-                == self.doc_comment_identifier
-            ):
-                doc_comment_node = doc_comment_node.prev_named_sibling
-                doc_comment.insert(0, doc_comment_node.text.decode())
-            methods.append({"method": node, "doc_comment": "\n".join(doc_comment)})
-        else:
-            for child in node.children:
-                methods.extend(self._query_all_methods(child))
-        return methods
+        return "\n".join(node.text.decode() for node in doc_comment_nodes)
 
 
 # Register the TreesitterRuby class in the registry
@@ -1,8 +1,29 @@
+import importlib
+import threading
+
+from codeqai import utils
 from codeqai.constants import Language
 
 
 class TreesitterRegistry:
     _registry = {}
+    # the modules register their treesitter class when they are imported on first use of the language
+    _modules = {
+        Language.C: "codeqai.treesitter.treesitter_c",
+        Language.CPP: "codeqai.treesitter.treesitter_cpp",
+        Language.C_SHARP: "codeqai.treesitter.treesitter_cs",
+        Language.GO: "codeqai.treesitter.treesitter_go",
+        Language.JAVA: "codeqai.treesitter.treesitter_java",
+        Language.JAVASCRIPT: "codeqai.treesitter.treesitter_js",
+        Language.KOTLIN: "codeqai.treesitter.treesitter_kt",
+        Language.PYTHON: "codeqai.treesitter.treesitter_py",
+        Language.RUBY: "codeqai.treesitter.treesitter_rb",
+        Language.RUST: "codeqai.treesitter.treesitter_rs",
+        Language.TYPESCRIPT: "codeqai.treesitter.treesitter_ts",
+        Language.HASKELL: "codeqai.treesitter.treesitter_hs",
+    }
+    # parsers are stateful, so the cached instances are kept per worker thread
+    _local = threading.local()
 
     @classmethod
     def register_treesitter(cls, name, treesitter_class):
@@ -10,8 +31,57 @@ class TreesitterRegistry:
 
     @classmethod
     def create_treesitter(cls, name: Language):
+        if name not in cls._registry and name in cls._modules:
+            importlib.import_module(cls._modules[name])
         treesitter_class = cls._registry.get(name)
         if treesitter_class:
             return treesitter_class()
         else:
             raise ValueError("Invalid tree type")
+
+    @classmethod
+    def get_treesitter(cls, name: Language):
+        """
+        Returns the cached treesitter instance for the given language, creating it on first use.
+
+        The instance holds the parser and the compiled language handle, so they are built once
+        per language and worker instead of once per file.
+
+        Args:
+            name (Language): The programming language.
+
+        Returns:
+            Treesitter: The treesitter instance for the language.
+        """
+        treesitters = cls._local.__dict__.setdefault("treesitters", {})
+        if name not in treesitters:
+            treesitters[name] = cls.create_treesitter(name)
+        return treesitters[name]
+
+    @classmethod
+    def get_code_splitter(cls, name: Language):
+        """
+        Returns the cached code splitter for the given language, creating it on first use.
+
+        Args:
+            name (Language): The programming language.
+
+        Returns:
+            RecursiveCharacterTextSplitter or None: The code splitter for the language,
+                                                    or None if langchain does not support the language.
+        """
+        code_splitters = cls._local.__dict__.setdefault("code_splitters", {})
+        if name not in code_splitters:
+            from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+            langchain_language = utils.get_langchain_language(name)
+            code_splitters[name] = (
+                RecursiveCharacterTextSplitter.from_language(
+                    language=langchain_language,
+                    chunk_size=512,
+                    chunk_overlap=128,
+                )
+                if langchain_language
+                else None
+            )
+        return code_splitters[name]
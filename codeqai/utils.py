@@ -1,10 +1,6 @@
 import os
 
-import langchain.text_splitter as text_splitter
-import tiktoken
-
 from codeqai.constants import Language
-from codeqai.repo import find_file_in_git_repo
 
 
 def get_programming_language(file_extension: str) -> Language:
@@ -54,6 +50,8 @@ def get_file_extension(file_name: str) -> str:
 
 
 def get_langchain_language(language: Language):
+    import langchain.text_splitter as text_splitter
+
     if language == Language.PYTHON:
         return text_splitter.Language.PYTHON
     elif language == Language.JAVASCRIPT:
@@ -93,27 +91,34 @@ def get_bold_text(text):
     return f"\033[01m{text}\033[0m"
 
 
-def find_starting_line_and_indent(filename, code_snippet):
+def find_starting_line_and_indent(file_path, code_snippet, metadata=None):
     """
     Finds the starting line number and indentation level of a code snippet within a file.
 
+    Documents parsed with their location store it in their metadata, in which case the file is not read at all.
+    Otherwise the code snippet is searched in the file content.
+
     Args:
-        filename (str): The name of the file to search within.
+        file_path (str or None): The path of the file to search within.
         code_snippet (str): The code snippet to find in the file.
+        metadata (dict, optional): The metadata of the document containing the code snippet. Defaults to None.
 
     Returns:
         tuple: A tuple containing the starting line number (int) and the indentation level (str) of the code snippet.
                If the file is not found or the code snippet is not found, returns (1, "").
     """
-    file_path = find_file_in_git_repo(filename)
-    if file_path is not None:
+    if metadata and "start_line" in metadata:
+        return metadata["start_line"], metadata.get("indent", "")
+
+    if file_path is not None and os.path.isfile(file_path):
         with open(file_path, "r") as file:
             file_content = file.read()
             start_pos = file_content.find(code_snippet)
-            return (
-                file_content.count("\n", 0, start_pos) + 1,
-                file_content[:start_pos].split("\n")[-1],
-            )
+            if start_pos != -1:
+                return (
+                    file_content.count("\n", 0, start_pos) + 1,
+                    file_content[:start_pos].split("\n")[-1],
+                )
     return 1, ""
 
 
@@ -128,5 +133,7 @@ def count_tokens(text, model="gpt-4"):
     Returns:
         int: The number of tokens in the text.
     """
+    import tiktoken
+
     enc = tiktoken.encoding_for_model(model)
     return len(enc.encode(text))
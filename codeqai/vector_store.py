@@ -1,4 +1,5 @@
 import os
+from collections.abc import Iterable
 
 import inquirer
 from langchain.embeddings.base import Embeddings
@@ -6,155 +7,460 @@ from langchain.schema import Document
 from langchain_community.vectorstores.faiss import FAISS
 
 from codeqai import utils
-from codeqai.cache import VectorCache, get_cache_path, load_vector_cache
+from codeqai.cache import (
+    SyncState,
+    VectorCache,
+    load_sync_state,
+    load_vector_cache,
+    save_sync_state,
+    save_vector_cache,
+)
 from codeqai.codeparser import parse_code_files_for_db
-from codeqai.repo import get_commit_hash
+from codeqai.docstore import SQLiteDocstore
+from codeqai.embedding_cache import embed_queries
+from codeqai.index_store import (
+    DEFAULT_EF_SEARCH,
+    DEFAULT_NPROBE,
+    SegmentedFAISS,
+    compact_index,
+    create_docstore,
+    load_index,
+    needs_compaction,
+    resolve_index_type,
+    save_index,
+)
+from codeqai.repo import (
+    get_blob_ids,
+    get_changed_files,
+    get_commit_hashes,
+    get_dirty_files,
+    get_git_root,
+    get_head_revision,
+    get_relative_paths,
+    load_files,
+    plan_files,
+)
+
+EMBEDDING_BATCH_SIZE = 1024
+# the vectors and the vector cache of an initial indexing run are written after this many batches
+INDEX_FLUSH_BATCHES = 16
 
 
 class VectorStore:
-    def __init__(self, name: str, embeddings: Embeddings):
+    def __init__(
+        self,
+        name: str,
+        embeddings: Embeddings,
+        index_type="auto",
+        vector_storage="float32",
+        nprobe=DEFAULT_NPROBE,
+        ef_search=DEFAULT_EF_SEARCH,
+    ):
+        """
+        Initializes a vector store.
+
+        Args:
+            name (str): The name of the vector store, i.e. the repository name.
+            embeddings (Embeddings): The embeddings model.
+            index_type (str, optional): The type of the FAISS index, one of index_store.INDEX_TYPES.
+                Defaults to "auto", which chooses the index type by the number of vectors.
+            vector_storage (str, optional): The storage of the indexed vectors, one of index_store.VECTOR_STORAGE_TYPES.
+                float16 and int8 quantized vectors take less memory, their search candidates are re-scored
+                with the full precision vectors kept on disk. Defaults to "float32".
+            nprobe (int, optional): Number of clusters visited by a search in an IVF index. Defaults to 16.
+            ef_search (int, optional): Size of the candidate list of a search in an HNSW index. Defaults to 64.
+        """
         self.name = name
         self.embeddings = embeddings
+        self.index_type = index_type
+        self.vector_storage = vector_storage
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.vector_cache = {}
+        self.path_index = None
+        self.changed_paths = set()
+        self.recall = None
         self.install_faiss()
 
     def load_documents(self):
         """
         Loads documents into the vector store.
 
-        This method reads the serialized FAISS index from a file, deserializes it, and loads it into the FAISS database.
+        The raw FAISS index is memory-mapped and documents are only read from the SQLite docstore when they are
+        searched, see index_store.load_index, so loading takes near-constant time regardless of the size of the vector store.
         It also loads the vector cache from a JSON file and initializes the retriever with the specified search parameters.
+        The vector store is only read, a legacy vector cache is migrated by the next sync, see migrate_vector_cache.
         """
-        with open(
-            os.path.join(get_cache_path(), f"{self.name}.faiss.bytes"), "rb"
-        ) as file:
-            index = file.read()
-
-        self.db = FAISS.deserialize_from_bytes(
-            embeddings=self.embeddings, serialized=index
-        )
+        self.db = load_index(self.name, self.embeddings, self.nprobe, self.ef_search)
+        self.changed_paths = set()
+        self.recall = None
         self.vector_cache = load_vector_cache(f"{self.name}.json")
+        self.sync_state = load_sync_state(f"{self.name}.sync.json")
+        self.path_index = None
         self.retriever = self.db.as_retriever(search_type="mmr", search_kwargs={"k": 8})
 
-    def index_documents(self, documents: list[Document]):
+    def migrate_vector_cache(self):
+        """
+        Migrates vector cache entries keyed by file basename to repository relative paths.
+
+        Earlier versions keyed the vector cache by file basename, so files with the same name in different
+        directories shared one entry. Entries whose basename matches exactly one file in the repository are
+        re-keyed to its path. The vectors of all other entries are deleted and a full sync is enforced,
+        so the affected files are indexed again under their own paths.
+        The deletions are only applied in memory, sync runs the migration and saves them along with the sync.
+        """
+        legacy_keys = [
+            key for key, cache_item in self.vector_cache.items() if not cache_item.path
+        ]
+        if not legacy_keys:
+            return
+
+        paths_by_filename = {}
+        for repo_file in plan_files():
+            paths_by_filename.setdefault(
+                os.path.basename(repo_file.relative_path), []
+            ).append(repo_file.relative_path)
+
+        for key in legacy_keys:
+            cache_item = self.vector_cache.pop(key)
+            self.changed_paths.add(key)
+            paths = paths_by_filename.get(cache_item.filename, [])
+            if len(paths) == 1 and paths[0] not in self.vector_cache:
+                cache_item.path = paths[0]
+                self.vector_cache[paths[0]] = cache_item
+                self.changed_paths.add(paths[0])
+            else:
+                try:
+                    self.db.delete(cache_item.vector_ids)
+                except Exception as e:
+                    print(f"Error deleting vectors for file {cache_item.filename}: {e}")
+        self.sync_state = None
+
+    def index_documents(self, documents: Iterable[Document]):
         """
         Indexes the given documents and stores them in the vector store.
 
-        This method creates a FAISS index from the provided documents and serializes it to a file.
+        The documents are consumed in batches, every batch is embedded and appended to the FAISS index
+        before the next one is requested, so a lazily parsed stream of documents is never materialized
+        in memory at once. Every INDEX_FLUSH_BATCHES batches the new vectors are saved as a segment
+        along with the vector cache, so only the vectors since the last flush are held in memory and an
+        interrupted run keeps the documents indexed so far. Its vector cache is saved with a sync state
+        without revision, so the next sync visits all files and indexes the remaining ones.
+        Finally the segments are merged into a base segment of the configured index type and vector storage,
+        see index_store.compact_index, which reads the vectors from the memory-mapped segments.
         It also creates a vector cache for quick lookup of document vectors and initializes the retriever.
 
         Args:
-            documents (list[Document]): A list of Document objects to be indexed.
+            documents (Iterable[Document]): The Document objects to be indexed, e.g. a generator as
+                returned by codeparser.iter_code_files_for_db.
         """
         self.vector_cache = {}
-        self.db = FAISS.from_documents(documents, self.embeddings)
-        index = self.db.serialize_to_bytes()
-        with open(
-            os.path.join(get_cache_path(), f"{self.name}.faiss.bytes"), "wb"
-        ) as binary_file:
-            binary_file.write(index)
-        # Create vector cache
-        index_to_docstore_id = self.db.index_to_docstore_id
-        for i in range(len(documents)):
-            document = self.db.docstore.search(index_to_docstore_id[i])
-            if document and isinstance(document, Document):
-                # Check if the document is already present in the vector cache
-                # if yes, then add the vector id to the vector cache entry
-                if self.vector_cache.get(document.metadata["filename"]):
-                    self.vector_cache[document.metadata["filename"]].vector_ids.append(
-                        index_to_docstore_id[i]
-                    )
-                # if no, then create a new entry in the vector cache
-                else:
-                    self.vector_cache[document.metadata["filename"]] = VectorCache(
-                        document.metadata["filename"],
-                        [index_to_docstore_id[i]],
-                        document.metadata["commit_hash"],
-                    )
+        self.path_index = None
+        self.changed_paths = set()
+        self.sync_state = SyncState(get_head_revision(), get_dirty_files())
+        self.recall = None
+        self.db = None
+        for i, batch in enumerate(self._batch_documents(documents), 1):
+            if self.db is None:
+                self.db = FAISS.from_documents(
+                    batch, self.embeddings, docstore=create_docstore(self.name)
+                )
+                vector_ids = list(self.db.index_to_docstore_id.values())
+            else:
+                vector_ids = self.db.add_documents(batch)
+            self._add_to_vector_cache(batch, vector_ids)
+            if i % INDEX_FLUSH_BATCHES == 0:
+                self._flush_index()
+        if self.db is None:
+            raise ValueError("No documents found to index.")
+        self._flush_index()
+
+        index = self.db.index
+        if (
+            len(index.segments) > 1
+            or resolve_index_type(self.index_type, index.ntotal) != "flat"
+            or self.vector_storage != "float32"
+        ):
+            self.recall = compact_index(
+                self.db, self.name, self.index_type, self.vector_storage
+            )
 
         self.retriever = self.db.as_retriever(search_type="mmr", search_kwargs={"k": 8})
 
-    def sync_documents(self, files):
+    def _flush_index(self):
+        # the first flush writes a flat base segment, later ones only the vectors added since, see index_store.save_index
+        if isinstance(self.db, SegmentedFAISS):
+            save_index(self.db, self.name)
+        else:
+            save_index(self.db, self.name, "flat", "float32")
+            self.db = load_index(
+                self.name, self.embeddings, self.nprobe, self.ef_search
+            )
+        save_vector_cache(self.vector_cache, f"{self.name}.json")
+        save_sync_state(SyncState(None, []), f"{self.name}.sync.json")
+
+    def _batch_documents(self, documents: Iterable[Document]):
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= EMBEDDING_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _add_to_vector_cache(self, documents: list[Document], vector_ids: list[str]):
+        for document, vector_id in zip(documents, vector_ids):
+            path = document.metadata.get("path", document.metadata["filename"])
+            # Check if the document is already present in the vector cache
+            # if yes, then add the vector id to the vector cache entry
+            if self.vector_cache.get(path):
+                self.vector_cache[path].vector_ids.append(vector_id)
+            # if no, then create a new entry in the vector cache
+            else:
+                self.vector_cache[path] = VectorCache(
+                    document.metadata["filename"],
+                    [vector_id],
+                    document.metadata["commit_hash"],
+                    document.metadata.get("blob_id", ""),
+                    path,
+                )
+
+    def sync(self):
+        """
+        Synchronizes the vector store with the current git checkout.
+
+        If the vector store knows the revision it was last built or synced from, only the files that changed
+        since that revision are visited, so the sync time scales with the size of the change.
+        Otherwise all files of the repository are synchronized.
+        A vector cache of an earlier version is migrated first, which enforces a full sync.
+        """
+        self.migrate_vector_cache()
+        sync_state = SyncState(get_head_revision(), get_dirty_files())
+        changes = None
+        if self.sync_state and self.sync_state.revision:
+            changes = get_changed_files(
+                self.sync_state.revision, self.sync_state.dirty_files
+            )
+
+        if changes is None:
+            self.sync_documents(load_files())
+        else:
+            changed_files, deleted_files = changes
+            self.sync_documents(changed_files, deleted_files)
+        self.sync_state = sync_state
+
+    def sync_documents(self, files, deleted_files=None):
         """
         Synchronizes the documents in the vector store with the provided files.
 
-        This method checks if the documents in the vector store are up-to-date with the provided files.
+        This method checks if the documents in the vector store are up-to-date with the provided files
+        by comparing the git blob id of their current content with the cached one, so uncommitted changes
+        are picked up as well and commits that do not change the content are ignored.
         If a document has been modified, it deletes the old vectors and adds new vectors.
         If a document is new, it adds the document to the vector store.
-        It also removes old documents that are no longer present in the provided files.
+        It also removes old documents that are no longer present in the provided files,
+        or only the given deleted files if the provided files are just the changed subset of the repository.
+
+        The sync runs in phases: the full change set is planned first, then all modified and new files
+        are parsed together in parallel and their chunks are embedded in batches of EMBEDDING_BATCH_SIZE.
+        Only then all deletions and insertions are applied to the vector store and saved at once,
+        so a failing parse or embedding request leaves the vector store unchanged.
 
         Args:
             files (list[str]): List of file paths to synchronize with the vector store.
+            deleted_files (list[str], optional): List of deleted file paths. If None, the provided files are
+                treated as the complete set of files and all other documents are removed. Defaults to None.
         """
-        new_filenames = set()
+        self.path_index = None
+        relative_paths = get_relative_paths(files)
+        blob_ids = get_blob_ids(files)
+        # Cache entries written before content hashing only know the commit hash of the file
+        legacy_files = [
+            file
+            for file in files
+            if relative_paths[file] in self.vector_cache
+            and not self.vector_cache[relative_paths[file]].blob_id
+        ]
+        commit_hashes = get_commit_hashes(legacy_files)
+
+        # Plan the change set
+        new_paths = set()
+        modified_files = []
         for file in files:
-            filename = os.path.basename(file)
-            new_filenames.add(filename)
-            commit_hash = get_commit_hash(file)
+            path = relative_paths[file]
+            new_paths.add(path)
             # Check if the document is already present in the vector cache
-            # if yes, then check if the document has been modified or not
-            if filename in self.vector_cache:
-                # Check if the document has been modified, if yes delete all old vectors and add new vector
-                if self.vector_cache[filename].commit_hash != commit_hash:
-                    # This will delete all the vectors associated with the document
-                    # incluing db.index_to_docstore_id, db.docstore and db.index
-                    try:
-                        self.db.delete(self.vector_cache[filename].vector_ids)
-                    except Exception as e:
-                        print(f"Error deleting vectors for file {filename}: {e}")
-
-                    # Add the new document to the vector store and recreate the vector cache entry
-                    self.vector_cache[filename] = VectorCache(
-                        filename,
-                        [],
-                        commit_hash,
-                    )
-                    documents = parse_code_files_for_db([file])
-                    for document in documents:
-                        self.db.add_documents([document])
-                        self.vector_cache[filename].vector_ids.append(
-                            self.db.index_to_docstore_id[
-                                len(self.db.index_to_docstore_id) - 1
-                            ]
-                        )
+            # if yes, then check if the content of the document has been modified or not
+            if path in self.vector_cache:
+                cache_item = self.vector_cache[path]
+                if cache_item.blob_id:
+                    unchanged = cache_item.blob_id == blob_ids[file]
+                else:
+                    unchanged = cache_item.commit_hash == commit_hashes[file]
+                if unchanged:
+                    if cache_item.blob_id != blob_ids[file]:
+                        cache_item.blob_id = blob_ids[file]
+                        self.changed_paths.add(path)
+                    continue
+            modified_files.append(file)
+        if deleted_files is None:
+            removed_paths = set(self.vector_cache) - new_paths
+        else:
+            removed_paths = set(get_relative_paths(deleted_files).values()) - new_paths
 
-            # if no, then create a new entry in the vector cache and add the document to the vector store
-            else:
-                self.vector_cache[filename] = VectorCache(
-                    filename,
-                    [],
-                    commit_hash,
-                )
-                documents = parse_code_files_for_db([file])
-                for document in documents:
-                    self.db.add_documents([document])
-                    self.vector_cache[filename].vector_ids.append(
-                        self.db.index_to_docstore_id[
-                            len(self.db.index_to_docstore_id) - 1
-                        ]
+        # Only the modified and new documents are parsed and embedded again, all files at once
+        commit_hashes.update(
+            get_commit_hashes(
+                [file for file in modified_files if file not in commit_hashes]
+            )
+        )
+        documents = (
+            parse_code_files_for_db(modified_files, commit_hashes, blob_ids)
+            if modified_files
+            else []
+        )
+        batches = []
+        for batch in self._batch_documents(documents):
+            texts = [document.page_content for document in batch]
+            batches.append((batch, self.embeddings.embed_documents(texts)))
+
+        # Apply all deletions and insertions, which are saved together
+        for file in modified_files:
+            path = relative_paths[file]
+            cache_item = self.vector_cache.get(path)
+            if cache_item is not None:
+                self._delete_vectors(cache_item.vector_ids, path)
+            self.changed_paths.add(path)
+            self.vector_cache[path] = VectorCache(
+                os.path.basename(file),
+                [],
+                commit_hashes[file],
+                blob_ids[file],
+                path,
+            )
+        for removed_path in removed_paths:
+            cache_item = self.vector_cache.pop(removed_path, None)
+            if cache_item is None:
+                continue
+            self.changed_paths.add(removed_path)
+            self._delete_vectors(cache_item.vector_ids, removed_path)
+        for batch, embeddings in batches:
+            vector_ids = self.db.add_embeddings(
+                zip([document.page_content for document in batch], embeddings),
+                [document.metadata for document in batch],
+            )
+            self._add_to_vector_cache(batch, vector_ids)
+
+        # only the added vectors and the deleted positions are written, see index_store.save_index
+        if self.db.index.has_changes():
+            save_index(self.db, self.name)
+        if needs_compaction(self.db):
+            self.recall = compact_index(
+                self.db, self.name, self.index_type, self.vector_storage
+            )
+
+    def _delete_vectors(self, vector_ids: list[str], path: str):
+        # deletes all the vectors associated with the document
+        # incluing db.index_to_docstore_id, db.docstore and db.index
+        if not vector_ids:
+            return
+        try:
+            self.db.delete(vector_ids)
+        except Exception as e:
+            print(f"Error deleting vectors for file {path}: {e}")
+
+    def compact(self):
+        """
+        Merges the segments of the vector store into a single one and drops the deleted vectors from disk.
+
+        Syncs append changes to the vector store as new segments, which is compacted automatically
+        once there are too many of them or too many vectors are deleted.
+        """
+        if self.db.index.has_changes():
+            save_index(self.db, self.name)
+        self.recall = compact_index(
+            self.db, self.name, self.index_type, self.vector_storage
+        )
+
+    def close(self):
+        """
+        Closes the docstore of the vector store and releases its index, whose segments are unmapped
+        once no other vector store refers to them.
+        """
+        if self.db is not None and isinstance(self.db.docstore, SQLiteDocstore):
+            self.db.docstore.close()
+        self.db = None
+        self.retriever = None
+
+    def get_file_path(self, document: Document):
+        """
+        Resolves the path of the file a document was parsed from.
+
+        Documents store their repository relative path in their metadata. For documents indexed before that,
+        the path is looked up by file name in the path keyed vector cache, so the repository is never walked.
+
+        Args:
+            document (Document): A document of the vector store.
+
+        Returns:
+            str or None: The full path to the file if it can be resolved unambiguously, otherwise None.
+        """
+        path = document.metadata.get("path")
+        if path is None:
+            if self.path_index is None:
+                self.path_index = {}
+                for cache_path in self.vector_cache:
+                    self.path_index.setdefault(os.path.basename(cache_path), []).append(
+                        cache_path
                     )
+            paths = self.path_index.get(document.metadata["filename"], [])
+            if len(paths) != 1:
+                return None
+            path = paths[0]
+        return os.path.join(get_git_root(os.getcwd()), path)
 
-        # Remove old documents from the vector store
-        deleted_files = []
-        for cache_item in self.vector_cache.values():
-            if cache_item.filename not in new_filenames:
-                try:
-                    self.db.delete(cache_item.vector_ids)
-                except Exception as e:
-                    print(f"Error deleting vectors for file {cache_item.filename}: {e}")
-                deleted_files.append(cache_item.filename)
+    def similarity_search(self, query: str, k=4):
+        return self.db.similarity_search(query, k=k)
 
-        # Remove old filenames from the vector cache
-        for deleted_file in deleted_files:
-            self.vector_cache.pop(deleted_file)
+    def similarity_search_with_score(
+        self, query: str, k=4
+    ) -> list[tuple[Document, float]]:
+        """
+        Searches the documents most similar to a query along with their scores.
 
-        index = self.db.serialize_to_bytes()
-        with open(
-            os.path.join(get_cache_path(), f"{self.name}.faiss.bytes"), "wb"
-        ) as binary_file:
-            binary_file.write(index)
+        Args:
+            query (str): The search query.
+            k (int, optional): The number of documents to return. Defaults to 4.
+
+        Returns:
+            list[tuple[Document, float]]: The found documents and the distances of their vectors to the query,
+                lower is more similar.
+        """
+        return self.db.similarity_search_with_score(query, k=k)
+
+    def similarity_search_batch(
+        self, queries: list[str], k=4
+    ) -> list[list[tuple[Document, float]]]:
+        """
+        Searches the documents most similar to each of several queries.
 
-    def similarity_search(self, query: str):
-        return self.db.similarity_search(query, k=4)
+        All queries are embedded together, see embedding_cache.embed_queries, and searched with one search
+        of the index, so the per query overhead of both is only paid once. Like single queries, the queries
+        are not written to the embedding cache.
+
+        Args:
+            queries (list[str]): The search queries.
+            k (int, optional): The number of documents to return per query. Defaults to 4.
+
+        Returns:
+            list[list[tuple[Document, float]]]: The found documents of every query and the distances
+                of their vectors to the query, lower is more similar, in the order of the queries.
+        """
+        if not queries:
+            return []
+        embeddings = embed_queries(self.embeddings, list(queries))
+        return self.db.similarity_search_with_score_by_vectors(embeddings, k=k)
 
     def install_faiss(self):
         try:
@@ -0,0 +1,93 @@
+import json
+
+import pytest
+from langchain.schema import Document
+
+from codeqai import app
+
+
+class FakeSession:
+    def __init__(self):
+        self.searches = []
+        self.history = []
+
+    def search(self, query, k=4):
+        self.searches.append((query, k))
+        return [
+            (
+                Document(
+                    page_content="def main():\n    pass",
+                    metadata={
+                        "filename": "main.py",
+                        "path": "src/main.py",
+                        "method_name": "main",
+                        "start_line": 3,
+                        "end_line": 4,
+                    },
+                ),
+                "/repo/src/main.py",
+                0.5,
+            )
+        ]
+
+    def search_batch(self, queries, k=4):
+        return [self.search(query, k) for query in queries]
+
+    def chat(self, question):
+        self.history.append(question)
+        return f"{len(self.history)}: {question}"
+
+    def reset_chat(self):
+        self.history = []
+
+
+def test_read_queries(tmp_path):
+    queries_file = tmp_path / "queries.txt"
+    queries_file.write_text("first\n\n  second  \n")
+
+    assert app.read_queries(None, None) == []
+    assert app.read_queries("main", None) == ["main"]
+    assert app.read_queries("main", str(queries_file)) == ["main", "first", "second"]
+
+
+def test_run_rejects_queries_of_other_actions_before_reading_them(monkeypatch, mocker):
+    monkeypatch.setattr("sys.argv", ["codeqai", "sync", "--queries", "-"])
+    read_queries = mocker.patch("codeqai.app.read_queries")
+
+    with pytest.raises(SystemExit):
+        app.run()
+
+    read_queries.assert_not_called()
+
+
+def test_run_queries_search_json(capsys):
+    session = FakeSession()
+
+    app.run_queries("search", session, ["main", "parse"], k=2, output_json=True)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert session.searches == [("main", 2), ("parse", 2)]
+    assert [json.loads(line)["query"] for line in lines] == ["main", "parse"]
+    assert json.loads(lines[0])["results"] == [
+        {
+            "path": "src/main.py",
+            "method_name": "main",
+            "start_line": 3,
+            "end_line": 4,
+            "score": 0.5,
+            "content": "def main():\n    pass",
+        }
+    ]
+
+
+def test_run_queries_chat_json(capsys):
+    session = FakeSession()
+
+    app.run_queries("chat", session, ["first", "second"], output_json=True)
+
+    lines = capsys.readouterr().out.splitlines()
+    # every question is answered without the history of the previous ones
+    assert [json.loads(line) for line in lines] == [
+        {"question": "first", "answer": "1: first"},
+        {"question": "second", "answer": "1: second"},
+    ]
@@ -0,0 +1,43 @@
+import os
+
+from codeqai.cache import (
+    VectorCache,
+    append_vector_cache,
+    load_vector_cache,
+    save_vector_cache,
+)
+
+
+def test_append_vector_cache(tmp_path, mocker):
+    mocker.patch("codeqai.cache.get_cache_path", return_value=str(tmp_path))
+    vector_cache = {
+        f"src/file_{i}.py": VectorCache(
+            f"file_{i}.py", [str(i)], "1", "a", f"src/file_{i}.py"
+        )
+        for i in range(10)
+    }
+    save_vector_cache(vector_cache, "test.json")
+    size = os.path.getsize(tmp_path / "test.json")
+
+    vector_cache["src/file_1.py"].vector_ids = ["11"]
+    vector_cache["src/new.py"] = VectorCache("new.py", ["12"], "2", "b", "src/new.py")
+    del vector_cache["src/file_2.py"]
+    append_vector_cache(
+        vector_cache, ["src/file_1.py", "src/new.py", "src/file_2.py"], "test.json"
+    )
+    # an interrupted append is skipped
+    with open(tmp_path / "test.json.log", "a", encoding="utf-8") as log_file:
+        log_file.write('{"key": "src/fi')
+    vector_cache["src/file_3.py"].blob_id = "c"
+    append_vector_cache(vector_cache, ["src/file_3.py"], "test.json")
+
+    assert os.path.getsize(tmp_path / "test.json") == size
+    loaded_vector_cache = load_vector_cache("test.json")
+    assert {key: value.to_json() for key, value in loaded_vector_cache.items()} == {
+        key: value.to_json() for key, value in vector_cache.items()
+    }
+
+    # a change log larger than the vector cache is merged into it
+    append_vector_cache(vector_cache, list(vector_cache) * 2, "test.json")
+    assert not os.path.exists(tmp_path / "test.json.log")
+    assert len(load_vector_cache("test.json")) == 10
@@ -0,0 +1,75 @@
+import os
+
+from codeqai import codeparser
+
+SOURCE = '''import os
+
+
+def top():
+    """Top level function."""
+    return os.getcwd()
+
+
+class Service:
+    def run(self):
+        return top()
+'''
+
+
+def test_parse_code_files_for_db(git_repo):
+    (git_repo / "service.py").write_text(SOURCE)
+    file = os.path.join(git_repo, "service.py")
+
+    documents = codeparser.parse_code_files_for_db([file])
+
+    assert [document.metadata["method_name"] for document in documents] == [
+        "top",
+        "run",
+    ]
+    lines = SOURCE.split("\n")
+    for document in documents:
+        metadata = document.metadata
+        assert metadata["path"] == "service.py"
+        assert metadata["commit_hash"] == ""
+        assert metadata["indent"] + document.page_content == "\n".join(
+            lines[metadata["start_line"] - 1 : metadata["end_line"]]
+        )
+    assert documents[1].metadata["start_line"] == 10
+    assert documents[1].metadata["indent"] == "    "
+
+
+def test_parse_code_files_for_db_in_parallel(git_repo):
+    files = []
+    for i in range(codeparser.PARALLEL_MIN_FILES + 8):
+        file = git_repo / f"module_{i}.py"
+        file.write_text(SOURCE * (i % 5 + 1))
+        files.append(str(file))
+
+    sequential = codeparser.parse_code_files_for_db(files, workers=1)
+    parallel = codeparser.parse_code_files_for_db(files, workers=2)
+
+    assert len(parallel) == len(sequential)
+    assert [document.page_content for document in parallel] == [
+        document.page_content for document in sequential
+    ]
+    assert [document.metadata for document in parallel] == [
+        document.metadata for document in sequential
+    ]
+
+
+def test_iter_code_files_for_db(git_repo):
+    files = []
+    for i in range(codeparser.PARALLEL_MIN_FILES + 8):
+        file = git_repo / f"module_{i}.py"
+        file.write_text(SOURCE * (i % 5 + 1))
+        files.append(str(file))
+
+    documents = codeparser.iter_code_files_for_db(files, workers=2)
+    streamed = [
+        (document.metadata["path"], document.page_content) for document in documents
+    ]
+
+    parsed = codeparser.parse_code_files_for_db(files, workers=1)
+    assert sorted(streamed) == sorted(
+        (document.metadata["path"], document.page_content) for document in parsed
+    )
@@ -1,6 +1,7 @@
 import subprocess
 import sys
 
+from tests.fixtures.git_repo import git_repo, git_repo_with_merge
 from tests.fixtures.vector_entries import (
     file_names,
     modified_vector_entries,
@@ -0,0 +1,65 @@
+import pytest
+from langchain.schema import Document
+
+from codeqai.docstore import SQLiteDocstore
+
+
+def create_document(path, method_name, start_line):
+    return Document(
+        page_content=f"def {method_name}():\n    pass",
+        metadata={
+            "filename": path.split("/")[-1],
+            "path": path,
+            "method_name": method_name,
+            "start_line": start_line,
+            "end_line": start_line + 1,
+            "commit_hash": "1",
+        },
+    )
+
+
+def test_sqlite_docstore(tmp_path):
+    docstore = SQLiteDocstore(str(tmp_path / "docstore.sqlite"))
+    documents = {
+        "a": create_document("src/main.py", "main", 10),
+        "b": create_document("src/main.py", "setup", 1),
+        "c": create_document("utils.py", "util", 1),
+    }
+    docstore.add(documents)
+
+    assert docstore.search("a") == documents["a"]
+    assert docstore.search("d") == "ID d not found."
+    assert docstore.get_documents(["c", "a", "d", "a"]) == {
+        "a": documents["a"],
+        "c": documents["c"],
+    }
+    with pytest.raises(ValueError):
+        docstore.add({"c": documents["c"]})
+
+    docstore.delete(["b"])
+    with pytest.raises(ValueError):
+        docstore.delete(["b"])
+    assert len(docstore) == 2
+
+    # uncommitted changes are not persisted
+    docstore.commit()
+    docstore.delete(["c"])
+    assert len(SQLiteDocstore(docstore.path)) == 2
+
+
+def test_sqlite_docstore_positions(tmp_path):
+    docstore = SQLiteDocstore(str(tmp_path / "docstore.sqlite"))
+    docstore.add(
+        {
+            "a": create_document("src/main.py", "main", 10),
+            "b": create_document("src/main.py", "setup", 1),
+        }
+    )
+    assert docstore.get_generation() is None
+    assert docstore.get_positions(["a", "b"]) == {}
+
+    docstore.set_positions(["b", "a"], 1)
+    docstore.add({"c": create_document("utils.py", "util", 1)}, {"c": 2})
+
+    assert docstore.get_generation() == 1
+    assert docstore.get_positions(["a", "c", "d"]) == {"a": 1, "c": 2}
@@ -0,0 +1,41 @@
+import pytest
+from langchain_core.embeddings import FakeEmbeddings
+
+from codeqai.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+
+def test_cached_embeddings(tmp_path, mocker):
+    embeddings = FakeEmbeddings(size=8)
+    embed_documents = mocker.spy(FakeEmbeddings, "embed_documents")
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+    cached_embeddings = CachedEmbeddings(embeddings, "model", cache)
+
+    first = cached_embeddings.embed_documents(["a", "b", "a"])
+    assert embed_documents.call_args.args[1] == ["a", "b"]
+    assert first[0] == first[2]
+
+    # a new cache instance reads the embeddings back from disk
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+    cached_embeddings = CachedEmbeddings(embeddings, "model", cache)
+    second = cached_embeddings.embed_documents(["b", "c", "a"])
+    assert embed_documents.call_count == 2
+    assert embed_documents.call_args.args[1] == ["c"]
+    # vectors are stored in single precision, like in the FAISS index
+    assert second[0] == pytest.approx(first[1], rel=1e-6)
+    assert second[2] == pytest.approx(first[0], rel=1e-6)
+
+    # embeddings of other models are not shared
+    CachedEmbeddings(embeddings, "other-model", cache).embed_documents(["a"])
+    assert embed_documents.call_args.args[1] == ["a"]
+
+
+def test_embedding_cache_evicts_least_recently_used(tmp_path):
+    vector_size = 8 * 4
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"), 3.5 * vector_size)
+    cache.put("model", {"a": [0.0] * 8, "b": [1.0] * 8, "c": [2.0] * 8})
+    cache.connection.execute("UPDATE embeddings SET accessed = 0 WHERE text_hash = 'b'")
+
+    cache.put("model", {"d": [3.0] * 8})
+
+    assert set(cache.get("model", ["a", "b", "c", "d"])) == {"a", "c", "d"}
+    assert cache.size == 3 * vector_size
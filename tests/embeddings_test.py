@@ -0,0 +1,257 @@
+import json
+import re
+import threading
+import time
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+from codeqai.constants import EmbeddingsModel
+from codeqai.embeddings import (
+    EMBEDDINGS_MAX_INPUT_TOKENS,
+    Embeddings,
+    LocalEmbeddings,
+    RemoteEmbeddings,
+)
+
+
+class FakeEmbeddingsServer(ThreadingHTTPServer):
+    def __init__(self, rate_limited_requests=0):
+        super().__init__(("127.0.0.1", 0), FakeEmbeddingsHandler)
+        self.rate_limited_requests = rate_limited_requests
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1/embeddings"
+
+
+class FakeEmbeddingsHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests.append(payload["input"])
+            rate_limited = server.rate_limited_requests > 0
+            server.rate_limited_requests -= 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            if rate_limited:
+                self.send_response(429)
+                self.send_header("retry-after-ms", "50")
+                self.end_headers()
+                return
+            # keep requests open long enough to overlap
+            time.sleep(0.05)
+            body = json.dumps(
+                {
+                    "data": [
+                        {"index": i, "embedding": [float(len(text)), float(i)]}
+                        for i, text in reversed(list(enumerate(payload["input"])))
+                    ]
+                }
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fake_server(request):
+    server = FakeEmbeddingsServer(getattr(request, "param", 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class FakeTokenizer:
+    # words are single tokens, every other character is a token of its own
+    def encode(self, text):
+        return re.findall(r"\s*\w+|\s*\S|\s+", text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+def count_tokens(text):
+    return len(FakeTokenizer().encode(text))
+
+
+def test_embed_documents_in_concurrent_batches(fake_server):
+    embeddings = RemoteEmbeddings(
+        fake_server.url,
+        max_concurrency=3,
+        max_batch_tokens=4,
+        tokenizer=FakeTokenizer(),
+    )
+    texts = [" ".join(["token"] * (i % 3 + 1)) for i in range(12)]
+
+    result = embeddings.embed_documents(texts)
+
+    assert [embedding[0] for embedding in result] == [
+        float(len(text)) for text in texts
+    ]
+    assert all(
+        sum(count_tokens(text) for text in batch) <= 4 for batch in fake_server.requests
+    )
+    assert sorted(sum(fake_server.requests, [])) == sorted(texts)
+    assert 1 < fake_server.max_in_flight <= 3
+
+
+@pytest.mark.parametrize("fake_server", [2], indirect=True)
+def test_embed_documents_retries_rate_limited_batches(fake_server):
+    embeddings = RemoteEmbeddings(
+        fake_server.url,
+        max_concurrency=2,
+        max_batch_tokens=2,
+        tokenizer=FakeTokenizer(),
+    )
+    texts = ["a b", "c d", "e f"]
+
+    start = time.monotonic()
+    result = embeddings.embed_documents(texts)
+
+    assert time.monotonic() - start >= 0.05
+    assert [embedding[0] for embedding in result] == [3.0, 3.0, 3.0]
+    # the two rate limited requests are sent again, successful ones are not
+    assert len(fake_server.requests) == 5
+    assert sorted(map(tuple, fake_server.requests[2:])) == [
+        ("a b",),
+        ("c d",),
+        ("e f",),
+    ]
+
+
+@pytest.mark.parametrize("fake_server", [10], indirect=True)
+def test_embed_documents_gives_up_after_max_retries(fake_server):
+    embeddings = RemoteEmbeddings(
+        fake_server.url, max_retries=1, tokenizer=FakeTokenizer()
+    )
+
+    with pytest.raises(urllib.error.HTTPError):
+        embeddings.embed_documents(["a"])
+    assert len(fake_server.requests) == 2
+
+
+def test_embed_documents_truncates_long_inputs_on_tokens(fake_server):
+    embeddings = RemoteEmbeddings(fake_server.url, tokenizer=FakeTokenizer())
+    # dense code first, a cut proportional to the characters would keep too many tokens
+    text = ";" * 8000 + " word" * 8000
+
+    embeddings.embed_documents([text, "short text"])
+
+    [[truncated, short]] = fake_server.requests
+    assert count_tokens(truncated) == EMBEDDINGS_MAX_INPUT_TOKENS
+    assert text.startswith(truncated)
+    assert short == "short text"
+
+
+class FakeSentenceTransformer:
+    max_seq_length = 16
+
+    def __init__(self):
+        self.batches = []
+
+    def tokenizer(self, texts, **kwargs):
+        return {"input_ids": [text.split()[: self.max_seq_length] for text in texts]}
+
+    def encode(self, texts, batch_size, **kwargs):
+        self.batches.append(texts)
+        return np.array(
+            [[float(len(text.split())), float(batch_size)] for text in texts]
+        )
+
+
+def test_local_embeddings_bucket_batches_by_length(mocker):
+    model = FakeSentenceTransformer()
+    mocker.patch("codeqai.embeddings._load_sentence_transformer", return_value=model)
+    embeddings = LocalEmbeddings("model", batch_tokens=8)
+    texts = ["a " * length for length in [1, 8, 2, 1, 4, 2, 40]]
+
+    result = embeddings.embed_documents(texts)
+
+    assert [embedding[0] for embedding in result] == [1, 8, 2, 1, 4, 2, 40]
+    # longest texts first, the batch size shrinks with the padded length
+    assert [[len(text.split()) for text in batch] for batch in model.batches] == [
+        [40],
+        [8],
+        [4, 2],
+        [2, 1, 1],
+    ]
+    assert embeddings.chunks == len(texts)
+    assert embeddings.chunks_per_second > 0
+
+
+def test_local_embeddings_embed_queries(mocker):
+    model = FakeSentenceTransformer()
+    mocker.patch("codeqai.embeddings._load_sentence_transformer", return_value=model)
+    embeddings = LocalEmbeddings("model", workers=2, batch_tokens=8)
+
+    result = embeddings.embed_queries(["a b", "a\nb c"])
+
+    # queries are encoded as one batch in the current process and not counted as embedded documents
+    assert [embedding[0] for embedding in result] == [2, 3]
+    assert model.batches == [["a b", "a b c"]]
+    assert embeddings.pool is None
+    assert embeddings.chunks == 0
+    assert embeddings.embed_queries([]) == []
+
+
+def test_azure_openai_embeddings(monkeypatch, mocker):
+    mocker.patch("codeqai.embeddings.EmbeddingCache")
+    monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://example.openai.azure.com/")
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY", "azure-key")
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.setenv("OPENAI_API_VERSION", "2024-02-01")
+
+    embeddings = Embeddings(EmbeddingsModel.AZURE_OPENAI, deployment="ada")
+
+    assert embeddings.engine.url == (
+        "https://example.openai.azure.com/openai/deployments/ada/embeddings"
+        + "?api-version=2024-02-01"
+    )
+    assert embeddings.engine.headers == {"api-key": "azure-key"}
+    # vectors of the langchain client, which averaged long inputs, are not taken from the cache
+    assert embeddings.model_id == f"{EmbeddingsModel.AZURE_OPENAI.value}/ada/truncated"
+
+
+def test_close_local_embeddings_workers(mocker):
+    mocker.patch("codeqai.embeddings.Embeddings._install_sentence_transformers")
+    mocker.patch(
+        "codeqai.embeddings._load_sentence_transformer",
+        return_value=FakeSentenceTransformer(),
+    )
+    pool = mocker.patch(
+        "codeqai.embeddings.multiprocessing.get_context"
+    ).return_value.Pool.return_value
+    pool.imap.side_effect = lambda function, batches: [
+        [[0.0, 0.0] for _ in batch] for batch in batches
+    ]
+    mocker.patch("codeqai.embeddings.EmbeddingCache")
+    embeddings = Embeddings(
+        EmbeddingsModel.SENTENCETRANSFORMERS_ALL_MINILM_L6_V2, workers=2
+    )
+    embeddings.engine.batch_tokens = 8
+
+    embeddings.engine.embed_documents(["a " * 8, "b " * 8])
+    assert embeddings.engine.pool is pool
+    embeddings.close()
+
+    pool.terminate.assert_called_once()
+    assert embeddings.engine.pool is None
@@ -0,0 +1,39 @@
+import subprocess
+
+import pytest
+
+
+def git(cwd, *args):
+    return subprocess.run(
+        ["git", *args], cwd=cwd, stdout=subprocess.PIPE, text=True, check=True
+    ).stdout.strip()
+
+
+@pytest.fixture
+def git_repo(tmp_path, monkeypatch):
+    git(tmp_path, "init", "-q")
+    git(tmp_path, "config", "user.email", "test@codeqai")
+    git(tmp_path, "config", "user.name", "codeqai")
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "main.py").write_text("def main():\n    pass\n")
+    (tmp_path / "utils.py").write_text("def util():\n    pass\n")
+    git(tmp_path, "add", ".")
+    git(tmp_path, "commit", "-q", "-m", "initial")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def git_repo_with_merge(git_repo):
+    """
+    A git repository whose src/main.py was changed on a branch merged into the checked out branch,
+    while utils.py was changed on the checked out branch before the merge.
+    """
+    git(git_repo, "checkout", "-q", "-b", "feature")
+    (git_repo / "src" / "main.py").write_text("def main():\n    return 1\n")
+    git(git_repo, "commit", "-q", "-am", "update main")
+    git(git_repo, "checkout", "-q", "-")
+    (git_repo / "utils.py").write_text("def util():\n    return 1\n")
+    git(git_repo, "commit", "-q", "-am", "update utils")
+    git(git_repo, "merge", "-q", "--no-ff", "-m", "merge feature", "feature")
+    return git_repo
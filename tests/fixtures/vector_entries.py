@@ -96,15 +96,18 @@ def vector_cache():
             filename="test.py",
             vector_ids=[],
             commit_hash="1234567890",
+            path="test.py",
         ),
         "another_test.py": VectorCache(
             filename="another_test.py",
             vector_ids=[],
             commit_hash="1234567891",
+            path="another_test.py",
         ),
         "fixed_test.py": VectorCache(
             filename="fixed_test.py",
             vector_ids=[],
             commit_hash="1234567891",
+            path="fixed_test.py",
         ),
     }
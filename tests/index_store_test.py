@@ -0,0 +1,352 @@
+import os
+import subprocess
+import sys
+
+import faiss
+import numpy as np
+import pytest
+from langchain.schema import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores.faiss import FAISS
+from langchain_core.embeddings import FakeEmbeddings
+
+from codeqai import index_store
+from codeqai.docstore import SQLiteDocstore
+
+
+@pytest.fixture
+def cache_path(tmp_path, mocker):
+    mocker.patch("codeqai.index_store.get_cache_path", return_value=str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.usefixtures("vector_entries")
+def test_save_and_load_index(cache_path, vector_entries):
+    embeddings = FakeEmbeddings(size=32)
+    db = FAISS.from_documents(vector_entries, embeddings)
+    index_store.save_index(db, "test")
+    assert index_store.index_exists("test")
+
+    loaded_db = index_store.load_index("test", embeddings)
+
+    assert isinstance(loaded_db.index_to_docstore_id, index_store.SegmentedIds)
+    assert dict(loaded_db.index_to_docstore_id) == db.index_to_docstore_id
+    assert isinstance(loaded_db.docstore, SQLiteDocstore)
+    vector = db.index.reconstruct(2)
+    assert loaded_db.similarity_search_by_vector(vector, k=1) == [vector_entries[2]]
+
+
+@pytest.mark.skipif(
+    not os.path.exists("/proc/self/status"), reason="needs the memory usage of /proc"
+)
+def test_load_index_memory_maps_segments(cache_path):
+    vectors = np.random.rand(32768, 256).astype(np.float32)
+    index = faiss.IndexFlatL2(256)
+    index.add(vectors)
+    db = FAISS(
+        FakeEmbeddings(size=256),
+        index,
+        InMemoryDocstore(),
+        {i: str(i) for i in range(len(vectors))},
+    )
+    index_store.save_index(db, "test", index_type="flat")
+    index_dir = index_store.get_index_dir("test")
+
+    # loaded in a new process, which cannot reuse memory freed by this one
+    code = (
+        "from codeqai import index_store\n"
+        + "import faiss\n"
+        + "def anonymous_memory():\n"
+        + "    with open('/proc/self/status') as status:\n"
+        + "        return next(int(line.split()[1]) for line in status if line.startswith('RssAnon:'))\n"
+        + "before = anonymous_memory()\n"
+        + f"index = index_store._load_segmented_index({index_dir!r}, index_store._load_manifest({index_dir!r}))\n"
+        + "print(anonymous_memory() - before)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+
+    # the 32 MiB of vectors are not copied into anonymous memory
+    assert int(result.stdout) < 8 * 1024
+
+
+@pytest.mark.usefixtures("vector_entries")
+def test_save_changes_as_segments(cache_path, vector_entries):
+    embeddings = FakeEmbeddings(size=32)
+    index_store.save_index(FAISS.from_documents(vector_entries, embeddings), "test")
+    db = index_store.load_index("test", embeddings)
+    index_dir = index_store.get_index_dir("test")
+    base_size = os.path.getsize(os.path.join(index_dir, "base-1.faiss"))
+
+    deleted_vector = db.index.reconstruct(1)
+    db.delete([db.index_to_docstore_id[1]])
+    new_ids = db.add_documents([Document(page_content="new", metadata={})])
+    index_store.save_index(db, "test")
+
+    # the base segment is not written again
+    assert os.path.getsize(os.path.join(index_dir, "base-1.faiss")) == base_size
+    assert os.path.exists(os.path.join(index_dir, "segment-1-1.faiss"))
+    assert os.path.getsize(os.path.join(index_dir, "tombstones-1.bin")) == 8
+
+    db = index_store.load_index("test", embeddings)
+    assert len(db.index_to_docstore_id) == 4
+    assert db.index_to_docstore_id[4] == new_ids[0]
+    assert 1 not in db.index_to_docstore_id
+    assert vector_entries[1] not in db.similarity_search_by_vector(deleted_vector, k=4)
+
+    index_store.compact_index(db, "test")
+
+    assert sorted(os.listdir(index_dir)) == [
+        "base-2.faiss",
+        "base-2.ids.npy",
+        os.path.basename(db.docstore.path),
+        "manifest.json",
+    ]
+    assert len(db.index.segments) == 1
+    assert db.index.ntotal == 4
+    assert db.index_to_docstore_id[3] == new_ids[0]
+    assert index_store.load_index("test", embeddings).index.ntotal == 4
+
+
+@pytest.mark.usefixtures("vector_entries")
+def test_delete_by_stored_positions(cache_path, vector_entries, mocker):
+    embeddings = FakeEmbeddings(size=32)
+    index_store.save_index(FAISS.from_documents(vector_entries, embeddings), "test")
+    db = index_store.load_index("test", embeddings)
+    # deleting must not scan the positions of the index
+    mocker.patch.object(
+        index_store.SegmentedIds, "__iter__", side_effect=AssertionError
+    )
+    new_ids = db.add_documents([Document(page_content="new", metadata={})])
+
+    db.delete([db.index_to_docstore_id[2], new_ids[0]])
+
+    assert db.index.deleted == {2, 4}
+    with pytest.raises(ValueError):
+        db.delete([db.index_to_docstore_id[0], new_ids[0]])
+    index_store.save_index(db, "test")
+    index_store.compact_index(db, "test")
+    assert db.docstore.get_positions([db.index_to_docstore_id[2]]) == {
+        db.index_to_docstore_id[2]: 2
+    }
+
+
+@pytest.mark.usefixtures("vector_entries")
+def test_load_index_repairs_positions(cache_path, vector_entries):
+    embeddings = FakeEmbeddings(size=32)
+    db = FAISS.from_documents(vector_entries, embeddings)
+    index_store.save_index(db, "test")
+    loaded_db = index_store.load_index("test", embeddings)
+    # positions of another generation, e.g. from an interrupted compaction
+    loaded_db.docstore.set_positions(["x"], 0)
+    loaded_db.docstore.commit()
+
+    loaded_db = index_store.load_index("test", embeddings)
+
+    assert loaded_db.docstore.get_positions(list(db.index_to_docstore_id.values())) == {
+        _id: position for position, _id in db.index_to_docstore_id.items()
+    }
+
+
+def test_segmented_index_search():
+    rng = np.random.default_rng(0)
+    vectors = rng.random((30, 8), dtype=np.float32)
+    queries = rng.random((5, 8), dtype=np.float32)
+    deleted = {3, 11, 12, 25}
+    segments = []
+    for start in range(0, 30, 10):
+        segment = faiss.IndexFlatL2(8)
+        segment.add(vectors[start : start + 10])
+        segments.append(segment)
+    index = index_store.SegmentedIndex(segments, [[]] * 3, deleted)
+
+    distances, positions = index.search(queries, 6)
+
+    live = np.array(sorted(set(range(30)) - deleted))
+    expected = faiss.IndexFlatL2(8)
+    expected.add(vectors[live])
+    expected_distances, expected_positions = expected.search(queries, 6)
+    assert (positions == live[expected_positions]).all()
+    assert np.allclose(distances, expected_distances)
+    # fewer vectors than requested are padded
+    assert (index.search(queries, 40)[1][:, 26:] == -1).all()
+
+
+@pytest.mark.usefixtures("vector_entries")
+def test_load_legacy_index(cache_path, vector_entries):
+    embeddings = FakeEmbeddings(size=32)
+    db = FAISS.from_documents(vector_entries, embeddings)
+    legacy_index_path = os.path.join(cache_path, "test.faiss.bytes")
+    with open(legacy_index_path, "wb") as file:
+        file.write(db.serialize_to_bytes())
+    assert index_store.index_exists("test")
+
+    loaded_db = index_store.load_index("test", embeddings)
+
+    assert not os.path.exists(legacy_index_path)
+    assert os.path.exists(
+        os.path.join(cache_path, "test.index", index_store.MANIFEST_FILE)
+    )
+    assert dict(loaded_db.index_to_docstore_id) == db.index_to_docstore_id
+    for docstore_id, document in db.docstore._dict.items():
+        assert loaded_db.docstore.search(docstore_id) == document
+
+
+def test_resolve_index_type():
+    assert index_store.resolve_index_type("auto", 5000) == "flat"
+    assert index_store.resolve_index_type("ivf", 5000) == "flat"
+    assert index_store.resolve_index_type("auto", 100000) == "hnsw"
+    assert index_store.resolve_index_type("auto", 1000000) == "ivf"
+    assert index_store.resolve_index_type("auto", 3000000) == "ivfpq"
+    assert index_store.resolve_index_type("ivfpq", 50000) == "ivfpq"
+    with pytest.raises(ValueError):
+        index_store.resolve_index_type("lsh", 50000)
+
+
+@pytest.mark.parametrize(
+    "index_type, min_recall",
+    [("hnsw", 0.9), ("ivf", 0.9), ("ivfpq", 0.3)],
+)
+def test_build_index(index_type, min_recall):
+    rng = np.random.default_rng(0)
+    # clustered vectors, like embeddings of similar code
+    centers = rng.random((50, 32), dtype=np.float32)
+    vectors = (
+        centers[rng.integers(0, 50, 12000)]
+        + rng.normal(0, 0.05, (12000, 32)).astype(np.float32)
+    ).astype(np.float32)
+    queries = vectors[rng.integers(0, 12000, 20)] + 0.01
+
+    index = index_store.build_index(
+        lambda: (vectors[i : i + 5000] for i in range(0, 12000, 5000)),
+        12000,
+        32,
+        faiss.METRIC_L2,
+        index_type,
+    )
+    segmented_index = index_store.SegmentedIndex(
+        [index], [[]], {0, 1, 2}, nprobe=32, ef_search=64
+    )
+    _, positions = segmented_index.search(queries, 10)
+
+    exact = faiss.IndexFlatL2(32)
+    exact.add(vectors)
+    _, expected_positions = exact.search(queries, 13)
+    recall = np.mean(
+        [
+            len(set(found) & set(expected[expected > 2][:10])) / 10
+            for found, expected in zip(positions, expected_positions)
+        ]
+    )
+    assert recall >= min_recall
+    assert not np.isin(positions, [0, 1, 2]).any()
+    assert np.allclose(index.reconstruct(5), vectors[5], atol=0.1)
+
+
+@pytest.mark.usefixtures("vector_entries")
+def test_save_index_with_index_type(cache_path, vector_entries, mocker):
+    mocker.patch("codeqai.index_store.ANN_MIN_VECTORS", 1)
+    embeddings = FakeEmbeddings(size=32)
+    db = FAISS.from_documents(vector_entries, embeddings)
+    index_store.save_index(db, "test", index_type="ivf")
+
+    loaded_db = index_store.load_index("test", embeddings, nprobe=4)
+
+    assert isinstance(loaded_db.index.segments[0], faiss.IndexIVFFlat)
+    vector = db.index.reconstruct(2)
+    assert loaded_db.similarity_search_by_vector(vector, k=1) == [vector_entries[2]]
+    assert loaded_db.max_marginal_relevance_search_by_vector(vector, k=2, fetch_k=4)
+
+    loaded_db.delete([loaded_db.index_to_docstore_id[0]])
+    index_store.save_index(loaded_db, "test", index_type="ivf")
+    index_store.compact_index(loaded_db, "test", index_type="hnsw")
+    assert isinstance(loaded_db.index.segments[0], faiss.IndexHNSWFlat)
+    assert loaded_db.index.nprobe == 4
+    assert len(loaded_db.index_to_docstore_id) == 3
+
+
+@pytest.mark.parametrize(
+    "index_type, vector_storage, segment_type",
+    [
+        ("flat", "float16", faiss.IndexScalarQuantizer),
+        ("hnsw", "int8", faiss.IndexHNSWSQ),
+        ("ivf", "int8", faiss.IndexIVFScalarQuantizer),
+    ],
+)
+def test_quantized_vector_storage(index_type, vector_storage, segment_type, mocker):
+    mocker.patch("codeqai.index_store.ANN_MIN_VECTORS", 1)
+    rng = np.random.default_rng(0)
+    centers = rng.random((20, 32), dtype=np.float32)
+    vectors = (
+        centers[rng.integers(0, 20, 4000)]
+        + rng.normal(0, 0.02, (4000, 32)).astype(np.float32)
+    ).astype(np.float32)
+
+    index = index_store.build_index(
+        lambda: iter([vectors]),
+        4000,
+        32,
+        faiss.METRIC_L2,
+        index_type,
+        vector_storage,
+    )
+    segmented_index = index_store.SegmentedIndex(
+        [index], [[]], vectors=[vectors], nprobe=8
+    )
+    recall = index_store.measure_recall(segmented_index, lambda: iter([vectors]))
+
+    assert isinstance(index, segment_type)
+    assert recall["recall"] >= 0.9
+    assert recall["recall"] >= recall["recall_without_rescoring"]
+    # re-scored distances are exact
+    distances, positions = segmented_index.search(vectors[:3], 1)
+    assert (positions[:, 0] == [0, 1, 2]).all()
+    assert np.allclose(distances, 0)
+    assert (segmented_index.reconstruct(7) == vectors[7]).all()
+
+
+@pytest.mark.usefixtures("vector_entries")
+def test_save_index_with_quantized_vectors(cache_path, vector_entries):
+    embeddings = FakeEmbeddings(size=32)
+    db = FAISS.from_documents(vector_entries, embeddings)
+    recall = index_store.save_index(db, "test", vector_storage="int8")
+    index_dir = index_store.get_index_dir("test")
+
+    assert recall["recall"] == 1.0
+    assert os.path.exists(os.path.join(index_dir, "base-1.vectors.npy"))
+    loaded_db = index_store.load_index("test", embeddings)
+    assert isinstance(loaded_db.index.segments[0], faiss.IndexScalarQuantizer)
+    vector = db.index.reconstruct(2)
+    assert loaded_db.similarity_search_by_vector(vector, k=1) == [vector_entries[2]]
+    assert (loaded_db.index.reconstruct(2) == vector).all()
+
+    loaded_db.delete([loaded_db.index_to_docstore_id[0]])
+    index_store.save_index(loaded_db, "test")
+    index_store.compact_index(loaded_db, "test", vector_storage="float16")
+    assert isinstance(loaded_db.index.segments[0], faiss.IndexScalarQuantizer)
+    assert (loaded_db.index.reconstruct(1) == vector).all()
+    with pytest.raises(ValueError):
+        index_store.save_index(db, "test", vector_storage="int4")
+
+
+@pytest.mark.usefixtures("vector_entries")
+def test_compact_emptied_index_with_quantized_vectors(cache_path, vector_entries):
+    embeddings = FakeEmbeddings(size=32)
+    db = FAISS.from_documents(vector_entries, embeddings)
+    index_store.save_index(db, "test", vector_storage="int8")
+    loaded_db = index_store.load_index("test", embeddings)
+
+    loaded_db.delete(list(loaded_db.index_to_docstore_id.values()))
+    index_store.save_index(loaded_db, "test")
+    recall = index_store.compact_index(loaded_db, "test", vector_storage="int8")
+
+    assert recall is None
+    assert loaded_db.index.ntotal == 0
+    loaded_db = index_store.load_index("test", embeddings)
+    assert loaded_db.similarity_search_by_vector(db.index.reconstruct(0), k=1) == []
+    new_ids = loaded_db.add_documents([Document(page_content="new", metadata={})])
+    assert loaded_db.similarity_search("new", k=1)[0].page_content == "new"
+    index_store.save_index(loaded_db, "test")
+    index_store.compact_index(loaded_db, "test", vector_storage="int8")
+    assert list(loaded_db.index_to_docstore_id.values()) == new_ids
@@ -0,0 +1,44 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from codeqai import onnx_embeddings
+
+
+def test_min_cosine_similarity():
+    expected = np.array([[1.0, 0.0], [0.0, 2.0]])
+    actual = np.array([[2.0, 0.0], [1.0, 1.0]])
+
+    assert onnx_embeddings.min_cosine_similarity(expected, actual) == pytest.approx(
+        1 / np.sqrt(2)
+    )
+    assert onnx_embeddings.min_cosine_similarity(expected, expected) == pytest.approx(
+        1.0
+    )
+
+
+def test_load_onnx_model_exports_once(tmp_path, mocker):
+    mocker.patch("codeqai.onnx_embeddings.get_cache_path", return_value=str(tmp_path))
+
+    def export_onnx_model(model_name, export_dir):
+        os.makedirs(export_dir)
+        with open(os.path.join(export_dir, "metadata.json"), "w") as metadata_file:
+            json.dump(
+                {"model_file": "model-int8.onnx", "max_seq_length": 384}, metadata_file
+            )
+
+    export = mocker.patch(
+        "codeqai.onnx_embeddings.export_onnx_model", side_effect=export_onnx_model
+    )
+    onnx_model = mocker.patch("codeqai.onnx_embeddings.OnnxSentenceTransformer")
+
+    onnx_embeddings.load_onnx_model("sentence-transformers/all-mpnet-base-v2", 2)
+    onnx_embeddings.load_onnx_model("sentence-transformers/all-mpnet-base-v2", 2)
+
+    export_dir = str(tmp_path / "onnx" / "sentence-transformers--all-mpnet-base-v2")
+    export.assert_called_once_with(
+        "sentence-transformers/all-mpnet-base-v2", export_dir
+    )
+    onnx_model.assert_called_with(export_dir, "model-int8.onnx", 384, 2)
@@ -0,0 +1,117 @@
+import os
+
+from codeqai import repo
+from tests.fixtures.git_repo import git
+
+
+def test_get_commit_hashes(git_repo):
+    initial_commit = git(git_repo, "rev-parse", "HEAD")
+    (git_repo / "utils.py").write_text("def util():\n    return 1\n")
+    git(git_repo, "commit", "-q", "-am", "update utils")
+    latest_commit = git(git_repo, "rev-parse", "HEAD")
+    (git_repo / "untracked.py").write_text("def untracked():\n    pass\n")
+
+    files = [
+        os.path.join(git_repo, "src", "main.py"),
+        os.path.join(git_repo, "utils.py"),
+        os.path.join(git_repo, "untracked.py"),
+    ]
+    commit_hashes = repo.get_commit_hashes(files)
+
+    assert commit_hashes == {
+        files[0]: initial_commit,
+        files[1]: latest_commit,
+        files[2]: "",
+    }
+    for file in files[:2]:
+        assert commit_hashes[file] == repo.get_commit_hash(file)
+
+
+def test_get_commit_hashes_with_merge(git_repo_with_merge):
+    utils_commit = git(git_repo_with_merge, "rev-parse", "HEAD^1")
+    merge_commit = git(git_repo_with_merge, "rev-parse", "HEAD")
+    files = [
+        os.path.join(git_repo_with_merge, "src", "main.py"),
+        os.path.join(git_repo_with_merge, "utils.py"),
+    ]
+
+    # the file changed on the merged branch is resolved to the merge commit
+    assert repo.get_commit_hashes(files) == {
+        files[0]: merge_commit,
+        files[1]: utils_commit,
+    }
+
+
+def test_plan_files(git_repo):
+    (git_repo / ".gitignore").write_text("generated/\n")
+    for directory in ["generated", "node_modules", "build", "environment"]:
+        (git_repo / directory).mkdir()
+        (git_repo / directory / "module.py").write_text("x = 1\n")
+    (git_repo / "src" / "new.py").write_text("def new():\n    pass\n")
+    (git_repo / "src" / "__init__.py").write_text("")
+    (git_repo / "README.txt").write_text("readme")
+
+    planned_files = {
+        repo_file.relative_path: repo_file for repo_file in repo.plan_files()
+    }
+
+    assert set(planned_files) == {
+        "src/main.py",
+        "src/new.py",
+        "utils.py",
+        "environment/module.py",
+    }
+    assert planned_files["utils.py"].path == os.path.join(git_repo, "utils.py")
+    assert planned_files["utils.py"].size == len("def util():\n    pass\n")
+    assert planned_files["utils.py"].mode == repo.GIT_MODE_REGULAR
+
+    tracked_files = {
+        repo_file.relative_path
+        for repo_file in repo.plan_files(include_untracked=False)
+    }
+    assert tracked_files == {"src/main.py", "utils.py"}
+
+
+def test_get_blob_ids(git_repo):
+    main_file = os.path.join(git_repo, "src", "main.py")
+    utils_file = os.path.join(git_repo, "utils.py")
+    untracked_file = os.path.join(git_repo, "untracked.py")
+    (git_repo / "utils.py").write_text("def util():\n    return 1\n")
+    (git_repo / "untracked.py").write_text("def main():\n    pass\n")
+
+    blob_ids = repo.get_blob_ids([main_file, utils_file, untracked_file])
+
+    assert blob_ids[main_file] == git(git_repo, "rev-parse", "HEAD:src/main.py")
+    assert blob_ids[utils_file] == git(git_repo, "hash-object", "utils.py")
+    assert blob_ids[utils_file] != git(git_repo, "rev-parse", "HEAD:utils.py")
+    # equal content maps to the same blob id
+    assert blob_ids[untracked_file] == blob_ids[main_file]
+
+
+def test_get_changed_files(git_repo):
+    (git_repo / "dirty.py").write_text("def dirty():\n    pass\n")
+    git(git_repo, "add", ".")
+    git(git_repo, "commit", "-q", "-m", "add dirty")
+    (git_repo / "dirty.py").write_text("def dirty():\n    return 1\n")
+    revision = repo.get_head_revision()
+    dirty_files = repo.get_dirty_files()
+    assert dirty_files == ["dirty.py"]
+
+    # dirty.py is reverted, utils.py modified, main.py renamed and new.py added
+    git(git_repo, "checkout", "dirty.py")
+    (git_repo / "utils.py").write_text("def util():\n    return 1\n")
+    git(git_repo, "mv", "src/main.py", "src/app.py")
+    git(git_repo, "commit", "-q", "-am", "rename main")
+    (git_repo / "new.py").write_text("def new():\n    pass\n")
+    (git_repo / "notes.txt").write_text("notes")
+
+    changed_files, deleted_files = repo.get_changed_files(revision, dirty_files)
+
+    assert sorted(changed_files) == [
+        os.path.join(git_repo, "dirty.py"),
+        os.path.join(git_repo, "new.py"),
+        os.path.join(git_repo, "src", "app.py"),
+        os.path.join(git_repo, "utils.py"),
+    ]
+    assert deleted_files == [os.path.join(git_repo, "src", "main.py")]
+    assert repo.get_changed_files("0" * 40) is None
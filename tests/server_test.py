@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+
+import pytest
+from langchain.schema import Document
+
+from codeqai import server
+
+
+@pytest.fixture
+def codeqai_server(tmp_path, mocker):
+    (tmp_path / "manifest.json").write_text("{}")
+    mocker.patch("codeqai.server.get_cache_path", return_value=str(tmp_path))
+    mocker.patch("codeqai.index_store.get_index_dir", return_value=str(tmp_path))
+
+    def create_vector_store():
+        vector_store = mocker.Mock()
+        vector_store.similarity_search_with_score.return_value = [
+            (
+                Document(
+                    page_content="def main():\n    pass",
+                    metadata={"filename": "main.py", "path": "src/main.py"},
+                ),
+                0.5,
+            )
+        ]
+        vector_store.similarity_search_batch.side_effect = lambda queries, k: [
+            vector_store.similarity_search_with_score.return_value for _ in queries
+        ]
+        vector_store.get_file_path.return_value = "/repo/src/main.py"
+        return vector_store
+
+    vector_store = create_vector_store()
+    mocker.patch("codeqai.server.copy").copy.side_effect = (
+        lambda _: create_vector_store()
+    )
+    histories = []
+
+    def create_qa_chain(vector_store, memory):
+        if memory is None:
+            memory = []
+            histories.append(memory)
+        return memory, lambda question: memory.append(question) or {
+            "answer": f"{len(memory)}: {question}"
+        }
+
+    codeqai_server = server.CodeQAIServer("test", vector_store, create_qa_chain)
+    thread = threading.Thread(target=codeqai_server.serve)
+    thread.start()
+    for _ in range(100):
+        if (tmp_path / "test.server.json").exists():
+            break
+        time.sleep(0.01)
+    yield codeqai_server, vector_store, histories, thread
+    codeqai_server.httpd.shutdown()
+    thread.join()
+
+
+def test_server(codeqai_server, tmp_path):
+    codeqai_server, vector_store, histories, thread = codeqai_server
+    assert server.connect_server("other") is None
+    client = server.connect_server("test")
+    assert client is not None
+
+    [(document, file_path, score)] = client.search("main", k=2)
+    assert document.page_content == "def main():\n    pass"
+    assert document.metadata == {"filename": "main.py", "path": "src/main.py"}
+    assert file_path == "/repo/src/main.py"
+    assert score == 0.5
+    vector_store.similarity_search_with_score.assert_called_once_with("main", k=2)
+    [[(document, file_path, score)], [_]] = client.search_batch(["main", "run"])
+    assert document.page_content == "def main():\n    pass"
+    assert (file_path, score) == ("/repo/src/main.py", 0.5)
+    assert client.chat("first") == "1: first"
+    assert client.chat("second") == "2: second"
+    # every client has its own chat history
+    other_client = server.connect_server("test")
+    assert other_client.chat("other") == "1: other"
+    client.reset_chat()
+    assert client.chat("third") == "1: third"
+    assert len(histories) == 3
+
+    vector_store.load_documents.assert_not_called()
+    manifest_stat = os.stat(tmp_path / "manifest.json")
+    (tmp_path / "manifest.json").write_text('{"generation": 2}')
+    # a manifest replaced within the same modification time is picked up as well
+    os.utime(
+        tmp_path / "manifest.json",
+        ns=(manifest_stat.st_atime_ns, manifest_stat.st_mtime_ns),
+    )
+    client.search("main")
+    # the vector store is loaded into a copy, which replaces the one of running requests
+    assert codeqai_server.vector_store is not vector_store
+    codeqai_server.vector_store.load_documents.assert_called_once()
+    vector_store.close.assert_called_once()
+    client.search("main")
+    codeqai_server.vector_store.load_documents.assert_called_once()
+    codeqai_server.vector_store.close.assert_not_called()
+
+    codeqai_server.httpd.shutdown()
+    thread.join()
+    assert not (tmp_path / "test.server.json").exists()
+
+
+def test_server_closes_replaced_vector_store_after_requests(codeqai_server, tmp_path):
+    codeqai_server, _, _, _ = codeqai_server
+    with codeqai_server._use_vector_store() as vector_store:
+        (tmp_path / "manifest.json").write_text('{"generation": 2}')
+        with codeqai_server._use_vector_store() as new_vector_store:
+            assert new_vector_store is not vector_store
+        # the replaced vector store is still used by the first request
+        vector_store.close.assert_not_called()
+    vector_store.close.assert_called_once()
+    new_vector_store.close.assert_not_called()
+    assert codeqai_server.vector_store_users == {}
+
+
+def test_server_keeps_server_file_of_other_server(codeqai_server, tmp_path):
+    codeqai_server, _, _, thread = codeqai_server
+    server_file = tmp_path / "test.server.json"
+    server_file.write_text('{"url": "http://127.0.0.1:1", "token": "x", "pid": 1}')
+    codeqai_server.httpd.shutdown()
+    thread.join()
+    assert server_file.exists()
+
+
+def test_connect_server_without_server(tmp_path, mocker):
+    mocker.patch("codeqai.server.get_cache_path", return_value=str(tmp_path))
+    (tmp_path / "test.server.json").write_text(
+        '{"url": "http://127.0.0.1:1", "token": "x", "pid": 1}'
+    )
+
+    assert server.connect_server("test") is None
@@ -0,0 +1,60 @@
+import subprocess
+import sys
+
+# cumulative import time of the CLI module, measured without interpreter startup
+STARTUP_BUDGET_SECONDS = 1.5
+HEAVY_MODULES = [
+    "streamlit",
+    "langchain",
+    "langchain_core",
+    "langchain_community",
+    "openai",
+    "anthropic",
+    "faiss",
+    "numpy",
+    "torch",
+    "sentence_transformers",
+    "tree_sitter_languages",
+]
+
+
+def import_modules(code):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # every line is "import time: self [us] | cumulative [us] | module"
+    modules = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, module = line.split("|")
+            if cumulative.strip().isdigit():
+                modules[module.strip()] = int(cumulative) / 1e6
+    return modules, result.stdout
+
+
+def test_app_startup_budget():
+    modules, _ = import_modules("import codeqai.app")
+
+    assert modules["codeqai.app"] < STARTUP_BUDGET_SECONDS
+    assert not [module for module in HEAVY_MODULES if module in modules]
+
+
+def test_treesitter_languages_are_imported_on_first_use():
+    _, stdout = import_modules(
+        "import sys\n"
+        + "from codeqai.constants import Language\n"
+        + "from codeqai.treesitter import Treesitter\n"
+        + "Treesitter.create_treesitter(Language.PYTHON)\n"
+        + "print(sorted(m for m in sys.modules if m.startswith('codeqai.treesitter.')))"
+    )
+
+    assert stdout.strip() == str(
+        [
+            "codeqai.treesitter.treesitter",
+            "codeqai.treesitter.treesitter_py",
+            "codeqai.treesitter.treesitter_registry",
+        ]
+    )
@@ -0,0 +1,56 @@
+from codeqai.constants import Language
+from codeqai.treesitter import Treesitter
+
+PYTHON_SOURCE = b'''def outer():
+    def inner():
+        """Inner docstring."""
+
+    return inner
+
+
+class Service:
+    def run(self):
+        """Run the service."""
+        return outer()
+'''
+
+RUST_SOURCE = b"""// Adds two numbers.
+// Returns the sum.
+fn add(a: i32, b: i32) -> i32 {
+    fn helper() {}
+    a + b
+}
+
+fn no_doc() {}
+"""
+
+C_SOURCE = b"""/* allocates a buffer */
+char *alloc(int size) {
+    return 0;
+}
+"""
+
+
+def parse(language, source):
+    return [
+        (method.name, method.doc_comment)
+        for method in Treesitter.get_treesitter(language).parse(source)
+    ]
+
+
+def test_parse_python():
+    assert parse(Language.PYTHON, PYTHON_SOURCE) == [
+        ("outer", None),
+        ("run", '"""Run the service."""'),
+    ]
+
+
+def test_parse_rust():
+    assert parse(Language.RUST, RUST_SOURCE) == [
+        ("add", "// Adds two numbers.\n// Returns the sum."),
+        ("no_doc", None),
+    ]
+
+
+def test_parse_c():
+    assert parse(Language.C, C_SOURCE) == [("alloc", "/* allocates a buffer */")]
@@ -1,10 +1,19 @@
+import sqlite3
 from pathlib import Path
 
 import pytest
 from langchain.schema import Document
-from langchain_core.embeddings import FakeEmbeddings
+from langchain_core.embeddings import DeterministicFakeEmbedding, FakeEmbeddings
 
-from codeqai.cache import get_cache_path
+from codeqai.cache import (
+    VectorCache,
+    get_cache_path,
+    load_sync_state,
+    load_vector_cache,
+    save_vector_cache,
+)
+from codeqai.embedding_cache import CachedEmbeddings, EmbeddingCache
+from codeqai.repo import RepoFile
 from codeqai.vector_store import VectorStore
 
 
@@ -33,6 +42,108 @@ def test_index_documents(vector_entries):
         == vector_entries[3]
     )
 
+    docstore = vector_store.db.docstore
+    vector_store.close()
+    assert vector_store.db is None
+    with pytest.raises(sqlite3.ProgrammingError):
+        len(docstore)
+
+
+@pytest.mark.usefixtures("vector_entries")
+def test_similarity_search_batch(vector_entries, tmp_path, mocker):
+    Path(get_cache_path()).mkdir(parents=True, exist_ok=True)
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+    vector_store = VectorStore(
+        name="test",
+        embeddings=CachedEmbeddings(
+            DeterministicFakeEmbedding(size=32), "model", cache
+        ),
+    )
+    vector_store.index_documents(vector_entries)
+    cached_rows = cache.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+    embed_documents = mocker.spy(DeterministicFakeEmbedding, "embed_documents")
+    embed_query = mocker.spy(DeterministicFakeEmbedding, "embed_query")
+
+    queries = [document.page_content for document in vector_entries[:3]]
+    results = vector_store.similarity_search_batch(queries + ["unrelated query"], k=2)
+
+    # a model without embed_queries embeds every query as query, bypassing the embedding cache
+    embed_documents.assert_not_called()
+    assert [call.args[1] for call in embed_query.call_args_list] == queries + [
+        "unrelated query"
+    ]
+    assert (
+        cache.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        == cached_rows
+    )
+    assert [len(query_results) for query_results in results] == [2, 2, 2, 2]
+    assert [query_results[0][0] for query_results in results[:3]] == vector_entries[:3]
+    assert [query_results[0][1] for query_results in results[:3]] == pytest.approx(
+        [0, 0, 0], abs=1e-4
+    )
+    for query, query_results in zip(queries, results):
+        assert query_results == [
+            (document, pytest.approx(score, abs=1e-4))
+            for document, score in vector_store.similarity_search_with_score(query, k=2)
+        ]
+    assert vector_store.similarity_search_batch([]) == []
+
+
+@pytest.mark.usefixtures("vector_entries")
+def test_index_documents_in_batches(vector_entries, mocker):
+    mocker.patch("codeqai.vector_store.EMBEDDING_BATCH_SIZE", 3)
+    Path(get_cache_path()).mkdir(parents=True, exist_ok=True)
+    embeddings = FakeEmbeddings(size=1024)
+    embed_documents = mocker.spy(FakeEmbeddings, "embed_documents")
+    vector_store = VectorStore(name="test", embeddings=embeddings)
+    vector_store.index_documents(document for document in vector_entries)
+
+    assert [len(call.args[1]) for call in embed_documents.call_args_list] == [3, 1]
+    index_to_docstore_id = vector_store.db.index_to_docstore_id
+    assert len(index_to_docstore_id) == 4
+    for i, document in enumerate(vector_entries):
+        assert vector_store.db.docstore.search(index_to_docstore_id[i]) == document
+    assert vector_store.vector_cache["test.py"].vector_ids == [
+        index_to_docstore_id[0],
+        index_to_docstore_id[1],
+    ]
+    assert vector_store.vector_cache["fixed_test.py"].vector_ids == [
+        index_to_docstore_id[3]
+    ]
+
+
+@pytest.mark.usefixtures("vector_entries")
+def test_index_documents_flushes_segments(vector_entries, mocker):
+    mocker.patch("codeqai.vector_store.EMBEDDING_BATCH_SIZE", 1)
+    mocker.patch("codeqai.vector_store.INDEX_FLUSH_BATCHES", 1)
+    Path(get_cache_path()).mkdir(parents=True, exist_ok=True)
+
+    def interrupted_documents():
+        yield from vector_entries[:3]
+        raise RuntimeError("interrupted")
+
+    vector_store = VectorStore(name="test", embeddings=FakeEmbeddings(size=1024))
+    with pytest.raises(RuntimeError):
+        vector_store.index_documents(interrupted_documents())
+
+    # the flushed batches are kept, and the next sync visits all files
+    assert load_sync_state("test.sync.json").revision is None
+    assert list(load_vector_cache("test.json")) == ["test.py", "another_test.py"]
+    vector_store = VectorStore(name="test", embeddings=FakeEmbeddings(size=1024))
+    vector_store.load_documents()
+    assert vector_store.db.index.ntotal == 3
+    assert len(vector_store.db.index.segments) == 3
+
+    vector_store = VectorStore(name="test", embeddings=FakeEmbeddings(size=1024))
+    vector_store.index_documents(document for document in vector_entries)
+    assert len(vector_store.db.index.segments) == 1
+    assert vector_store.db.index.ntotal == 4
+    for i, document in enumerate(vector_entries):
+        assert (
+            vector_store.db.docstore.search(vector_store.db.index_to_docstore_id[i])
+            == document
+        )
+
 
 def mock_get_commit_hash(file):
     if file == "test.py":
@@ -47,8 +158,20 @@ def mock_get_commit_hash(file):
         return "1234567890"
 
 
-def parse_code_files_for_db(files):
-    if files == ["test.py"]:
+def mock_get_commit_hashes(files):
+    return {file: mock_get_commit_hash(file) for file in files}
+
+
+def mock_get_blob_ids(files):
+    return {file: "blob-" + mock_get_commit_hash(file) for file in files}
+
+
+def parse_code_files_for_db(files, commit_hashes=None, blob_ids=None):
+    return [document for file in files for document in parse_code_file_for_db(file)]
+
+
+def parse_code_file_for_db(file):
+    if file == "test.py":
         return [
             Document(
                 page_content="This is a test document.",
@@ -65,7 +188,7 @@ def parse_code_files_for_db(files):
                 },
             ),
         ]
-    elif files == ["new_test.py"]:
+    elif file == "new_test.py":
         return [
             Document(
                 page_content="This is a new test document.",
@@ -75,7 +198,7 @@ def parse_code_files_for_db(files):
                 },
             )
         ]
-    elif files == ["fixed_test.py"]:
+    elif file == "fixed_test.py":
         return [
             Document(
                 page_content="This is another test document.",
@@ -100,8 +223,9 @@ def parse_code_files_for_db(files):
 @pytest.mark.usefixtures("file_names", "vector_entries", "vector_cache")
 def test_sync_documents(file_names, vector_entries, vector_cache, mocker):
     mocker.patch(
-        "codeqai.vector_store.get_commit_hash", side_effect=mock_get_commit_hash
+        "codeqai.vector_store.get_commit_hashes", side_effect=mock_get_commit_hashes
     )
+    mocker.patch("codeqai.vector_store.get_blob_ids", side_effect=mock_get_blob_ids)
     mocker.patch(
         "codeqai.vector_store.parse_code_files_for_db",
         side_effect=parse_code_files_for_db,
@@ -128,3 +252,169 @@ def test_sync_documents(file_names, vector_entries, vector_cache, mocker):
         cache_commit_hash = vector_store.vector_cache[filename].commit_hash
         assert vector_id in cache_vector_ids
         assert commit_hash == cache_commit_hash
+        assert vector_store.vector_cache[filename].blob_id == "blob-" + commit_hash
+
+
+@pytest.mark.usefixtures("file_names", "vector_entries", "vector_cache")
+def test_sync_documents_in_batches(file_names, vector_entries, vector_cache, mocker):
+    mocker.patch("codeqai.vector_store.EMBEDDING_BATCH_SIZE", 2)
+    mocker.patch(
+        "codeqai.vector_store.get_commit_hashes", side_effect=mock_get_commit_hashes
+    )
+    mocker.patch(
+        "codeqai.vector_store.get_blob_ids",
+        side_effect=lambda files: {file: "new-blob" for file in files},
+    )
+    parse_mock = mocker.patch(
+        "codeqai.vector_store.parse_code_files_for_db",
+        side_effect=parse_code_files_for_db,
+    )
+    Path(get_cache_path()).mkdir(parents=True, exist_ok=True)
+    embeddings = FakeEmbeddings(size=1024)
+    vector_store = VectorStore(name="test", embeddings=embeddings)
+    vector_store.index_documents(vector_entries)
+    vector_store.vector_cache = vector_cache
+    for vector_id in vector_store.db.index_to_docstore_id.values():
+        filename = vector_store.db.docstore.search(vector_id).metadata["filename"]
+        vector_store.vector_cache[filename].vector_ids.append(vector_id)
+    embed_documents = mocker.spy(FakeEmbeddings, "embed_documents")
+
+    vector_store.sync_documents(file_names)
+
+    # all changed files are parsed together and their chunks embedded in full batches
+    parse_mock.assert_called_once()
+    assert parse_mock.call_args.args[0] == [
+        "test.py",
+        "modified_test.py",
+        "new_test.py",
+    ]
+    assert [len(call.args[1]) for call in embed_documents.call_args_list] == [2, 2]
+    assert len(vector_store.db.index_to_docstore_id) == 5
+    assert vector_store.changed_paths == {*file_names, "another_test.py"}
+
+
+@pytest.mark.usefixtures("vector_entries", "vector_cache")
+def test_sync_documents_skips_unchanged_content(vector_entries, vector_cache, mocker):
+    mocker.patch(
+        "codeqai.vector_store.get_commit_hashes", side_effect=mock_get_commit_hashes
+    )
+    mocker.patch(
+        "codeqai.vector_store.get_blob_ids",
+        side_effect=lambda files: {file: "unchanged-blob" for file in files},
+    )
+    parse_mock = mocker.patch(
+        "codeqai.vector_store.parse_code_files_for_db",
+        side_effect=parse_code_files_for_db,
+    )
+    Path(get_cache_path()).mkdir(parents=True, exist_ok=True)
+    embeddings = FakeEmbeddings(size=1024)
+    vector_store = VectorStore(name="test", embeddings=embeddings)
+    vector_store.index_documents(vector_entries)
+    vector_store.vector_cache = vector_cache
+    for vector_id in vector_store.db.index_to_docstore_id.values():
+        filename = vector_store.db.docstore.search(vector_id).metadata["filename"]
+        vector_store.vector_cache[filename].vector_ids.append(vector_id)
+        vector_store.vector_cache[filename].blob_id = "unchanged-blob"
+
+    # test.py was touched by a new commit, but its content did not change
+    vector_store.sync_documents(["test.py", "fixed_test.py", "another_test.py"])
+
+    parse_mock.assert_not_called()
+    assert len(vector_store.db.index_to_docstore_id) == 4
+
+
+@pytest.mark.usefixtures("vector_entries", "vector_cache")
+def test_sync_documents_with_changed_files(vector_entries, vector_cache, mocker):
+    mocker.patch(
+        "codeqai.vector_store.get_commit_hashes", side_effect=mock_get_commit_hashes
+    )
+    mocker.patch("codeqai.vector_store.get_blob_ids", side_effect=mock_get_blob_ids)
+    mocker.patch(
+        "codeqai.vector_store.parse_code_files_for_db",
+        side_effect=parse_code_files_for_db,
+    )
+    Path(get_cache_path()).mkdir(parents=True, exist_ok=True)
+    embeddings = FakeEmbeddings(size=1024)
+    vector_store = VectorStore(name="test", embeddings=embeddings)
+    vector_store.index_documents(vector_entries)
+    vector_store.vector_cache = vector_cache
+    for vector_id in vector_store.db.index_to_docstore_id.values():
+        filename = vector_store.db.docstore.search(vector_id).metadata["filename"]
+        vector_store.vector_cache[filename].vector_ids.append(vector_id)
+
+    vector_store.sync_documents(["new_test.py"], deleted_files=["another_test.py"])
+
+    assert set(vector_store.vector_cache) == {"test.py", "fixed_test.py", "new_test.py"}
+    assert len(vector_store.db.index_to_docstore_id) == 4
+    assert vector_store.changed_paths == {"new_test.py", "another_test.py"}
+
+
+@pytest.mark.usefixtures("vector_entries")
+def test_migrate_vector_cache(vector_entries, mocker):
+    mocker.patch(
+        "codeqai.vector_store.plan_files",
+        return_value=[
+            RepoFile("/repo/src/test.py", "src/test.py", 1, "100644"),
+            RepoFile("/repo/a/fixed_test.py", "a/fixed_test.py", 1, "100644"),
+            RepoFile("/repo/b/fixed_test.py", "b/fixed_test.py", 1, "100644"),
+        ],
+    )
+    Path(get_cache_path()).mkdir(parents=True, exist_ok=True)
+    embeddings = FakeEmbeddings(size=1024)
+    vector_store = VectorStore(name="test", embeddings=embeddings)
+    vector_store.index_documents(vector_entries)
+    index_to_docstore_id = vector_store.db.index_to_docstore_id
+    # legacy vector cache keyed by file basename
+    vector_store.vector_cache = {
+        "test.py": VectorCache(
+            "test.py", [index_to_docstore_id[0], index_to_docstore_id[1]], "1"
+        ),
+        "another_test.py": VectorCache(
+            "another_test.py", [index_to_docstore_id[2]], "1"
+        ),
+        "fixed_test.py": VectorCache("fixed_test.py", [index_to_docstore_id[3]], "1"),
+    }
+
+    vector_store.migrate_vector_cache()
+
+    assert list(vector_store.vector_cache) == ["src/test.py"]
+    assert vector_store.vector_cache["src/test.py"].path == "src/test.py"
+    assert len(vector_store.db.index_to_docstore_id) == 2
+    assert vector_store.sync_state is None
+
+
+@pytest.mark.usefixtures("vector_entries")
+def test_migrate_vector_cache_on_sync_only(vector_entries, mocker):
+    plan_files = mocker.patch("codeqai.vector_store.plan_files", return_value=[])
+    Path(get_cache_path()).mkdir(parents=True, exist_ok=True)
+    embeddings = FakeEmbeddings(size=1024)
+    vector_store = VectorStore(name="test", embeddings=embeddings)
+    vector_store.index_documents(vector_entries)
+    index_to_docstore_id = vector_store.db.index_to_docstore_id
+    # legacy vector cache keyed by file basename
+    save_vector_cache(
+        {
+            "test.py": VectorCache(
+                "test.py", [index_to_docstore_id[0], index_to_docstore_id[1]], "1"
+            )
+        },
+        "test.json",
+    )
+
+    # loading for a search leaves the vector store untouched
+    vector_store.load_documents()
+    assert list(vector_store.vector_cache) == ["test.py"]
+    assert len(vector_store.db.index_to_docstore_id) == 4
+    plan_files.assert_not_called()
+
+    mocker.patch("codeqai.vector_store.load_files", return_value=[])
+    mocker.patch("codeqai.vector_store.get_relative_paths", return_value={})
+    mocker.patch("codeqai.vector_store.get_blob_ids", return_value={})
+    mocker.patch("codeqai.vector_store.get_commit_hashes", return_value={})
+    vector_store.sync()
+
+    # the file is not found in the repository anymore, its vectors are deleted and saved
+    plan_files.assert_called_once()
+    assert vector_store.vector_cache == {}
+    vector_store.load_documents()
+    assert len(vector_store.db.index_to_docstore_id) == 2